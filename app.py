@@ -1,34 +1,141 @@
 import os
-from flask import Flask, request
-from flask_cors import CORS
+import asyncio
+import time
 from dotenv import load_dotenv
-import psycopg2
+
+# The modules below read their settings (e.g. KNOWLEDGE_BASE_K, DIRECT_QUESTIONS_MEMORY) when imported, so .env is loaded before them
+load_dotenv()
+
+from flask import Flask, Response, g, request
+from flask_cors import CORS
 import langchain
+from sqlalchemy import text
 from database.database import db
-import openai
+from database.engine import engine_options, get_engine, pool_stats, sqlalchemy_database_uri
 
-from route_handlers.query_handlers import search_direct_questions, search_location_questions, tools
-
-load_dotenv()
+from embeddings.openai import openai_embeddings
+from caches.semantic_cache import query_cache
+from chains.conversational_retrieval_chain_with_memory import has_chat_history
+from lifecycle.lazy import Lazy
+from memory.bounded_history import ensure_schema
+from memory.write_behind import message_writer
+from route_handlers.query_handlers import knowledge_base_embedding_timeout, llm, condense_question_llm, pg_vector_retriever, direct_questions_pipeline, location_questions_pipeline, search_direct_questions, search_location_questions, retrieve_direct_documents, retrieve_direct_documents_lexically, retrieve_location_documents, document_sources, query_place, serve_cached_result
+from route_handlers.query_classifier import classify_query
+from route_handlers.query_router import query_router
+from route_handlers.speculative_search import speculative_search
+from route_handlers.streaming_handlers import format_error_events, stream_search, stream_cached_result, streaming_llm
+from retrievers.location_index import location_index
+from monitoring.collectors import gauges_collector
+from monitoring.metrics import registry, request_duration, stage, timed
+# Imported for its side effect: registers the handler timing the LLM calls and retrievals of every LangChain run
+import monitoring.langchain_callbacks  # noqa: F401
 
 app = Flask(__name__)
 CORS(app)
 
 # Load database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI')
+# Flask-SQLAlchemy is only used to create the tables, request handlers share the pool of database.engine.get_engine()
+app.config['SQLALCHEMY_DATABASE_URI'] = sqlalchemy_database_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = { **engine_options(), "pool_size": 1, "max_overflow": 0 }
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-database_uri = os.getenv('DATABASE_URI')
 
-# Creating all tables
-with app.app_context():
-    db.init_app(app)
-    db.create_all()
+db.init_app(app)
+
+def create_database_schema():
+    '''
+    Creates the pgvector extension, all tables and the chat history tables and index if they are missing.
+    The ANN indexes of the embeddings are left to the loading scripts and python -m database.indexes: building one (and typing the vector column of
+    langchain_pg_embedding) rewrites the table under a lock, which a request should never wait for.
+    '''
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+        db.create_all()
+
+    # message_store is not a model of db, its (session_id, id) index is what keeps reads and writes of a conversation fast
+    ensure_schema(get_engine())
+
+# Created on the first request that needs the database (or by warmup) instead of at import, so a worker starts while PostgreSQL is unavailable
+database_schema = Lazy("database_schema", create_database_schema)
+
+# Routes served without the database
+DATABASE_FREE_ENDPOINTS = {"hello_world", "prometheus_metrics", "database_pool_metrics", "cache_metrics", "embeddings_metrics"}
+
+# Verbose LangChain logging (every prompt and answer printed to stdout) is opt-in, see /metrics for timings
+langchain.verbose = os.getenv('LANGCHAIN_VERBOSE', 'false').lower() == 'true'
 
-# Establish connection to PostgreSQL (optional, if you need to use raw psycopg2)
-conn = psycopg2.connect(database_uri)
+def built_metrics(lazy):
+    '''
+    Reads the counters of a lazily built cache, none until it has been built (or when it is disabled)
+    '''
+    def read_values():
+        value = lazy.get() if lazy.loaded else None
+
+        return value.metrics() if hasattr(value, "metrics") else {}
 
-# Enable verbose logging in LangChain
-langchain.verbose = True
+    return read_values
+
+# Values counted elsewhere, exposed as gauges by /metrics
+registry.add_collector(gauges_collector("ichild_database_pool", pool_stats, "State of the shared database connection pool (see /pool/metrics)"))
+registry.add_collector(gauges_collector("ichild_query_cache", built_metrics(query_cache), "Counters of the unified search cache (see /cache/metrics)"))
+registry.add_collector(gauges_collector("ichild_embedding_cache", built_metrics(openai_embeddings), "Counters of the embeddings cache (see /embeddings/metrics)"))
+registry.add_collector(gauges_collector("ichild_chat_history_writer", built_metrics(message_writer), "Counters of the background chat history writer"))
+
+def warmup():
+    '''
+    Builds everything the first search would otherwise wait for: the database schema, the OpenAI clients, the query cache,
+    the knowledge base retriever (PGVector store and BM25 index), the location index and the answer pipelines.
+
+    Called in each worker once it has been forked (see gunicorn.conf.py), never in the pre-fork master, so workers do not share sockets.
+    A step that fails (e.g. PostgreSQL is not reachable yet) is logged and built again on first use. Step durations are recorded as the
+    warmup_<step> stages of /metrics. Returns the duration of each step in seconds (None for a failed step).
+    '''
+    steps = [
+        ("database_schema", database_schema.get),
+        ("openai_embeddings", openai_embeddings.get),
+        ("llm", llm.get),
+        ("condense_question_llm", condense_question_llm.get),
+        ("streaming_llm", streaming_llm.get),
+        ("query_cache", query_cache.get),
+        ("knowledge_base_retriever", pg_vector_retriever.get),
+        ("location_index", location_index.get),
+        ("direct_questions_pipeline", direct_questions_pipeline.get),
+        ("location_questions_pipeline", location_questions_pipeline.get)
+    ]
+
+    durations = {}
+    for name, build in steps:
+        start = time.perf_counter()
+
+        try:
+            with stage(f"warmup_{name}"):
+                build()
+            durations[name] = time.perf_counter() - start
+        except Exception as e:
+            print(f"Warmup of {name} failed, it will be built on first use: {e}")
+            durations[name] = None
+
+    print(f"Warmup done in {sum(duration or 0 for duration in durations.values()):.2f} s")
+
+    return durations
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def ensure_database_schema():
+    if(request.endpoint not in DATABASE_FREE_ENDPOINTS):
+        database_schema.get()
+
+@app.after_request
+def record_request_duration(response):
+    if("request_start" in g):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_duration.observe(time.perf_counter() - g.request_start, route=route, method=request.method, status=response.status_code)
+
+    return response
 
 # Basic hello world route
 @app.route("/")
@@ -38,42 +145,192 @@ def hello_world():
 # Unified search handler for direct and location based queries
 @app.route("/search/", defaults={"id": None})
 @app.route("/search/<id>")
-def unified_search(id):
+async def unified_search(id):
     '''
     Unified search handles direct and location based question.
     First, use OpenAI function calling to classify query and choose approprite function to invoke (search_direct_questions, search_location_questions)
-    Invoke chosen function and return results to user
+    While the query is being classified, it is embedded and the documents for both functions are retrieved speculatively (the unused retrieval is cancelled)
+    Invoke chosen function with its retrieved documents and return results to user
+    Questions without conversation history are answered from the cache when the same question (or a very similar one about the same place) was answered before
     '''
     
     search_query = request.args.get("query")
 
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant. Use the supplied tools to assist the user."},
-        {"role": "user", "content": search_query}
-    ]
+    handlers = {
+        "search_direct_questions": search_direct_questions,
+        "search_location_questions": search_location_questions
+    }
 
-    response = openai.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        tools=tools,
-    )
+    cache, place = await cache_for_conversation(id, search_query)
 
-    refusal = response.choices[0].message.refusal
+    cached = await asyncio.to_thread(cache.lookup_exact, search_query) if cache else None
+    if(cached):
+        return await asyncio.to_thread(serve_cached_result, id, search_query, cached)
 
-    if(refusal):
-        return "Something went wrong: OpenAi Classification Refusal"
+    result = await classify_and_retrieve(search_query, cache, place)
 
-    function_name = response.choices[0].message.tool_calls[0].function.name
+    if(result.cached):
+        return await asyncio.to_thread(serve_cached_result, id, search_query, result.cached)
 
-    data = None
-    if(function_name == 'search_direct_questions'):
-        data = search_direct_questions(id, search_query)
-    elif(function_name == 'search_location_questions'):
-        data = search_location_questions(id, search_query)
-    else:
+    if(result.function_name is None):
+        return "Something went wrong: OpenAi Classification Refusal"
+
+    if(result.function_name not in handlers):
         return "error"
 
+    data = await asyncio.to_thread(timed(result.function_name, handlers[result.function_name]), id, search_query, result.documents)
+
+    if(cache and result.query_embedding is not None):
+        sources = document_sources(result.documents) if result.function_name == "search_direct_questions" and result.documents else None
+        await asyncio.to_thread(cache.store, search_query, result.query_embedding, { "function_name": result.function_name, "data": data, "sources": sources }, place)
+
     return data
 
+# Streaming variant of unified search using Server-Sent Events
+@app.route("/search/stream/", defaults={"id": None})
+@app.route("/search/stream/<id>")
+async def unified_search_stream(id):
+    '''
+    Same classification and retrieval as unified_search, but the response is streamed as Server-Sent Events:
+    a session event with the conversation id, a locations (location questions) or sources (direct questions) event as soon as retrieval is done,
+    one token event per answer token and a final done event with the full answer (an error event, then done, if classification, retrieval or the answer fails)
+    '''
+
+    search_query = request.args.get("query")
+
+    # Classification and retrieval run before the stream starts, their errors are sent as events too so every stream ends with done
+    try:
+        cache, place = await cache_for_conversation(id, search_query)
+
+        cached = await asyncio.to_thread(cache.lookup_exact, search_query) if cache else None
+        if(cached):
+            return event_stream(stream_cached_result(id, search_query, cached))
+
+        result = await classify_and_retrieve(search_query, cache, place)
+    except Exception as e:
+        return event_stream(format_error_events(e))
+
+    if(result.cached):
+        return event_stream(stream_cached_result(id, search_query, result.cached))
+
+    if(result.function_name is None):
+        return event_stream(format_error_events("Something went wrong: OpenAi Classification Refusal"))
+
+    if(result.function_name not in ["search_direct_questions", "search_location_questions"]):
+        return event_stream(format_error_events("error"))
+
+    on_complete = None
+    if(cache and result.query_embedding is not None):
+        on_complete = lambda value: cache.store(search_query, result.query_embedding, value, place)
+
+    return event_stream(stream_search(id, result.function_name, search_query, result.documents, on_complete=on_complete))
+
+def event_stream(events):
+    return Response(events, mimetype="text/event-stream", headers={ "Cache-Control": "no-cache", "X-Accel-Buffering": "no" })
+
+async def cache_for_conversation(id, search_query):
+    '''
+    Returns the query cache if it can be used for this conversation, and the place search_query mentions (see SemanticCache).
+    Follow-up questions bypass the cache since their answer depends on the chat history.
+    So do questions whose place cannot be told without the location index, a similar question about another place would be served.
+    '''
+    cache = query_cache.get()
+    if(cache is None):
+        return None, None
+
+    if(await asyncio.to_thread(has_chat_history, id)):
+        cache.bypass()
+        return None, None
+
+    try:
+        place = await asyncio.to_thread(query_place, search_query)
+    except Exception as e:
+        print(f"Query cache bypassed, the location index is not available: {e}")
+        cache.bypass()
+        return None, None
+
+    return cache, place
+
+async def classify_and_retrieve(search_query, cache=None, place=None):
+    '''
+    Chooses the handler for search_query and retrieves its documents.
+    Queries the local router is confident about skip the gpt-4o classification call (and the retrieval for the other handler)
+    Direct questions are answered from the BM25 results alone when the query is not embedded within KNOWLEDGE_BASE_EMBEDDING_TIMEOUT seconds
+    '''
+    retrievers = {
+        "search_direct_questions": timed("retrieve_direct", lambda query_embedding: retrieve_direct_documents(query_embedding, search_query)),
+        "search_location_questions": timed("retrieve_location", lambda query_embedding: retrieve_location_documents(query_embedding, search_query))
+    }
+
+    classify = timed("classification", classify_query)
+
+    with stage("routing"):
+        route = query_router.route(search_query)
+
+    if(route):
+        classify = lambda search_query: route
+        retrievers = { route: retrievers[route] }
+
+    return await speculative_search(
+        search_query,
+        classify=classify,
+        embed_query=timed("query_embedding", openai_embeddings.get().embed_query),
+        retrievers=retrievers,
+        cache_lookup=timed("cache_lookup", lambda query_embedding: cache.lookup_similar(query_embedding, place)) if cache else None,
+        embedding_timeout=knowledge_base_embedding_timeout,
+        fallbacks={ "search_direct_questions": timed("retrieve_direct_lexical", retrieve_direct_documents_lexically) }
+    )
+
+# Rebuild the in-memory location index after the location table has been updated
+# Only the worker handling the request is reloaded, set LOCATION_INDEX_REFRESH_SECONDS for every worker to pick up changes
+@app.route("/locations/reload", methods=["POST"])
+def reload_locations():
+    retriever = location_index.reload()
+
+    return {
+        # Large tables are searched in SQL (see retrievers/SQLLocationRetriever.py) and only count their rows
+        "locations": retriever.row_count if hasattr(retriever, "row_count") else len(retriever.documents)
+    }
+
+# Rebuild the knowledge base retriever (its in-memory BM25 index) after preprocessing/load_docs.py has added or deleted chunks
+# Only the worker handling the request is reloaded, set KNOWLEDGE_BASE_REFRESH_SECONDS for every worker to pick up changes
+@app.route("/knowledge-base/reload", methods=["POST"])
+def reload_knowledge_base():
+    retriever = pg_vector_retriever.reload()
+
+    return {
+        # The mmr search has no in-memory index
+        "chunks": len(retriever.lexical_index.documents) if hasattr(retriever, "lexical_index") else None
+    }
+
+# Hit/miss counters of the unified search cache
+@app.route("/cache/metrics")
+def cache_metrics():
+    cache = query_cache.get()
+    if(cache is None):
+        return { "enabled": False }
+
+    return { "enabled": True, **cache.metrics() }
+
+# Hit/miss counters of the embeddings cache
+@app.route("/embeddings/metrics")
+def embeddings_metrics():
+    embeddings = openai_embeddings.get()
+    if(not hasattr(embeddings, "metrics")):
+        return { "enabled": False }
+
+    return { "enabled": True, **embeddings.metrics() }
+
+# State of the shared database connection pool
+@app.route("/pool/metrics")
+def database_pool_metrics():
+    return pool_stats()
+
+# Latency histograms per route and per search stage, LLM token usage and the counters above, in the Prometheus text format
+# Metrics are kept per process, each worker has to be scraped
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,197 @@
+'''
+Compares the answer pipeline of chains/answer_pipeline.py with the ConversationalRetrievalChain it replaces, on the conversations
+of benchmarks/data/follow_up_eval.csv (questions labeled 1 when they can only be understood with the conversation).
+
+Each question is answered as the location route does: the locations are retrieved first (speculative search, not counted), then answered by
+- chain: ConversationalRetrievalChain with PrefetchedRetriever, the previous handlers (the question is condensed on every turn with history,
+  both are kept here since the server no longer uses them),
+- pipeline_always: AnswerPipeline condensing every turn with history (CONDENSE_QUESTION=always),
+- pipeline_auto: AnswerPipeline only condensing the questions is_self_contained rejects (CONDENSE_QUESTION=auto, the default).
+For first turns and follow-up turns, reports the latency, the LLM calls and the extra retrievals per turn, and the accuracy of
+is_self_contained on the labeled questions (recall_follow_ups: share of follow-ups it sends to the LLM, the ones it misses are answered
+without the conversation). The LLM is a fake model answering after --llm-latency seconds, the memory is a temporary SQLite database,
+and the locations come from knowledge_base/locations.csv embedded with FakeEmbeddings, so no OpenAI key or PostgreSQL is needed.
+
+Usage: python -m benchmarks.answer_pipeline [--llm-latency 0.3] [--output results.json]
+'''
+import argparse
+import csv
+import os
+import tempfile
+import time
+from collections import defaultdict
+from itertools import groupby
+from typing import Any, List
+from uuid import uuid4
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+
+from benchmarks.micro import read_location_rows
+from benchmarks.results import latency_summary, write_results
+from embeddings.fake import FakeEmbeddings
+from retrievers.LocationRetriever import build_location_retriever_from_rows
+from retrievers.location_index import LOCATION_COLUMNS
+
+MODES = ["chain", "pipeline_always", "pipeline_auto"]
+
+def load_conversations():
+    with open(os.path.join(os.path.dirname(__file__), "data", "follow_up_eval.csv"), newline="", encoding="utf-8") as eval_file:
+        rows = list(csv.DictReader(eval_file))
+
+    return [[(row["question"], row["follow_up"] == "1") for row in turns] for _, turns in groupby(rows, key=lambda row: row["conversation"])]
+
+class SlowFakeChatModel(FakeListChatModel):
+    '''
+    Fake chat model answering after a fixed latency and counting its calls
+    '''
+
+    latency: float = 0.3
+    calls: int = 0
+
+    def _call(self, *args, **kwargs):
+        time.sleep(self.latency)
+        self.calls += 1
+
+        return super()._call(*args, **kwargs)
+
+class CountingRetriever(BaseRetriever):
+    '''
+    Counts the retrievals done while answering (the speculative retrieval is done before, on the wrapped retriever)
+    '''
+
+    retriever: Any
+    retrievals: int = 0
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        self.retrievals += 1
+
+        return self.retriever.get_relevant_documents(query)
+
+class PrefetchedRetriever(BaseRetriever):
+    '''
+    Serves documents retrieved ahead of time for one query and delegates any other query to the wrapped retriever,
+    as the previous handlers did with the speculatively retrieved documents
+    '''
+
+    query: str
+    documents: List[Document]
+    retriever: BaseRetriever
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if query == self.query:
+            return self.documents
+
+        return self.retriever.invoke(query)
+
+def build_conversational_retrieval_chain_with_memory(llm, retriever, id):
+    '''
+    The ConversationalRetrievalChain of the previous handlers, its whole conversation read from and written to message_store
+    '''
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain.memory import ConversationBufferMemory
+
+    from database.engine import get_engine
+    from memory.bounded_history import build_chat_history
+
+    memory = ConversationBufferMemory(
+        chat_memory=build_chat_history(id, get_engine(), summary_llm=llm),
+        return_messages=True,
+        memory_key="chat_history",
+        output_key="answer"
+    )
+
+    return ConversationalRetrievalChain.from_llm(llm=llm, memory=memory, retriever=retriever, condense_question_llm=llm)
+
+def build_answer(mode, llm, retriever):
+    '''
+    Returns answer(id, question, documents) for a mode
+    '''
+    from chains.answer_pipeline import AnswerPipeline
+
+    if mode == "chain":
+        def answer(id, question, documents):
+            prefetched = PrefetchedRetriever(query=question, documents=documents, retriever=retriever)
+
+            return build_conversational_retrieval_chain_with_memory(llm, prefetched, id).run(question)
+
+        return answer
+
+    pipeline = AnswerPipeline(llm, retriever.invoke, condense_mode=mode.split("_")[1])
+
+    return lambda id, question, documents: pipeline.run(id, question, documents)[0]
+
+def heuristic_accuracy(conversations):
+    from chains.answer_pipeline import is_self_contained
+
+    labeled = [(question, follow_up) for turns in conversations for question, follow_up in turns[1:]]
+    follow_ups = [question for question, follow_up in labeled if follow_up]
+    self_contained = [question for question, follow_up in labeled if not follow_up]
+
+    return {
+        "questions": len(labeled),
+        "recall_follow_ups": round(sum(not is_self_contained(question) for question in follow_ups) / len(follow_ups), 3),
+        "skipped_self_contained_rate": round(sum(is_self_contained(question) for question in self_contained) / len(self_contained), 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--output", help="path of the JSON results (default benchmarks/results/answer_pipeline-<time>.json)")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URI"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'answer_pipeline.db')}"
+    os.environ["VECTOR_INDEX_TYPE"] = "none"
+    from database.engine import get_engine
+    from memory.bounded_history import ensure_schema
+
+    ensure_schema(get_engine())
+
+    embeddings_model = FakeEmbeddings()
+    rows = read_location_rows()
+    location_embeddings = np.asarray(embeddings_model.embed_documents([row[LOCATION_COLUMNS.index("description")] for row in rows]), dtype=np.float32)
+    location_retriever = build_location_retriever_from_rows(rows, location_embeddings, LOCATION_COLUMNS, embeddings_model)
+
+    conversations = load_conversations()
+    cases = {}
+
+    for mode in MODES:
+        llm = SlowFakeChatModel(responses=["Clinics in Bryan and College Station that accept Medicaid."], latency=args.llm_latency)
+        retriever = CountingRetriever(retriever=location_retriever)
+        answer = build_answer(mode, llm, retriever)
+
+        timings, llm_calls, retrievals = defaultdict(list), defaultdict(list), defaultdict(list)
+        for turns in conversations:
+            id = uuid4()
+            for turn, (question, _) in enumerate(turns):
+                documents = location_retriever.get_relevant_documents(question)
+                kind = "first_turn" if turn == 0 else "follow_up_turn"
+                calls_before, retrievals_before = llm.calls, retriever.retrievals
+
+                start = time.perf_counter()
+                answer(id, question, documents)
+                timings[kind].append(time.perf_counter() - start)
+
+                llm_calls[kind].append(llm.calls - calls_before)
+                retrievals[kind].append(retriever.retrievals - retrievals_before)
+
+        for kind in timings:
+            cases[f"{mode}.{kind}"] = {
+                **latency_summary(timings[kind]),
+                "llm_calls_per_turn": round(sum(llm_calls[kind]) / len(llm_calls[kind]), 3),
+                "retrievals_per_turn": round(sum(retrievals[kind]) / len(retrievals[kind]), 3)
+            }
+
+    cases["is_self_contained"] = heuristic_accuracy(conversations)
+
+    for case, metrics in cases.items():
+        print(f"{case:<32} " + "   ".join(f"{name} {value:.3f}" if isinstance(value, float) else f"{name} {value}" for name, value in metrics.items()
+                                        if name in ("p50_ms", "p95_ms", "llm_calls_per_turn", "retrievals_per_turn", "recall_follow_ups", "skipped_self_contained_rate")))
+
+    write_results("answer_pipeline", cases, { "llm_latency": args.llm_latency, "conversations": len(conversations) }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+'''
+Compares the chat history writes of memory/write_behind.py with synchronous inserts (CHAT_HISTORY_WRITES=sync, the previous behaviour).
+
+--threads request threads each hold --conversations conversations of --turns turns. Every turn reads the history, as the answer pipeline does,
+then adds the question and the answer. Reports the time the request spends writing (what the user waits for after the answer),
+the transactions used and the throughput of whole turns. Once the writer is flushed, checks that every conversation is stored and read back
+complete and in order (ordering_errors, should be 0). Runs on a temporary SQLite database by default, pass --database-uri to use PostgreSQL.
+
+Usage: python -m benchmarks.chat_history_writes [--threads 8] [--conversations 10] [--turns 6] [--flush-interval 0.05] [--database-uri postgresql+psycopg://...] [--output results.json]
+'''
+import argparse
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage
+from sqlalchemy import create_engine, func, select
+
+from benchmarks.results import latency_summary, write_results
+from memory.bounded_history import BoundedSQLChatMessageHistory, ensure_schema, message_table
+from memory.write_behind import message_writer
+
+QUESTION = "Are there any pediatricians near College Station that accept Medicaid?"
+ANSWER = "There are several pediatric clinics in College Station and Bryan that accept Medicaid, call ahead to confirm they take new patients."
+
+MODES = ["sync", "background"]
+
+def run_conversations(engine, session_ids, turns, timings, errors):
+    for turn in range(turns):
+        for session_id in session_ids:
+            history = BoundedSQLChatMessageHistory(session_id, engine, max_turns=None)
+
+            # Every earlier turn must be read, written or not
+            if len(history.messages) != 2 * turn:
+                errors.append(session_id)
+
+            start = time.perf_counter()
+            history.add_messages([HumanMessage(content=f"{QUESTION} ({turn})"), AIMessage(content=f"{ANSWER} ({turn})")])
+            timings.append(time.perf_counter() - start)
+
+def stored_in_order(engine, session_id, turns):
+    contents = [message.content for message in BoundedSQLChatMessageHistory(session_id, engine, max_turns=None).messages]
+
+    return contents == [content for turn in range(turns) for content in (f"{QUESTION} ({turn})", f"{ANSWER} ({turn})")]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--conversations", type=int, default=10, help="conversations per thread")
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--database-uri")
+    parser.add_argument("--output", help="path of the JSON results (default benchmarks/results/chat_history_writes-<time>.json)")
+    args = parser.parse_args()
+
+    temporary_directory = None
+    if args.database_uri:
+        engine = create_engine(args.database_uri)
+    else:
+        temporary_directory = tempfile.TemporaryDirectory()
+        engine = create_engine(f"sqlite:///{os.path.join(temporary_directory.name, 'chat_history.db')}", connect_args={ "timeout": 30 })
+
+    ensure_schema(engine)
+    os.environ["CHAT_HISTORY_FLUSH_INTERVAL"] = str(args.flush_interval)
+
+    cases = {}
+    for mode in MODES:
+        os.environ["CHAT_HISTORY_WRITES"] = mode
+        message_writer.reset()
+        writer = message_writer.get()
+
+        sessions = [[str(uuid.uuid4()) for _ in range(args.conversations)] for _ in range(args.threads)]
+        timings, errors = [], []
+        threads = [threading.Thread(target=run_conversations, args=(engine, session_ids, args.turns, timings, errors)) for session_ids in sessions]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if writer is not None:
+            writer.flush()
+
+        with engine.connect() as conn:
+            stored = conn.execute(select(func.count()).select_from(message_table).where(message_table.c.session_id.in_(
+                [session_id for session_ids in sessions for session_id in session_ids]))).scalar()
+
+        ordering_errors = len(errors) + sum(not stored_in_order(engine, session_id, args.turns) for session_ids in sessions for session_id in session_ids)
+        metrics = writer.metrics() if writer is not None else {}
+        cases[mode] = {
+            **latency_summary(timings),
+            "turns_per_s": round(len(timings) / elapsed, 1),
+            "transactions": metrics.get("batches", 0) + metrics.get("synchronous_writes", 0) if writer is not None else len(timings),
+            "stored_messages": stored,
+            "ordering_errors": ordering_errors
+        }
+
+        if writer is not None:
+            writer.close()
+
+    for case, metrics in cases.items():
+        print(f"{case:<12} " + "   ".join(f"{name} {value}" for name, value in metrics.items()
+                                        if name in ("p50_ms", "p95_ms", "p99_ms", "turns_per_s", "transactions", "stored_messages", "ordering_errors")))
+
+    write_results("chat_history_writes", cases, { key: value for key, value in vars(args).items() if key not in ("output", "database_uri") }, args.output)
+
+    engine.dispose()
+    if temporary_directory:
+        temporary_directory.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+'''
+Measures the cold start of a server worker: the time to import app.py in a fresh process, to warm it up (app.warmup, see gunicorn.conf.py)
+and to answer its first /search request, each in a new Python process (--runs times).
+
+OpenAI is replaced by the stub server of benchmarks/stub_openai_server.py. Without --database-uri the database is unreachable
+(connections to 127.0.0.1:1 are refused), which shows whether a worker can start, and serve /metrics, while PostgreSQL is down.
+With --database-uri (a local PostgreSQL with pgvector, loaded with preprocessing/) the warmup and the first search are measured too.
+
+Usage: python -m benchmarks.cold_start [--runs 5] [--database-uri postgresql://...] [--output results.json]
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.results import write_results
+from benchmarks.stub_openai_server import start_stub_server
+
+UNREACHABLE_DATABASE_URI = "postgresql://ichild@127.0.0.1:1/ichild"
+
+# Run in the fresh process, prints one JSON object of timings (seconds) and errors
+WORKER = '''
+import json, time
+timings = {}
+start = time.perf_counter()
+try:
+    import app
+    timings["import_s"] = time.perf_counter() - start
+except Exception as e:
+    print(json.dumps({ "import_error": repr(e)[:200] }))
+    raise SystemExit
+
+if hasattr(app, "warmup"):
+    start = time.perf_counter()
+    app.warmup()
+    timings["warmup_s"] = time.perf_counter() - start
+
+client = app.app.test_client()
+for name, path in [("metrics", "/metrics"), ("first_search", "/search/?query=What%20is%20mastitis%20treated%20with%3F")]:
+    start = time.perf_counter()
+    status = client.get(path).status_code
+    timings[f"{name}_s"] = time.perf_counter() - start
+    timings[f"{name}_status"] = status
+
+print(json.dumps(timings))
+'''
+
+def run_worker(env):
+    completed = subprocess.run([sys.executable, "-c", WORKER], capture_output=True, text=True, env=env, cwd=os.path.join(os.path.dirname(__file__), ".."))
+    lines = [line for line in completed.stdout.splitlines() if line.startswith("{")]
+
+    return json.loads(lines[-1]) if lines else { "import_error": completed.stderr.strip().splitlines()[-1][:200] if completed.stderr.strip() else "no output" }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--database-uri", default=UNREACHABLE_DATABASE_URI)
+    parser.add_argument("--output", help="path of the JSON results (default benchmarks/results/cold_start-<time>.json)")
+    args = parser.parse_args()
+
+    server = start_stub_server(chat_latency=0.05, classification_latency=0.05, embedding_latency=0.01)
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    env = { **os.environ, "OPENAI_BASE_URL": base_url, "OPENAI_API_BASE": base_url, "OPENAI_API_KEY": "stub", "DATABASE_URI": args.database_uri }
+
+    runs = [run_worker(env) for _ in range(args.runs)]
+
+    for run in runs:
+        print(" ".join(f"{key} {value:.3f}" if isinstance(value, float) else f"{key} {value}" for key, value in run.items()))
+
+    cases = {}
+    failed_imports = sum("import_error" in run for run in runs)
+    for key in sorted({ key for run in runs for key in run if key.endswith("_s") }):
+        values = [run[key] for run in runs if key in run]
+        cases[key[:-2]] = { "median_s": round(statistics.median(values), 4), "max_s": round(max(values), 4) }
+    cases["import"] = { **cases.get("import", {}), "failed_imports": failed_imports }
+
+    print(f"{failed_imports} of {args.runs} workers failed to import app.py")
+    write_results("cold_start", cases, { "runs": args.runs, "database": "unreachable" if args.database_uri == UNREACHABLE_DATABASE_URI else "local" }, args.output)
+
+if __name__ == "__main__":
+    main()
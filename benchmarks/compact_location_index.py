@@ -0,0 +1,156 @@
+'''
+Compares the compact location index (retrievers/compact_index.py) with the float32 matrix every worker holds by default:
+recall@k against the exact search, query latency, size of the first-pass codes and memory per worker.
+
+The embeddings are synthetic 1536-dimension vectors with a decaying spectrum (like OpenAI embeddings, most of the variance lies in
+a few hundred directions), queries are noisy copies of random rows. Memory per worker is measured: --workers processes are forked,
+each builds the retriever as a server worker does (the index files are written by the first build and memory-mapped by the others)
+and runs the queries, and the private memory they added is read from /proc/self/smaps_rollup (Linux only).
+Memory-mapped pages are shared by the workers, so they are reported once, as shared_mb.
+
+Usage: python -m benchmarks.compact_location_index [--rows 10000,50000] [--queries 200] [--k 4] [--workers 2] [--output results.json]
+'''
+import argparse
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.results import latency_summary, write_results
+from embeddings.fake import FakeEmbeddings
+from retrievers.TableColumnRetriever import TableColumnRetriever, build_documents, normalize_embeddings, top_k_indices
+from retrievers.compact_index import CompactIndexConfig, build_compact_index
+
+DIMENSIONS = 1536
+
+# name -> (quantization, dimensions), None is the current representation
+CONFIGURATIONS = {
+    "float32": None,
+    "int8": ("int8", None),
+    "binary": ("binary", None),
+    "pca256": ("none", 256),
+    "pca256_int8": ("int8", 256),
+    "pca512_binary": ("binary", 512),
+}
+
+def synthetic_embeddings(rows, queries, seed=0):
+    rng = np.random.default_rng(seed)
+
+    basis = rng.standard_normal((512, DIMENSIONS), dtype=np.float32)
+    spectrum = (1 / np.sqrt(np.arange(1, 513))).astype(np.float32)
+    embeddings = normalize_embeddings((rng.standard_normal((rows, 512), dtype=np.float32) * spectrum) @ basis, copy=False)
+    embeddings += 0.01 * rng.standard_normal((rows, DIMENSIONS), dtype=np.float32)
+
+    targets = rng.choice(rows, queries, replace=False)
+    query_embeddings = normalize_embeddings(embeddings[targets] + 0.02 * rng.standard_normal((queries, DIMENSIONS), dtype=np.float32), copy=False)
+
+    return normalize_embeddings(embeddings, copy=False), query_embeddings
+
+def build_retriever(embeddings, configuration, directory, k):
+    '''
+    Builds the retriever a worker would hold (the current one copies the matrix it loaded, the compact one maps the index files)
+    '''
+    compact_index = None
+    if configuration is None:
+        embeddings = embeddings.copy()
+    else:
+        embeddings, compact_index = build_compact_index(embeddings, CompactIndexConfig(*configuration, rescore_factor=10, directory=directory))
+
+    return TableColumnRetriever(
+        documents=build_documents([(str(i),) for i in range(len(embeddings))], ["id"]),
+        embeddings=embeddings,
+        k=k,
+        openai_embeddings=FakeEmbeddings(),
+        compact_index=compact_index
+    )
+
+def private_bytes():
+    '''
+    Memory of this process that no other process shares (None off Linux)
+    '''
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            return sum(int(line.split()[1]) * 1024 for line in smaps if line.startswith(("Private_Clean", "Private_Dirty", "Private_Hugetlb")))
+    except OSError:
+        return None
+
+def worker(embeddings, query_embeddings, configuration, directory, k, results):
+    before = private_bytes()
+
+    retriever = build_retriever(embeddings, configuration, directory, k)
+    for query_embedding in query_embeddings:
+        retriever.get_relevant_documents_by_vector(query_embedding)
+
+    after = private_bytes()
+    results.put(None if before is None else after - before)
+
+def measure_workers(embeddings, query_embeddings, configuration, directory, k, workers):
+    '''
+    Private memory added by each of workers forked processes (the matrix they get from the parent is shared copy-on-write, like rows
+    streamed from the database would be transient)
+    '''
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+
+    processes = [context.Process(target=worker, args=(embeddings, query_embeddings, configuration, directory, k, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    added = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    return None if None in added else max(added)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,50000", help="comma separated numbers of locations")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", help="path of the JSON results (default benchmarks/results/compact_location_index-<time>.json)")
+    args = parser.parse_args()
+
+    cases = {}
+    for rows in [int(count) for count in args.rows.split(",")]:
+        embeddings, query_embeddings = synthetic_embeddings(rows, args.queries)
+        exact = [set(top_k_indices(embeddings @ query_embedding, args.k)) for query_embedding in query_embeddings]
+
+        for name, configuration in CONFIGURATIONS.items():
+            directory = tempfile.mkdtemp()
+            try:
+                retriever = build_retriever(embeddings, configuration, directory, args.k)
+
+                timings, hits = [], 0
+                for query_embedding, expected in zip(query_embeddings, exact):
+                    start = time.perf_counter()
+                    documents = retriever.get_relevant_documents_by_vector(query_embedding)
+                    timings.append(time.perf_counter() - start)
+
+                    hits += len(expected & { int(document.page_content) for document in documents })
+
+                memory = retriever.compact_index.memory() if retriever.compact_index else { "heap_bytes": 0, "mapped_bytes": 0 }
+                first_pass_bytes = retriever.compact_index.codes.nbytes if retriever.compact_index else retriever.embeddings.nbytes
+                shared_bytes = memory["mapped_bytes"] + (retriever.embeddings.nbytes if isinstance(retriever.embeddings, np.memmap) else 0)
+                private = measure_workers(embeddings, query_embeddings, configuration, directory, args.k, args.workers)
+
+                cases[f"{name}@{rows}"] = {
+                    **latency_summary(timings),
+                    f"recall_at_{args.k}": round(hits / (args.k * len(query_embeddings)), 4),
+                    "first_pass_mb": round(first_pass_bytes / 2**20, 1),
+                    "private_mb_per_worker": None if private is None else round(private / 2**20, 1),
+                    "shared_mb": round(shared_bytes / 2**20, 1)
+                }
+                del retriever
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    for case, metrics in cases.items():
+        print(f"{case:<24} " + "   ".join(f"{name} {value}" for name, value in metrics.items()
+                                        if name in ("p50_ms", "p95_ms", f"recall_at_{args.k}", "first_pass_mb", "private_mb_per_worker", "shared_mb")))
+
+    write_results("compact_location_index", cases, { key: value for key, value in vars(args).items() if key != "output" }, args.output)
+
+if __name__ == "__main__":
+    main()
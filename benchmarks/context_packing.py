@@ -0,0 +1,80 @@
+'''
+Measures the context of the answer prompt of direct questions built by chains/context_builder.py against stuffing every retrieved chunk.
+
+The knowledge base is split like preprocessing/load_docs.py (chunk_index included) and the labeled questions of
+benchmarks/data/knowledge_base_eval.csv are answered from the top --k chunks of the BM25 index (no OpenAI key needed).
+For each --k and budget, reports the context tokens per prompt, the share of chunks merged with a neighbor or dropped as near-duplicates,
+hit_rate (a relevant source is still in the context) and the time to build the context. Tokens are counted with tiktoken when its
+encoding is available, otherwise estimated at 4 characters per token.
+
+Usage: python -m benchmarks.context_packing [--k 4,8,16] [--budgets 0,500,1000] [--output results.json]
+'''
+import argparse
+import csv
+import os
+import re
+import statistics
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.results import latency_summary, write_results
+from chains.answer_pipeline import join_page_contents
+from chains.context_builder import ContextBuilder, token_counter
+from preprocessing.load_docs import split_documents
+from retrievers.HybridRetriever import BM25Index
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", default="4,8,16", help="comma separated numbers of retrieved chunks")
+    parser.add_argument("--budgets", default="0,500,1000", help="comma separated context budgets in tokens (0 for no limit)")
+    parser.add_argument("--output", help="path of the JSON results (default benchmarks/results/context_packing-<time>.json)")
+    args = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(__file__), "data", "knowledge_base_eval.csv"), newline="", encoding="utf-8") as eval_file:
+        examples = [(row["query"], re.compile(row["relevant_sources"], re.IGNORECASE)) for row in csv.DictReader(eval_file)]
+
+    chunks, _ = split_documents(os.path.join(os.path.dirname(__file__), "..", "knowledge_base"), "benchmark", RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=0))
+    lexical_index = BM25Index(chunks)
+    count_tokens = token_counter()
+    sources = { chunk.page_content: chunk.metadata["source"] for chunk in chunks }
+
+    cases = {}
+    for k in [int(value) for value in args.k.split(",")]:
+        retrieved = [(lexical_index.search(query, k), relevant) for query, relevant in examples]
+
+        builders = { "stuffed": None, **{ f"packed_{budget or 'unlimited'}": ContextBuilder(max_tokens=budget or None, count_tokens=count_tokens)
+                                          for budget in [int(value) for value in args.budgets.split(",")] } }
+
+        for name, builder in builders.items():
+            tokens, timings, hits, passages, kept = [], [], 0, 0, 0
+
+            for documents, relevant in retrieved:
+                start = time.perf_counter()
+                context = join_page_contents(documents) if builder is None else builder(documents)
+                timings.append(time.perf_counter() - start)
+
+                tokens.append(count_tokens(context))
+                hits += any(relevant.search(sources.get(document.page_content, "")) and document.page_content in context for document in documents)
+
+                if builder is not None:
+                    merged = builder.merge_adjacent(documents)
+                    passages += len(merged)
+                    kept += len(builder.deduplicate(merged))
+
+            cases[f"{name}@{k}"] = {
+                "context_tokens_mean": round(statistics.mean(tokens), 1),
+                "context_tokens_max": max(tokens),
+                "hit_rate": round(hits / len(retrieved), 3),
+                "merged_chunks_share": round(1 - passages / (k * len(retrieved)), 3) if builder else 0.0,
+                "duplicate_passages_share": round(1 - kept / passages, 3) if builder and passages else 0.0,
+                "build_p50_ms": latency_summary(timings)["p50_ms"]
+            }
+
+    for case, metrics in cases.items():
+        print(f"{case:<24} " + "   ".join(f"{name} {value}" for name, value in metrics.items()))
+
+    write_results("context_packing", cases, { key: value for key, value in vars(args).items() if key != "output" }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+'''
+Benchmarks the conversation memory of the chains against the length of the conversation.
+
+For each conversation length, measures the time to load the chat history (what the chain does on every request) and the size,
+in tokens, of the condense question prompt built from it, for the three memory modes of memory/bounded_history.py:
+buffer (whole conversation, the previous behaviour), window (last --max-turns turns) and summary (window and rolling summary).
+The summary is written by a fake LLM returning a fixed summary of about --summary-words words, so no OpenAI key is needed.
+Runs on a temporary SQLite database by default, pass --database-uri to use PostgreSQL.
+
+Usage: python -m benchmarks.conversation_memory [--turns 1,5,10,25,50,100,200] [--max-turns 4] [--requests 20] [--database-uri postgresql+psycopg://...]
+'''
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import uuid
+
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain_community.chat_message_histories import SQLChatMessageHistory
+from langchain_core.language_models import FakeListLLM
+from langchain_core.messages import AIMessage, HumanMessage
+from sqlalchemy import create_engine
+
+from memory.bounded_history import BoundedSQLChatMessageHistory
+
+QUESTION = "Are there any pediatricians near College Station that accept Medicaid?"
+ANSWER = ("There are several pediatric clinics in College Station and Bryan that accept Medicaid. "
+          "The Brazos Valley Community Action Agency health center offers well child visits, immunizations and sick visits, "
+          "and Texas A&M Family Care can help with referrals. Call ahead to confirm they are accepting new patients. ") * 2
+
+def token_counter():
+    '''
+    Counts tokens with tiktoken when its encoding is available, otherwise estimates them at 4 characters per token
+    '''
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text)), "tiktoken"
+    except Exception:
+        return lambda text: len(text) // 4, "estimated at 4 characters per token"
+
+def fill_conversation(engine, turns):
+    session_id = str(uuid.uuid4())
+    messages = []
+    for turn in range(turns):
+        messages += [HumanMessage(content=f"{QUESTION} ({turn})"), AIMessage(content=ANSWER)]
+
+    BoundedSQLChatMessageHistory(session_id, engine).add_messages(messages)
+
+    return session_id
+
+def measure(history, requests, count_tokens):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        messages = history.messages
+        timings.append(time.perf_counter() - start)
+
+    prompt = CONDENSE_QUESTION_PROMPT.format(chat_history=_get_chat_history(messages), question=QUESTION)
+
+    return statistics.median(timings) * 1000, count_tokens(prompt)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", default="1,5,10,25,50,100,200")
+    parser.add_argument("--max-turns", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--summary-words", type=int, default=150)
+    parser.add_argument("--database-uri")
+    args = parser.parse_args()
+
+    # The conversations are written before they are loaded, not queued (see benchmarks/chat_history_writes.py for writes)
+    os.environ["CHAT_HISTORY_WRITES"] = "sync"
+
+    temporary_directory = None
+    if args.database_uri:
+        engine = create_engine(args.database_uri)
+    else:
+        temporary_directory = tempfile.TemporaryDirectory()
+        engine = create_engine(f"sqlite:///{os.path.join(temporary_directory.name, 'memory.db')}")
+
+    count_tokens, token_method = token_counter()
+    summary_llm = FakeListLLM(responses=[" ".join(["summary"] * args.summary_words)])
+
+    print(f"prompt tokens {token_method}, load time is the median of {args.requests} loads")
+    print(f"{'turns':>6} | {'buffer ms':>9} {'tokens':>7} | {'window ms':>9} {'tokens':>7} | {'summary ms':>10} {'tokens':>7}")
+
+    for turns in [int(turns) for turns in args.turns.split(",")]:
+        session_id = fill_conversation(engine, turns)
+
+        buffer = SQLChatMessageHistory(session_id=session_id, connection=engine)
+        window = BoundedSQLChatMessageHistory(session_id, engine, max_turns=args.max_turns)
+        summary = BoundedSQLChatMessageHistory(session_id, engine, max_turns=args.max_turns, summary_llm=summary_llm)
+
+        buffer_ms, buffer_tokens = measure(buffer, args.requests, count_tokens)
+        window_ms, window_tokens = measure(window, args.requests, count_tokens)
+
+        summary.summarize()
+        summary_ms, summary_tokens = measure(summary, args.requests, count_tokens)
+
+        print(f"{turns:>6} | {buffer_ms:>9.2f} {buffer_tokens:>7} | {window_ms:>9.2f} {window_tokens:>7} | {summary_ms:>10.2f} {summary_tokens:>7}")
+
+    engine.dispose()
+    if temporary_directory:
+        temporary_directory.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+'''
+Benchmarks the embeddings cache (embeddings/cached.py) offline.
+
+1. Query time: replays --requests user queries drawn from --distinct-queries questions with a Zipf distribution
+   (a few questions are asked very often), embedding each with embed_query, and reports the hit rate and latency.
+2. Ingestion: embeds the knowledge base chunks twice with embed_documents, the second time from a new CachedEmbeddings
+   (as a new run of preprocessing/load_docs.py would), and reports how many chunks were sent to the model each time.
+
+The model is FakeEmbeddings with a simulated round trip of --latency seconds and the persistent store is a temporary SQLite
+database, so no OpenAI key or PostgreSQL is needed (pass --database-uri to use PostgreSQL instead).
+
+Usage: python -m benchmarks.embedding_cache [--requests 2000] [--distinct-queries 300] [--latency 0.15] [--database-uri postgresql+psycopg://...]
+'''
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from sqlalchemy import create_engine
+
+from embeddings.cached import CachedEmbeddings, SQLEmbeddingStore
+from embeddings.fake import FakeEmbeddings
+from preprocessing.load_docs import split_documents
+
+class CountingEmbeddings(FakeEmbeddings):
+    '''
+    FakeEmbeddings counting the texts it embeds
+    '''
+
+    def __init__(self, latency):
+        super().__init__(latency=latency)
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        self.texts += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.texts += 1
+        return super().embed_query(text)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--distinct-queries", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.15)
+    parser.add_argument("--max-entries", type=int, default=10000)
+    parser.add_argument("--database-uri")
+    args = parser.parse_args()
+
+    temporary_directory = None
+    if args.database_uri:
+        engine = create_engine(args.database_uri)
+    else:
+        temporary_directory = tempfile.TemporaryDirectory()
+        engine = create_engine(f"sqlite:///{os.path.join(temporary_directory.name, 'embeddings.db')}")
+
+    # Query time
+    rng = np.random.default_rng(0)
+    ranks = np.minimum(rng.zipf(1.3, args.requests), args.distinct_queries)
+    queries = [f"Where can I find a pediatrician near College Station? ({rank})" for rank in ranks]
+
+    model = CountingEmbeddings(args.latency)
+    embeddings = CachedEmbeddings(model, namespace="fake", store=SQLEmbeddingStore(engine), max_entries=args.max_entries)
+
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        embeddings.embed_query(query)
+        timings.append(time.perf_counter() - start)
+
+    metrics = embeddings.metrics()
+    hits = [timing for timing in timings if timing < args.latency]
+
+    print(f"query time: {args.requests} queries, {len(set(queries))} distinct")
+    print(f"  hit rate:            {metrics['hit_rate']:.1%} ({metrics['memory_hits']} memory, {metrics['store_hits']} store, {metrics['misses']} model calls)")
+    print(f"  mean latency:        {statistics.mean(timings) * 1000:.2f} ms (uncached {args.latency * 1000:.0f} ms)")
+    print(f"  cached hit latency:  {statistics.median(hits) * 1e6:.1f} us median" if hits else "  no hits")
+
+    # Ingestion
+    chunks, _ = split_documents(os.path.join(os.path.dirname(__file__), "..", "knowledge_base"), "benchmark", RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=0))
+    texts = [chunk.page_content for chunk in chunks]
+
+    for run in ("first", "second"):
+        model = CountingEmbeddings(latency=0)
+        embeddings = CachedEmbeddings(model, namespace="fake", store=SQLEmbeddingStore(engine), max_entries=args.max_entries)
+
+        start = time.perf_counter()
+        for i in range(0, len(texts), 100):
+            embeddings.embed_documents(texts[i:i + 100])
+
+        print(f"ingestion, {run} run: {len(texts)} chunks, {model.texts} embedded by the model, {time.perf_counter() - start:.2f} s")
+
+    engine.dispose()
+    if temporary_directory:
+        temporary_directory.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+'''
+Benchmarks the retrieval quality and latency of the knowledge base search over knowledge_base/.
+
+Splits the transcripts like preprocessing/load_docs.py and runs the labeled questions of benchmarks/data/knowledge_base_eval.csv
+(each with a pattern of the source files that answer it) through:
+- lexical: the BM25 index of retrievers/HybridRetriever.py,
+- vector and hybrid (vector and BM25 fused with reciprocal rank fusion), only with --openai (needs OPENAI_API_KEY,
+  the chunks are embedded once, about 2k embeddings), since fake embeddings carry no meaning,
+- the lexical fallback of HybridRetriever when the embeddings call is slower than its timeout.
+Reports hit@k (a relevant source among the k results), MRR over --fetch-k results and the latency per query.
+
+Usage: python -m benchmarks.knowledge_base_retrieval [--k 4] [--fetch-k 10] [--openai]
+'''
+import argparse
+import csv
+import os
+import re
+import statistics
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from embeddings.fake import FakeEmbeddings
+from preprocessing.load_docs import split_documents
+from retrievers.HybridRetriever import BM25Index, HybridRetriever
+
+def evaluate(name, search, examples, k):
+    hits = 0
+    reciprocal_ranks = []
+    timings = []
+
+    for query, relevant in examples:
+        start = time.perf_counter()
+        documents = search(query)
+        timings.append(time.perf_counter() - start)
+
+        ranks = [rank for rank, document in enumerate(documents, start=1) if relevant.search(document.metadata["source"])]
+        hits += bool(ranks) and ranks[0] <= k
+        reciprocal_ranks.append(1 / ranks[0] if ranks else 0)
+
+    print(f"{name:<22} hit@{k} {hits / len(examples):6.1%}   MRR {statistics.mean(reciprocal_ranks):.3f}   {statistics.median(timings) * 1000:8.2f} ms median")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--eval-set", default=os.path.join(os.path.dirname(__file__), "data", "knowledge_base_eval.csv"))
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--fetch-k", type=int, default=10)
+    parser.add_argument("--openai", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.eval_set, newline="", encoding="utf-8") as eval_file:
+        examples = [(row["query"], re.compile(row["relevant_sources"], re.IGNORECASE)) for row in csv.DictReader(eval_file)]
+
+    chunks, _ = split_documents(os.path.join(os.path.dirname(__file__), "..", "knowledge_base"), "benchmark", RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=0))
+
+    start = time.perf_counter()
+    lexical_index = BM25Index(chunks)
+    print(f"{len(chunks)} chunks, {len(examples)} questions, BM25 index built in {(time.perf_counter() - start) * 1000:.0f} ms\n")
+
+    evaluate("lexical (BM25)", lambda query: lexical_index.search(query, args.fetch_k), examples, args.k)
+
+    if args.openai:
+        from langchain.embeddings import OpenAIEmbeddings
+
+        embeddings = OpenAIEmbeddings()
+        vector_store = InMemoryVectorStore(embeddings)
+        vector_store.add_documents(chunks)
+
+        hybrid = HybridRetriever(lexical_index=lexical_index, vector_store=vector_store, embeddings=embeddings, k=args.fetch_k, fetch_k=args.fetch_k)
+
+        evaluate("vector", lambda query: vector_store.similarity_search(query, k=args.fetch_k), examples, args.k)
+        evaluate("vector (MMR)", lambda query: vector_store.max_marginal_relevance_search(query, k=args.fetch_k, fetch_k=2 * args.fetch_k), examples, args.k)
+        evaluate("hybrid (RRF)", hybrid.invoke, examples, args.k)
+
+    # Embeddings that take 1 s against a 100 ms timeout: the retriever answers from the BM25 index
+    slow_embeddings = FakeEmbeddings(latency=1.0)
+    fallback = HybridRetriever(lexical_index=lexical_index, vector_store=InMemoryVectorStore(slow_embeddings), embeddings=slow_embeddings,
+                               k=args.fetch_k, fetch_k=args.fetch_k, embedding_timeout=0.1)
+    evaluate("hybrid, slow embedding", fallback.invoke, examples[:10], args.k)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+'''
+End-to-end load test of the search pipeline: unified_search, search_direct_questions and search_location_questions
+under increasing concurrency, reporting the p50/p95/p99 latency, the throughput and the errors of each scenario.
+
+OpenAI is replaced by the stub server of benchmarks/stub_openai_server.py (started in-process, --chat-latency, --classification-latency
+and --embedding-latency set its delays), so no network or API key is needed. Requests go through app.py itself: /search/ is called through
+the Flask test client and the handlers of route_handlers/query_handlers.py directly. The storage comes from the backend:
+- standin (default): no PostgreSQL. The singletons of the application that read PostgreSQL are built from in-memory stand-ins instead:
+  the location index from knowledge_base/locations.csv, the knowledge base retriever from knowledge_base/ (BM25 and an in-memory vector
+  store fused by HybridRetriever) and the query embeddings from the stub server, with the conversation memory on a temporary SQLite database.
+  Everything else (routing, speculative search, semantic cache with --cache, answer pipelines, memory writes) is the code the server runs.
+- app: against DATABASE_URI (a local PostgreSQL with pgvector, loaded with preprocessing/).
+  The OpenAIEmbeddings of the server need the tiktoken encoding to be cached locally.
+- http: sends unified_search requests to a server already running at --url (start it with the OPENAI_* variables printed by
+  python -m benchmarks.stub_openai_server), only the unified_search scenario is available.
+
+Questions are the labeled queries of benchmarks/data/routing_eval.csv (location questions for search_location_questions, direct questions for
+search_direct_questions, all of them for unified_search). They are sent in conversations of --turns questions, so every turn after the first
+carries chat history (condensed question, memory read and write). The results are written as JSON (see benchmarks/results.py).
+
+Usage: python -m benchmarks.load_test [--backend standin|app|http] [--url http://127.0.0.1:5000] [--scenarios unified_search,search_direct_questions,search_location_questions]
+                                      [--concurrency 1,4,16] [--requests 48] [--turns 2] [--chat-latency 0.5] [--output results.json]
+'''
+import argparse
+import csv
+import os
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from uuid import uuid4
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from benchmarks.results import latency_summary, write_results
+from benchmarks.stub_openai_server import start_stub_server
+from retrievers.TableColumnRetriever import normalize_embeddings, top_k_indices
+
+SCENARIOS = ["unified_search", "search_direct_questions", "search_location_questions"]
+
+def load_questions():
+    with open(os.path.join(os.path.dirname(__file__), "data", "routing_eval.csv"), newline="", encoding="utf-8") as eval_file:
+        examples = [(row["query"], row["label"]) for row in csv.DictReader(eval_file)]
+
+    return {
+        "unified_search": [query for query, _ in examples],
+        "search_direct_questions": [query for query, label in examples if label == "search_direct_questions"],
+        "search_location_questions": [query for query, label in examples if label == "search_location_questions"]
+    }
+
+class StubServerEmbeddings(Embeddings):
+    '''
+    Embeddings requested from the embeddings endpoint directly (LangChain's OpenAIEmbeddings would download a tiktoken encoding first)
+    '''
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        import openai
+
+        return [item.embedding for item in openai.embeddings.create(model="text-embedding-ada-002", input=texts).data]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+class MatrixVectorStore(VectorStore):
+    '''
+    Exact cosine search over a normalized float32 matrix, standing in for the PGVector collection of the knowledge base
+    (LangChain's InMemoryVectorStore compares the query with one document at a time, which would dominate the latencies)
+    '''
+
+    def __init__(self, documents, embeddings):
+        self.documents = documents
+        self.matrix = normalize_embeddings(embeddings)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        similarities = self.matrix @ normalize_embeddings(embedding)
+
+        return [self.documents[i] for i in top_k_indices(similarities, k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        raise NotImplementedError("MatrixVectorStore is searched by vector")
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("MatrixVectorStore is built from embedded documents")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("MatrixVectorStore is built from embedded documents")
+
+def replace_factory(lazy, factory):
+    '''
+    Makes a singleton of the application (see lifecycle/lazy.py) build from factory instead
+    '''
+    lazy.factory = factory
+    lazy.reset()
+
+def standin_scenarios(args):
+    '''
+    The routes and handlers of app.py, with the storage they read replaced by in-memory stand-ins and the chat memory in a temporary SQLite database
+    '''
+    temporary_directory = tempfile.mkdtemp()
+    os.environ["DATABASE_URI"] = f"sqlite:///{os.path.join(temporary_directory, 'load_test.db')}"
+    os.environ["VECTOR_INDEX_TYPE"] = "none"
+    os.environ["QUERY_CACHE_BACKEND"] = "memory" if args.cache else "none"
+    os.environ["KNOWLEDGE_BASE_SEARCH"] = "hybrid"
+
+    # Imported once the environment points the clients at the stub server and at SQLite, importing app.py connects to nothing
+    import app
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    from benchmarks.micro import read_location_rows
+    from database.engine import get_engine
+    from embeddings.cached import CachedEmbeddings
+    from embeddings.fake import FakeEmbeddings
+    from embeddings.openai import openai_embeddings
+    from memory.bounded_history import ensure_schema
+    from preprocessing.load_docs import split_documents
+    from retrievers.HybridRetriever import BM25Index, HybridRetriever
+    from retrievers.LocationRetriever import build_location_retriever_from_rows
+    from retrievers.location_index import LOCATION_COLUMNS, location_index
+    from route_handlers import query_handlers
+
+    # The stub server embeds with FakeEmbeddings, so the stored embeddings are computed locally
+    stored_embeddings = FakeEmbeddings()
+
+    rows = read_location_rows()
+    location_embeddings = np.asarray(stored_embeddings.embed_documents([row[LOCATION_COLUMNS.index("description")] for row in rows]), dtype=np.float32)
+
+    chunks, _ = split_documents(os.path.join(os.path.dirname(__file__), "..", "knowledge_base"), "load_test", RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=0))
+    vector_store = MatrixVectorStore(chunks, stored_embeddings.embed_documents([chunk.page_content for chunk in chunks]))
+
+    # Only the schema of the chat memory exists in SQLite (the pgvector extension and tables do not)
+    replace_factory(app.database_schema, lambda: ensure_schema(get_engine()))
+    replace_factory(openai_embeddings, lambda: CachedEmbeddings(StubServerEmbeddings(), namespace="load_test"))
+    replace_factory(query_handlers.pg_vector_store, lambda: vector_store)
+    query_handlers.pg_vector_retriever.fingerprint = None
+    query_handlers.pg_vector_retriever.loader = lambda: HybridRetriever(
+        lexical_index=BM25Index(chunks),
+        vector_store=vector_store,
+        embeddings=openai_embeddings.get(),
+        k=query_handlers.knowledge_base_k,
+        fetch_k=max(10, query_handlers.knowledge_base_k),
+        embedding_timeout=query_handlers.knowledge_base_embedding_timeout
+    )
+
+    location_index.loader = lambda: build_location_retriever_from_rows(rows, location_embeddings, LOCATION_COLUMNS, openai_embeddings.get())
+    location_index.fingerprint = None
+
+    print(f"stand-in backend: {len(rows)} locations, {len(chunks)} knowledge base chunks, memory in {os.environ['DATABASE_URI']}")
+
+    return app_scenarios(args)
+
+def app_scenarios(args):
+    '''
+    The routes and handlers of app.py, against the PostgreSQL database of DATABASE_URI
+    '''
+    from app import app, warmup
+    from route_handlers.query_handlers import search_direct_questions, search_location_questions
+
+    # Cold start is measured by benchmarks/cold_start.py
+    warmup()
+
+    def unified_search(id, search_query):
+        response = app.test_client().get(f"/search/{id}", query_string={ "query": search_query })
+        if(response.status_code != 200):
+            raise RuntimeError(f"/search/ returned {response.status_code}")
+
+        return response.get_data(as_text=True)
+
+    return {
+        "unified_search": unified_search,
+        "search_direct_questions": search_direct_questions,
+        "search_location_questions": search_location_questions
+    }
+
+def http_scenarios(args):
+    '''
+    unified_search requests sent to the server running at args.url
+    '''
+    def unified_search(id, search_query):
+        with urllib.request.urlopen(f"{args.url.rstrip('/')}/search/{id}?{urllib.parse.urlencode({ 'query': search_query })}", timeout=120) as response:
+            return response.read()
+
+    return { "unified_search": unified_search }
+
+BACKENDS = {
+    "standin": standin_scenarios,
+    "app": app_scenarios,
+    "http": http_scenarios
+}
+
+def run_conversation(handler, questions):
+    '''
+    Sends questions as the turns of a new conversation, returns the latency of each turn (None for a failed turn)
+    '''
+    id = str(uuid4())
+    latencies = []
+
+    for question in questions:
+        start = time.perf_counter()
+        try:
+            handler(id, question)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            print(f"Request failed: {e!r}")
+            latencies.append(None)
+
+    return latencies
+
+def run_load(handler, questions, concurrency, requests, turns):
+    '''
+    Sends requests questions in conversations of turns questions, concurrency conversations at a time
+    '''
+    conversations = [
+        [questions[(start + turn) % len(questions)] for turn in range(min(turns, requests - start))]
+        for start in range(0, requests, turns)
+    ]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda conversation: run_conversation(handler, conversation), conversations))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for conversation in results for latency in conversation if latency is not None]
+    errors = sum(latency is None for conversation in results for latency in conversation)
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_per_s": round(len(latencies) / elapsed, 3),
+        **latency_summary(latencies)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=BACKENDS, default="standin")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated levels of concurrent conversations")
+    parser.add_argument("--requests", type=int, default=48, help="requests per scenario and concurrency level")
+    parser.add_argument("--turns", type=int, default=2, help="questions per conversation")
+    parser.add_argument("--cache", action="store_true", help="serve repeated questions from the in-memory semantic cache (standin backend, the app backend uses QUERY_CACHE_BACKEND)")
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--classification-latency", type=float, default=0.6)
+    parser.add_argument("--embedding-latency", type=float, default=0.15)
+    parser.add_argument("--output", help="path of the JSON results (default benchmarks/results/load_test-<time>.json)")
+    args = parser.parse_args()
+
+    if args.backend != "http":
+        server = start_stub_server(chat_latency=args.chat_latency, classification_latency=args.classification_latency, embedding_latency=args.embedding_latency)
+        base_url = f"http://127.0.0.1:{server.server_port}/v1"
+        os.environ["OPENAI_BASE_URL"] = base_url
+        os.environ["OPENAI_API_BASE"] = base_url
+        os.environ["OPENAI_API_KEY"] = "stub"
+
+    scenarios = BACKENDS[args.backend](args)
+    questions = load_questions()
+
+    cases = {}
+    print(f"{'scenario':<28} {'conc':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+
+    for scenario in args.scenarios.split(","):
+        if scenario not in scenarios:
+            print(f"{scenario} is not available with the {args.backend} backend")
+            continue
+
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            result = run_load(scenarios[scenario], questions[scenario], concurrency, args.requests, args.turns)
+            cases[f"{scenario}@{concurrency}"] = result
+
+            print(f"{scenario:<28} {concurrency:>5} {result['throughput_per_s']:>8.2f} {result.get('p50_ms', 0):>9.1f} {result.get('p95_ms', 0):>9.1f} "
+                  f"{result.get('p99_ms', 0):>9.1f} {result['errors']:>7}")
+
+    parameters = { key: value for key, value in vars(args).items() if key != "output" }
+    write_results("load_test", cases, parameters, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+'''
+Benchmarks the embedding throughput of preprocessing/load_locations.py offline.
+
+Compares embedding the location descriptions one embed_query request at a time (the previous loader) against
+preprocessing.ingestion.embed_batches (one embed_documents request per batch, several requests in flight, retries).
+Uses FakeEmbeddings with a simulated round trip of --latency seconds plus --per-text-latency seconds per text,
+and fails one request in --failure-rate to exercise the retries, so no OpenAI key is needed.
+Pass --database-uri to also store the locations (the location table must exist, see database/database.py).
+
+Usage: python -m benchmarks.location_ingestion [--rows 2000] [--latency 0.2] [--batch-size 100] [--max-concurrency 4] [--database-uri postgresql://...]
+'''
+import argparse
+import csv
+import os
+import random
+import threading
+import time
+
+from embeddings.fake import FakeEmbeddings
+from preprocessing.ingestion import batched, embed_batches
+
+class SimulatedEmbeddings(FakeEmbeddings):
+    '''
+    FakeEmbeddings whose requests take latency + per_text_latency * len(texts) seconds and fail with probability failure_rate
+    '''
+
+    def __init__(self, latency, per_text_latency, failure_rate, seed=0):
+        super().__init__()
+        self.round_trip = latency
+        self.per_text_latency = per_text_latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def _request(self, count):
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.failure_rate
+
+        time.sleep(self.round_trip + self.per_text_latency * count)
+        if failed:
+            raise RuntimeError("simulated rate limit")
+
+    def embed_documents(self, texts):
+        self._request(len(texts))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self._request(1)
+        return super().embed_query(text)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--per-text-latency", type=float, default=0.001)
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--sequential-rows", type=int, default=50, help="rows embedded one at a time, the sequential rate is extrapolated from them")
+    parser.add_argument("--database-uri")
+    args = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "knowledge_base", "locations.csv"), newline="", encoding="utf-8") as csv_file:
+        descriptions = [row["description"] for row in csv.DictReader(csv_file)]
+    texts = [f"{descriptions[i % len(descriptions)]} ({i})" for i in range(args.rows)]
+
+    # Previous loader: one embed_query per row (without retries, so failures are not simulated)
+    embeddings_model = SimulatedEmbeddings(args.latency, args.per_text_latency, failure_rate=0)
+    start = time.perf_counter()
+    for text in texts[:args.sequential_rows]:
+        embeddings_model.embed_query(text)
+    sequential_rate = args.sequential_rows / (time.perf_counter() - start)
+
+    embeddings_model = SimulatedEmbeddings(args.latency, args.per_text_latency, args.failure_rate)
+    start = time.perf_counter()
+    embedded = failed = 0
+    for _, embeddings, error in embed_batches(embeddings_model, batched(texts, args.batch_size), args.max_concurrency):
+        if error:
+            failed += 1
+        else:
+            embedded += len(embeddings)
+    batched_seconds = time.perf_counter() - start
+
+    print(f"sequential embed_query:  {sequential_rate:8.1f} rows/s ({args.rows / sequential_rate:.1f} s for {args.rows} rows, extrapolated from {args.sequential_rows})")
+    print(f"batched and concurrent:  {embedded / batched_seconds:8.1f} rows/s ({batched_seconds:.1f} s, {embeddings_model.requests} requests including retries, {failed} batches failed)")
+
+    if args.database_uri:
+        from preprocessing.load_locations import load_and_store_locations
+
+        start = time.perf_counter()
+        loaded = load_and_store_locations(FakeEmbeddings(), "knowledge_base/locations.csv", args.database_uri, args.batch_size, args.max_concurrency)
+        print(f"load_and_store_locations: {loaded / (time.perf_counter() - start):8.1f} rows/s ({loaded} locations stored)")
+
+if __name__ == "__main__":
+    main()
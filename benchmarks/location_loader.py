@@ -0,0 +1,118 @@
+'''
+Benchmarks loading embeddings for the location retriever.
+
+Compares the previous loader (fetchall + ast.literal_eval of every pgvector text literal into a float64 array)
+against load_table (binary pgvector values streamed through a server-side cursor into a preallocated float32 matrix).
+
+With --database-uri a synthetic table (bench_location_embeddings) is created and filled with --rows random vectors,
+both loaders read it back and the table is dropped afterwards. Without it, only the parsing step is compared,
+over generated pgvector text literals. Load time and peak traced memory are reported for each loader.
+
+Usage: python -m benchmarks.location_loader [--rows 100000] [--database-uri postgresql://...]
+'''
+import argparse
+import ast
+import time
+import tracemalloc
+
+import numpy as np
+
+from retrievers.TableColumnRetriever import load_table, parse_vector
+
+TABLE_NAME = "bench_location_embeddings"
+DIMENSIONS = 1536
+
+def to_literal(vector):
+    return "[" + ",".join(f"{value:.8f}" for value in vector) + "]"
+
+def measure(label, load):
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    result = load()
+
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<36} {elapsed:9.2f} s   peak {peak / 2**20:10.1f} MiB")
+
+    return result
+
+def create_synthetic_table(database_uri, rows):
+    import psycopg
+    from pgvector.psycopg import register_vector
+
+    rng = np.random.default_rng(0)
+
+    with psycopg.connect(database_uri) as conn:
+        conn.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+        register_vector(conn)
+
+        conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME};")
+        conn.execute(f"CREATE TABLE {TABLE_NAME} (id integer PRIMARY KEY, name text NOT NULL, embedding vector({DIMENSIONS}));")
+
+        with conn.cursor().copy(f"COPY {TABLE_NAME} (id, name, embedding) FROM STDIN WITH (FORMAT BINARY)") as copy:
+            copy.set_types(["integer", "text", "vector"])
+            for i in range(rows):
+                copy.write_row((i, f"Location {i}", rng.standard_normal(DIMENSIONS).astype(np.float32)))
+
+def drop_synthetic_table(database_uri):
+    import psycopg
+
+    with psycopg.connect(database_uri) as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME};")
+
+def legacy_load(database_uri):
+    from psycopg2 import connect
+
+    conn = connect(database_uri)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id, name, embedding FROM {TABLE_NAME};")
+    rows = cursor.fetchall()
+    embeddings = [np.array(ast.literal_eval(row[2])) for row in rows]
+    conn.close()
+
+    return rows, embeddings
+
+def benchmark_database(database_uri, rows):
+    print(f"creating {TABLE_NAME} with {rows} rows...")
+    create_synthetic_table(database_uri, rows)
+
+    try:
+        measure("fetchall + ast.literal_eval", lambda: legacy_load(database_uri))
+        measure("load_table (binary, streamed)", lambda: load_table(database_uri, TABLE_NAME, ["id", "name"], "embedding"))
+    finally:
+        drop_synthetic_table(database_uri)
+
+def benchmark_parsing(rows):
+    # A small pool of distinct literals is cycled so the input itself does not dominate memory
+    rng = np.random.default_rng(0)
+    literals = [to_literal(rng.standard_normal(DIMENSIONS)) for _ in range(64)]
+
+    def legacy():
+        return [np.array(ast.literal_eval(literals[i % len(literals)])) for i in range(rows)]
+
+    def preallocated():
+        embeddings = np.empty((rows, DIMENSIONS), dtype=np.float32)
+        for i in range(rows):
+            embeddings[i] = parse_vector(literals[i % len(literals)])
+
+        return embeddings
+
+    measure("ast.literal_eval -> float64 arrays", legacy)
+    measure("parse_vector -> float32 matrix", preallocated)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--database-uri")
+    args = parser.parse_args()
+
+    if args.database_uri:
+        benchmark_database(args.database_uri, args.rows)
+    else:
+        benchmark_parsing(args.rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+'''
+Benchmarks the per-request cost and the LLM context size of the location documents.
+
+Compares the previous documents (every column joined with "##" into page_content, split back and converted into the client JSON on every request,
+and sent as is to the LLM) against the documents of retrievers/location_documents.py (client JSON computed once at load time in metadata,
+compact text rendering in page_content). Rows come from knowledge_base/locations.csv, with numeric coordinates as read from the location table.
+Tokens are estimated at 4 characters per token.
+
+Usage: python -m benchmarks.location_payloads [--requests 20000] [--k 4]
+'''
+import argparse
+import csv
+import os
+import statistics
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from retrievers.location_documents import build_location_documents
+from retrievers.location_index import LOCATION_COLUMNS
+
+def legacy_documents(rows, column_names):
+    return [Document(page_content="##".join([str(row[i]) for i in range(len(column_names))])) for row in rows]
+
+def legacy_locations_json(doc_list):
+    '''
+    Previous build_locations_json, parsing page_content on every request
+    '''
+    locations = []
+
+    for doc in doc_list:
+        doc_id, name, address, city, state, country, zip_code, latitude, longitude, description, phone, sunday_hours, monday_hours, tuesday_hours, wednesday_hours, thursday_hours, friday_hours, saturday_hours, rating, address_link, website, resource_type, county = doc.page_content.split("##")
+
+        hours_of_operation = [{ "sunday": sunday_hours }, { "monday": monday_hours }, { "tuesday": tuesday_hours }, { "wednesday": wednesday_hours }, { "thursday": thursday_hours }, { "friday": friday_hours }, { "saturday": saturday_hours }]
+        if(latitude and latitude.isnumeric()):
+            latitude = float(latitude.strip())
+        if(longitude and longitude.isnumeric()):
+            longitude = float(longitude.strip())
+        if(rating and rating.isnumeric()):
+            rating = float(rating.strip())
+
+        locations.append({
+            "address": f"{address}, {city}, {state} {zip_code}", "addressLink": address_link, "confidence" : 1, "description" : description,
+            "hoursOfOperation" : hours_of_operation, "id": doc_id, "isSaved": False, "latitude": latitude, "longitude": longitude,
+            "name": name, "phone": phone, "rating": rating, "website": website
+        })
+
+    return locations
+
+def current_locations_json(doc_list):
+    # Same as route_handlers.query_handlers.build_locations_json, which cannot be imported without an OpenAI key and a database
+    return [doc.metadata["location"] for doc in doc_list]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "knowledge_base", "locations.csv"), newline="", encoding="utf-8") as csv_file:
+        rows = [
+            tuple(float(row[column]) if column in ("latitude", "longitude") and row[column] else row[column] for column in LOCATION_COLUMNS)
+            for row in csv.DictReader(csv_file)
+        ]
+
+    rng = np.random.default_rng(0)
+    requests = [rng.choice(len(rows), args.k, replace=False) for _ in range(args.requests)]
+
+    print(f"{len(rows)} locations, {args.requests} requests of {args.k} locations")
+    print(f"{'':<10} {'load ms':>8} {'request us':>11} {'context chars':>14} {'~tokens':>8} {'numeric lat/lon':>16}")
+
+    for name, build_documents, locations_json in (("previous", legacy_documents, legacy_locations_json), ("current", build_location_documents, current_locations_json)):
+        start = time.perf_counter()
+        documents = build_documents(rows, LOCATION_COLUMNS)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        timings = []
+        for indices in requests:
+            doc_list = [documents[i] for i in indices]
+
+            start = time.perf_counter()
+            locations_json(doc_list)
+            timings.append(time.perf_counter() - start)
+
+        # The retrieved documents are joined with blank lines into the context of the answer prompt
+        context_chars = statistics.mean(len("\n\n".join(documents[i].page_content for i in indices)) for indices in requests)
+        numeric = statistics.mean(isinstance(location["latitude"], float) and isinstance(location["longitude"], float) for location in locations_json(documents))
+
+        print(f"{name:<10} {load_ms:>8.1f} {statistics.median(timings) * 1e6:>11.2f} {context_chars:>14.0f} {context_chars / 4:>8.0f} {numeric:>16.0%}")
+
+if __name__ == "__main__":
+    main()
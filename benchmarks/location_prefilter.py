@@ -0,0 +1,96 @@
+'''
+Benchmarks the geospatial pre-filter of the location search (retrievers/LocationRetriever.py) against ranking every location.
+
+Builds synthetic location tables of growing size from the cities, counties and coordinates of knowledge_base/locations.csv
+(with jittered coordinates and fake embeddings, so no database or OpenAI key is needed), then runs "<resource> in <city>" queries.
+Reports the ranking latency per query (the query embedding is computed beforehand) and how many of the returned locations
+are within --radius-km of the city asked for. With fake embeddings the full scan returns locations from anywhere, which is what happens
+to the real search whenever a description matches better than the place.
+
+Usage: python -m benchmarks.location_prefilter [--rows 500,5000,20000,50000] [--requests 200]
+'''
+import argparse
+import csv
+import os
+import statistics
+import time
+
+import numpy as np
+
+from embeddings.fake import FakeEmbeddings
+from retrievers.LocationRetriever import build_location_retriever_from_rows, haversine_km
+from retrievers.location_index import LOCATION_COLUMNS
+from retrievers.place_matcher import NOT_PLACES, normalize_place
+
+RESOURCES = ["Dentist", "Food pantry", "Pediatrician", "WIC office", "Mental health support", "Child care"]
+
+def synthetic_locations(base_rows, count, rng):
+    '''
+    Samples count rows from base_rows, moving each one up to about 5 km from its original coordinates
+    '''
+    rows = []
+    for i, index in enumerate(rng.integers(0, len(base_rows), count)):
+        row = dict(base_rows[index])
+        row["id"] = str(i)
+        row["latitude"] = float(row["latitude"] or 0) + rng.uniform(-0.05, 0.05)
+        row["longitude"] = float(row["longitude"] or 0) + rng.uniform(-0.05, 0.05)
+        rows.append(tuple(row[column] for column in LOCATION_COLUMNS))
+
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="500,5000,20000,50000")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--radius-km", type=float, default=40)
+    args = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "knowledge_base", "locations.csv"), newline="", encoding="utf-8") as csv_file:
+        base_rows = list(csv.DictReader(csv_file))
+
+    rng = np.random.default_rng(0)
+    embeddings_model = FakeEmbeddings(size=args.dimensions)
+
+    cities = [city for city in dict.fromkeys(normalize_place(row["city"]) for row in base_rows) if city not in NOT_PLACES][:20]
+    queries = [f"{RESOURCES[i % len(RESOURCES)]} in {cities[i % len(cities)]}" for i in range(args.requests)]
+    query_embeddings = embeddings_model.embed_documents(queries)
+
+    centers = {}
+    for city in cities:
+        coordinates = [(float(row["latitude"]), float(row["longitude"])) for row in base_rows if normalize_place(row["city"]) == city and row["latitude"] and float(row["latitude"])]
+        centers[city] = np.mean(coordinates, axis=0)
+
+    print(f"{'rows':>7} | {'full scan ms':>12} {'nearby':>7} | {'pre-filter ms':>13} {'nearby':>7} {'candidates':>10}")
+
+    for count in [int(count) for count in args.rows.split(",")]:
+        rows = synthetic_locations(base_rows, count, rng)
+        embeddings = rng.standard_normal((count, args.dimensions), dtype=np.float32)
+
+        retriever = build_location_retriever_from_rows(rows, embeddings, LOCATION_COLUMNS, embeddings_model, radius_km=args.radius_km)
+
+        results = {}
+        for name, search in (("full", lambda embedding, query: retriever.get_relevant_documents_by_vector(embedding)),
+                             ("prefilter", retriever.get_relevant_documents_by_vector)):
+            timings = []
+            nearby = 0
+
+            for query, embedding in zip(queries, query_embeddings):
+                start = time.perf_counter()
+                documents = search(embedding, query)
+                timings.append(time.perf_counter() - start)
+
+                locations = [document.metadata["location"] for document in documents]
+                latitude, longitude = centers[query.split(" in ", 1)[1]]
+                distances = haversine_km(latitude, longitude, np.array([location["latitude"] for location in locations]), np.array([location["longitude"] for location in locations]))
+                nearby += int((distances <= args.radius_km).sum())
+
+            results[name] = (statistics.median(timings) * 1000, nearby / (len(queries) * retriever.k))
+
+        # Queries for places without enough locations in the table rank every location
+        candidates = statistics.mean(len(retriever.candidates(query) if retriever.candidates(query) is not None else rows) for query in queries)
+
+        print(f"{count:>7} | {results['full'][0]:>12.3f} {results['full'][1]:>7.0%} | {results['prefilter'][0]:>13.3f} {results['prefilter'][1]:>7.0%} {candidates:>10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+'''
+Benchmarks the latency of the location retrieval path of /search.
+
+Compares building the TableColumnRetriever on every request (the previous behaviour) against the process-wide location index (lifecycle/reloadable.py).
+By default rows come from a fake loader that produces pgvector-formatted embedding strings, so no database or OpenAI key is needed.
+Pass --database-uri to read the real location table instead.
+
+Usage: python -m benchmarks.location_search_latency [--rows 500] [--requests 50] [--database-uri postgresql://...]
+'''
+import argparse
+import statistics
+import time
+import uuid
+
+import numpy as np
+
+from embeddings.fake import FakeEmbeddings
+from retrievers.TableColumnRetriever import build_table_column_retriever, build_table_column_retriever_from_rows
+from lifecycle.reloadable import Reloadable
+from retrievers.location_index import LOCATION_COLUMNS
+
+QUERIES = [
+    "Dental services in Corpus Christi",
+    "Where can I get mental health support in Bryan?",
+    "Food pantry near College Station",
+    "WIC office in Brazos county",
+]
+
+def fake_location_rows(count, dimensions=1536, seed=0):
+    '''
+    Generates rows shaped like the location table, with the embedding column in pgvector text format.
+    '''
+    rng = np.random.default_rng(seed)
+    rows = []
+
+    for i in range(count):
+        values = [str(uuid.UUID(int=i)), f"Location {i}", f"{i} Main Street", "Bryan", "Texas", "United States", "77802",
+                  30.6, -96.3, f"Clinic number {i}", "(979) 555-0100", "Closed", "8:00 AM – 5:00 PM", "8:00 AM – 5:00 PM",
+                  "8:00 AM – 5:00 PM", "8:00 AM – 5:00 PM", "8:00 AM – 5:00 PM", "Closed", "4.5", "https://maps.google.com",
+                  "https://example.org", "Health", "Brazos"]
+        embedding = "[" + ",".join(f"{value:.8f}" for value in rng.standard_normal(dimensions)) + "]"
+        rows.append(tuple(values) + (embedding,))
+
+    return rows
+
+def measure(handler, requests):
+    latencies = []
+
+    for i in range(requests):
+        start = time.perf_counter()
+        handler(QUERIES[i % len(QUERIES)])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return latencies
+
+def report(label, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    print(f"{label:<28} mean {statistics.mean(latencies):9.2f} ms   p50 {statistics.median(latencies):9.2f} ms   p95 {p95:9.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--database-uri")
+    args = parser.parse_args()
+
+    embeddings_model = FakeEmbeddings()
+
+    if args.database_uri:
+        def loader():
+            return build_table_column_retriever(args.database_uri, "location", LOCATION_COLUMNS, "embedding", embeddings_model=embeddings_model)
+    else:
+        rows = fake_location_rows(args.rows)
+
+        def loader():
+            return build_table_column_retriever_from_rows(rows, LOCATION_COLUMNS, embeddings_model)
+
+    def per_request(query):
+        return loader().get_relevant_documents(query)
+
+    index = Reloadable("location index", loader=loader)
+
+    def cached(query):
+        return index.get().get_relevant_documents(query)
+
+    # The first cached request pays for the load, exactly like the first request of a worker process
+    start = time.perf_counter()
+    retriever = index.get()
+    print(f"initial index load: {(time.perf_counter() - start) * 1000:.2f} ms, embedding matrix {retriever.embeddings.nbytes / 2**20:.1f} MiB")
+
+    report("per-request retriever build", measure(per_request, args.requests))
+    report("process-wide location index", measure(cached, args.requests))
+
+    start = time.perf_counter()
+    index.get().get_relevant_documents_batch([QUERIES[i % len(QUERIES)] for i in range(args.requests)])
+    print(f"batched ({args.requests} queries, one GEMM): {(time.perf_counter() - start) * 1000 / args.requests:.2f} ms per query")
+
+if __name__ == "__main__":
+    main()
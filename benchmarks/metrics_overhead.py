@@ -0,0 +1,78 @@
+'''
+Benchmarks the overhead of the instrumentation behind /metrics (monitoring/) and shows what it records for a conversational retrieval chain.
+
+1. The cost of timing a block with monitoring.metrics.stage.
+2. The latency of a ConversationalRetrievalChain (condense question, retrieval and answer, as the previous handlers built it,
+   see benchmarks/answer_pipeline.py) over a fake chat model, with and without the metrics callback handler.
+   The chat model answers instantly, so the difference is the whole cost of the handler.
+Prints the resulting stage histograms and token counters in the Prometheus format. No OpenAI key or database is needed.
+
+Usage: python -m benchmarks.metrics_overhead [--runs 2000]
+'''
+import argparse
+import statistics
+import time
+from typing import List
+
+from langchain.chains import ConversationalRetrievalChain
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+
+from monitoring.langchain_callbacks import metrics_callback_var
+from monitoring.metrics import registry, stage
+
+class StaticRetriever(BaseRetriever):
+    documents: List[Document]
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        return self.documents
+
+def build_chain():
+    chain = ConversationalRetrievalChain.from_llm(
+        llm=FakeListChatModel(responses=["Mastitis is usually treated with antibiotics and continued breastfeeding."]),
+        retriever=StaticRetriever(documents=[Document(page_content="Mastitis is an inflammation of breast tissue.", metadata={ "source": "mastitis.txt" })]),
+        condense_question_llm=FakeListChatModel(responses=["What is mastitis treated with?"])
+    )
+    chain.question_generator.metadata = { "stage": "condense_question" }
+    chain.combine_docs_chain.metadata = { "stage": "answer" }
+
+    return chain
+
+def time_runs(chain, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        chain.invoke({ "question": "and how is it treated?", "chat_history": [("What is mastitis?", "An inflammation of breast tissue.")] })
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=2000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    for _ in range(args.runs * 10):
+        with stage("benchmark"):
+            pass
+    print(f"stage(): {(time.perf_counter() - start) / (args.runs * 10) * 1e6:.2f} us per timed block")
+
+    chain = build_chain()
+
+    token = metrics_callback_var.set(None)
+    without_handler = time_runs(chain, args.runs)
+    metrics_callback_var.reset(token)
+
+    with_handler = time_runs(chain, args.runs)
+
+    print(f"chain run: {without_handler:.3f} ms median without the metrics handler, {with_handler:.3f} ms with it "
+          f"({(with_handler - without_handler) * 1000:+.0f} us)\n")
+
+    for line in registry.render().splitlines():
+        if line.startswith(("ichild_stage_duration_seconds_count", "ichild_stage_duration_seconds_sum", "ichild_retriever_duration_seconds_count", "ichild_llm_tokens_total")):
+            print(line)
+
+if __name__ == "__main__":
+    main()
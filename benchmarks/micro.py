@@ -0,0 +1,131 @@
+'''
+Micro-benchmarks of the retrievers and of the ingestion scripts, with machine-readable results (see benchmarks/results.py).
+
+- TableColumnRetriever.get_relevant_documents (one query) and get_relevant_documents_batch (per query, --batch-size queries per call)
+  over --rows random embeddings, and parsing the pgvector text embeddings of 1000 rows (build_table_column_retriever_from_rows).
+- LocationRetriever.get_relevant_documents over knowledge_base/locations.csv, with a place in the query (neighborhood prefilter) and without.
+- The BM25 search of HybridRetriever over the knowledge base chunks.
+- Ingestion: building the location documents (build_location_documents), splitting the knowledge base (split_documents, chunk_id included)
+  and the embedding throughput of preprocessing.ingestion.embed_batches with a simulated round trip of --embedding-latency seconds.
+Queries are embedded with FakeEmbeddings, so no OpenAI key or database is needed.
+
+Usage: python -m benchmarks.micro [--rows 1000,10000,50000] [--runs 200] [--batch-size 32] [--embedding-latency 0.05] [--output results.json]
+'''
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.location_ingestion import SimulatedEmbeddings
+from benchmarks.location_search_latency import fake_location_rows
+from benchmarks.results import latency_summary, write_results
+from embeddings.fake import FakeEmbeddings
+from preprocessing.ingestion import batched, embed_batches
+from preprocessing.load_docs import split_documents
+from retrievers.HybridRetriever import BM25Index
+from retrievers.LocationRetriever import build_location_retriever_from_rows
+from retrievers.TableColumnRetriever import TableColumnRetriever, build_documents, build_table_column_retriever_from_rows, normalize_embeddings
+from retrievers.location_documents import build_location_documents
+from retrievers.location_index import LOCATION_COLUMNS
+
+QUERIES = [
+    "Dental services in Corpus Christi",
+    "How do hormonal IUDs prevent pregnancy?",
+    "Where can I get mental health support in Bryan?",
+    "What is mastitis treated with?",
+    "food pantry",
+    "prenatal care for uninsured mothers",
+]
+
+def measure(function, runs):
+    '''
+    Calls function(i) runs times and returns the latency summary of the calls
+    '''
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        function(i)
+        timings.append(time.perf_counter() - start)
+
+    return latency_summary(timings)
+
+def read_location_rows():
+    with open(os.path.join(os.path.dirname(__file__), "..", "knowledge_base", "locations.csv"), newline="", encoding="utf-8") as csv_file:
+        return [
+            tuple(float(row[column]) if column in ("latitude", "longitude") and row[column] else row[column] for column in LOCATION_COLUMNS)
+            for row in csv.DictReader(csv_file)
+        ]
+
+def retriever_cases(args, embeddings_model):
+    cases = {}
+    rng = np.random.default_rng(0)
+
+    for rows in [int(count) for count in args.rows.split(",")]:
+        retriever = TableColumnRetriever(
+            documents=build_documents([(str(i),) for i in range(rows)], ["id"]),
+            embeddings=normalize_embeddings(rng.standard_normal((rows, embeddings_model.size), dtype=np.float32), copy=False),
+            k=4,
+            openai_embeddings=embeddings_model
+        )
+
+        cases[f"table_column_retriever.get_relevant_documents@{rows}"] = measure(lambda i: retriever.get_relevant_documents(QUERIES[i % len(QUERIES)]), args.runs)
+
+        batch = [QUERIES[i % len(QUERIES)] for i in range(args.batch_size)]
+        summary = measure(lambda i: retriever.get_relevant_documents_batch(batch), max(1, args.runs // 10))
+        cases[f"table_column_retriever.get_relevant_documents_batch@{rows}"] = { name.replace("_ms", "_per_query_ms"): round(value / args.batch_size, 4) for name, value in summary.items() }
+
+    rows = fake_location_rows(1000)
+    cases["table_column_retriever.build_from_rows@1000"] = measure(lambda i: build_table_column_retriever_from_rows(rows, LOCATION_COLUMNS, embeddings_model), 3)
+
+    location_rows = read_location_rows()
+    location_embeddings = np.asarray(embeddings_model.embed_documents([row[LOCATION_COLUMNS.index("description")] for row in location_rows]), dtype=np.float32)
+    location_retriever = build_location_retriever_from_rows(location_rows, location_embeddings, LOCATION_COLUMNS, embeddings_model)
+
+    cases["location_retriever.get_relevant_documents.place"] = measure(lambda i: location_retriever.get_relevant_documents("Dental services in Corpus Christi"), args.runs)
+    cases["location_retriever.get_relevant_documents.no_place"] = measure(lambda i: location_retriever.get_relevant_documents("food pantry"), args.runs)
+
+    return cases
+
+def ingestion_cases(args):
+    cases = {}
+
+    location_rows = read_location_rows()
+    cases[f"build_location_documents@{len(location_rows)}"] = measure(lambda i: build_location_documents(location_rows, LOCATION_COLUMNS), 10)
+
+    knowledge_base = os.path.join(os.path.dirname(__file__), "..", "knowledge_base")
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=200, chunk_overlap=0)
+    cases["split_documents.knowledge_base"] = measure(lambda i: split_documents(knowledge_base, "benchmark", text_splitter), 3)
+
+    chunks, _ = split_documents(knowledge_base, "benchmark", text_splitter)
+    lexical_index = BM25Index(chunks)
+    cases[f"bm25.search@{len(chunks)}"] = measure(lambda i: lexical_index.search(QUERIES[i % len(QUERIES)], 10), args.runs)
+
+    texts = [chunk.page_content for chunk in chunks[:1000]]
+    embeddings_model = SimulatedEmbeddings(args.embedding_latency, per_text_latency=0, failure_rate=0)
+    start = time.perf_counter()
+    embedded = sum(len(embeddings) for _, embeddings, error in embed_batches(embeddings_model, batched(texts, 100), max_concurrency=4) if not error)
+    cases["embed_batches@1000"] = { "rows_per_s": round(embedded / (time.perf_counter() - start), 1) }
+
+    return cases
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1000,10000,50000", help="comma separated sizes of the TableColumnRetriever")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--output", help="path of the JSON results (default benchmarks/results/micro-<time>.json)")
+    args = parser.parse_args()
+
+    cases = { **retriever_cases(args, FakeEmbeddings()), **ingestion_cases(args) }
+
+    for case, metrics in cases.items():
+        print(f"{case:<60} " + "   ".join(f"{name} {value:.3f}" for name, value in metrics.items() if name in ("p50_ms", "p95_ms", "p50_per_query_ms", "p95_per_query_ms", "rows_per_s")))
+
+    write_results("micro", cases, { key: value for key, value in vars(args).items() if key != "output" }, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+'''
+Evaluates the local query router (route_handlers/query_router.py) on a labeled set of queries.
+
+Reports how many queries the router decides locally (coverage), the accuracy of those decisions, the router latency
+and the classification latency saved, assuming each locally routed query skips one gpt-4o round trip of --llm-latency seconds.
+With --llm the queries the router defers are also classified with gpt-4o (needs OPENAI_API_KEY) to report end-to-end accuracy.
+
+Usage: python -m benchmarks.query_routing [--eval-set benchmarks/data/routing_eval.csv] [--llm-latency 0.6] [--llm] [--verbose]
+'''
+import argparse
+import csv
+import os
+import time
+
+from route_handlers.query_router import query_router
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--eval-set", default=os.path.join(os.path.dirname(__file__), "data", "routing_eval.csv"))
+    parser.add_argument("--llm-latency", type=float, default=0.6)
+    parser.add_argument("--llm", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.eval_set, newline="", encoding="utf-8") as eval_file:
+        examples = list(csv.DictReader(eval_file))
+
+    routed = correct = 0
+    deferred = []
+    router_seconds = 0.0
+
+    for example in examples:
+        start = time.perf_counter()
+        route = query_router.route(example["query"])
+        router_seconds += time.perf_counter() - start
+
+        if route is None:
+            deferred.append(example)
+        else:
+            routed += 1
+            correct += route == example["label"]
+
+        if args.verbose and route != example["label"]:
+            print(f"{str(route):<28} expected {example['label']:<28} {example['query']}")
+
+    print(f"examples:              {len(examples)}")
+    print(f"routed locally:        {routed} ({routed / len(examples):.0%})")
+    print(f"local accuracy:        {correct / routed if routed else 0:.1%}")
+    print(f"router latency:        {router_seconds / len(examples) * 1e6:.1f} us per query")
+    print(f"classification saved:  {routed * args.llm_latency / len(examples) * 1000:.0f} ms per query on average (at {args.llm_latency * 1000:.0f} ms per gpt-4o call)")
+
+    if args.llm:
+        from route_handlers.query_classifier import classify_query
+
+        llm_correct = sum(classify_query(example["query"]) == example["label"] for example in deferred)
+        print(f"end-to-end accuracy:   {(correct + llm_correct) / len(examples):.1%} (gpt-4o on the {len(deferred)} deferred queries)")
+
+if __name__ == "__main__":
+    main()
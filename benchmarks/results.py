@@ -0,0 +1,122 @@
+'''
+Machine-readable results of the benchmark suite (benchmarks/load_test.py and benchmarks/micro.py), so runs can be compared.
+
+Each run is written as a JSON file holding the environment (git commit, Python, CPU count, time) and a dict of cases,
+each a dict of numeric metrics. Metric names carry their direction: *_ms and *_s are lower-is-better, *_per_s and hit rates
+are higher-is-better, anything else is informative only.
+
+Compare two runs (exits with status 1 if a metric regressed by more than --threshold):
+    python -m benchmarks.results baseline.json current.json [--threshold 0.1]
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "results")
+
+def latency_summary(seconds):
+    '''
+    p50/p95/p99/mean/max (in milliseconds) of a list of latencies in seconds
+    '''
+    if not seconds:
+        return {}
+
+    milliseconds = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(milliseconds.mean()), 3),
+        "max_ms": round(float(milliseconds.max()), 3)
+    }
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    }
+
+def write_results(suite, cases, parameters, path=None):
+    '''
+    Writes the cases of a run to path (default benchmarks/results/<suite>-<time>.json) and returns the path
+    '''
+    if path is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        path = os.path.join(RESULTS_DIRECTORY, f"{suite}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+
+    with open(path, "w", encoding="utf-8") as results_file:
+        json.dump({ "suite": suite, "environment": environment(), "parameters": parameters, "cases": cases }, results_file, indent=2)
+
+    print(f"Results written to {path}")
+
+    return path
+
+def direction(metric):
+    '''
+    1 if a higher value is better, -1 if a lower value is better, 0 if the metric is informative only
+    '''
+    if metric.endswith("_per_s") or metric.endswith("hit_rate") or metric.startswith("recall"):
+        return 1
+    if metric.endswith("_ms") or metric.endswith("_s") or metric == "errors":
+        return -1
+
+    return 0
+
+def compare_results(baseline, current, threshold=0.1):
+    '''
+    Returns (case, metric, baseline value, current value, relative change, regressed) for every metric present in both runs
+    '''
+    comparisons = []
+
+    for case, metrics in current["cases"].items():
+        for metric, value in metrics.items():
+            previous = baseline["cases"].get(case, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)):
+                continue
+
+            change = (value - previous) / previous if previous else 0.0
+            regressed = direction(metric) != 0 and -direction(metric) * change > threshold
+
+            comparisons.append((case, metric, previous, value, change, regressed))
+
+    return comparisons
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as baseline_file, open(args.current, encoding="utf-8") as current_file:
+        baseline, current = json.load(baseline_file), json.load(current_file)
+
+    print(f"baseline {baseline['environment'].get('commit')} ({baseline['environment'].get('time')}), current {current['environment'].get('commit')} ({current['environment'].get('time')})")
+
+    comparisons = compare_results(baseline, current, args.threshold)
+    for case, metric, previous, value, change, regressed in comparisons:
+        print(f"{case:<45} {metric:<16} {previous:>12.3f} {value:>12.3f} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+
+    regressions = sum(regressed for *_, regressed in comparisons)
+    print(f"{regressions} regressions beyond {args.threshold:.0%}")
+
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
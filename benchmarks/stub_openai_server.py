@@ -0,0 +1,179 @@
+'''
+Local stand-in for the OpenAI API used to measure request latency without network access or API costs.
+
+Serves /v1/chat/completions and /v1/embeddings with deterministic responses after a configurable delay:
+- chat completions that carry tools answer with a tool call (search_location_questions when the query names a place, search_direct_questions otherwise)
+- other chat completions answer with a short canned text, streamed word by word as SSE chunks when the request sets stream
+- embeddings are the deterministic vectors of embeddings.fake.FakeEmbeddings
+
+Point the application at it with:
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub
+
+Usage: python -m benchmarks.stub_openai_server [--port 8765] [--chat-latency 0.5] [--classification-latency 0.6] [--embedding-latency 0.15]
+'''
+import argparse
+import base64
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from embeddings.fake import FakeEmbeddings
+
+LOCATION_PATTERN = re.compile(r"\b(in|near|around|where)\b", re.IGNORECASE)
+
+ANSWER = "This is a stubbed answer generated locally for benchmarking purposes."
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        if self.path.endswith("/chat/completions"):
+            self.chat_completion(body)
+        elif self.path.endswith("/embeddings"):
+            self.embeddings(body)
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def chat_completion(self, body):
+        config = self.server.config
+        query = body["messages"][-1]["content"] if body.get("messages") else ""
+
+        if body.get("tools"):
+            time.sleep(config["classification_latency"])
+
+            name = "search_location_questions" if LOCATION_PATTERN.search(query) else "search_direct_questions"
+            message = {
+                "role": "assistant",
+                "content": None,
+                "refusal": None,
+                "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex}",
+                    "type": "function",
+                    "function": { "name": name, "arguments": json.dumps({ "id": None, "query": query }) }
+                }]
+            }
+            finish_reason = "tool_calls"
+        elif body.get("stream"):
+            return self.stream_chat_completion(body)
+        else:
+            time.sleep(config["chat_latency"])
+
+            message = { "role": "assistant", "content": ANSWER, "refusal": None }
+            finish_reason = "stop"
+
+        self.send_json({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{ "index": 0, "message": message, "logprobs": None, "finish_reason": finish_reason }],
+            "usage": { "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0 }
+        })
+
+    def stream_chat_completion(self, body):
+        # Half of the latency is spent before the first token, the rest is spread over the remaining tokens
+        words = ANSWER.split(" ")
+        delay = self.server.config["chat_latency"] / 2
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        for i, word in enumerate(words):
+            time.sleep(delay if i == 0 else delay / len(words))
+
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [{ "index": 0, "delta": { "role": "assistant", "content": word if i == 0 else " " + word }, "logprobs": None, "finish_reason": None }]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        chunk["choices"] = [{ "index": 0, "delta": {}, "logprobs": None, "finish_reason": "stop" }]
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def embeddings(self, body):
+        time.sleep(self.server.config["embedding_latency"])
+
+        inputs = body["input"]
+        # A single string, a list of strings or (as sent by LangChain) a list of token id lists
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+
+        data = []
+        for i, text in enumerate(inputs):
+            vector = self.server.embeddings_model.embed_query(text if isinstance(text, str) else json.dumps(text))
+
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+            data.append({ "object": "embedding", "index": i, "embedding": vector })
+
+        self.send_json({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-ada-002"),
+            "usage": { "prompt_tokens": 0, "total_tokens": 0 }
+        })
+
+def start_stub_server(port=0, chat_latency=0.5, classification_latency=0.6, embedding_latency=0.15):
+    '''
+    Starts the stub server on a background thread and returns it. The base url is f"http://127.0.0.1:{server.server_port}/v1".
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubOpenAIHandler)
+    server.daemon_threads = True
+    server.config = {
+        "chat_latency": chat_latency,
+        "classification_latency": classification_latency,
+        "embedding_latency": embedding_latency
+    }
+    server.embeddings_model = FakeEmbeddings()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--classification-latency", type=float, default=0.6)
+    parser.add_argument("--embedding-latency", type=float, default=0.15)
+    args = parser.parse_args()
+
+    server = start_stub_server(args.port, args.chat_latency, args.classification_latency, args.embedding_latency)
+    print(f"Stub OpenAI server listening on http://127.0.0.1:{server.server_port}/v1")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+'''
+Measures how much of the /search latency is saved by overlapping classification with the query embedding and retrieval.
+
+Runs against the local stub OpenAI server (benchmarks/stub_openai_server.py), so no network or API key is needed.
+Location retrieval uses an in-memory index over fake rows and knowledge base retrieval is simulated with a fixed delay (--kb-latency)
+standing in for the PGVector MMR query. Both the sequential pipeline (classify, then embed, then retrieve, then answer)
+and the speculative pipeline used by app.unified_search are timed end to end.
+
+Usage: python -m benchmarks.unified_search_overlap [--requests 20] [--kb-latency 0.08]
+'''
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from benchmarks.location_search_latency import fake_location_rows
+from benchmarks.stub_openai_server import start_stub_server
+from route_handlers.speculative_search import speculative_search
+
+QUERIES = [
+    "Dental services in Corpus Christi",
+    "How do hormonal IUDs prevent pregnancy?",
+    "Where can I get mental health support in Bryan?",
+    "What is mastitis treated with?",
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--kb-latency", type=float, default=0.08)
+    args = parser.parse_args()
+
+    server = start_stub_server()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    # Imported after the environment points the OpenAI clients at the stub server
+    import openai
+    from embeddings.fake import FakeEmbeddings
+    from retrievers.TableColumnRetriever import build_table_column_retriever_from_rows
+    from retrievers.location_index import LOCATION_COLUMNS
+    from route_handlers.query_classifier import classify_query
+
+    location_retriever = build_table_column_retriever_from_rows(fake_location_rows(200), LOCATION_COLUMNS, FakeEmbeddings())
+
+    # Calls the embeddings endpoint directly (LangChain's OpenAIEmbeddings would download a tiktoken encoding first)
+    def embed_query(search_query):
+        return openai.embeddings.create(model="text-embedding-ada-002", input=search_query).data[0].embedding
+
+    def retrieve_direct_documents(query_embedding):
+        time.sleep(args.kb_latency)
+        return location_retriever.get_relevant_documents_by_vector(query_embedding)
+
+    retrievers = {
+        "search_direct_questions": retrieve_direct_documents,
+        "search_location_questions": location_retriever.get_relevant_documents_by_vector
+    }
+
+    def answer(search_query, documents):
+        return openai.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": search_query}])
+
+    def sequential(search_query):
+        function_name = classify_query(search_query)
+        documents = retrievers[function_name](embed_query(search_query))
+        answer(search_query, documents)
+
+    def speculative(search_query):
+        # Like asgiref (which runs Flask async views), do not wait for cancelled worker threads when closing the loop
+        loop = asyncio.new_event_loop()
+        try:
+            result = loop.run_until_complete(speculative_search(search_query, classify_query, embed_query, retrievers))
+        finally:
+            loop.close()
+
+        answer(search_query, result.documents)
+
+    for label, pipeline in [("sequential", sequential), ("speculative", speculative)]:
+        latencies = []
+        for i in range(args.requests):
+            start = time.perf_counter()
+            pipeline(QUERIES[i % len(QUERIES)])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        print(f"{label:<12} mean {statistics.mean(latencies):8.1f} ms   p50 {statistics.median(latencies):8.1f} ms   max {max(latencies):8.1f} ms")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
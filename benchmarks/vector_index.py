@@ -0,0 +1,167 @@
+'''
+Benchmarks the recall and latency of nearest neighbor search over pgvector columns at several table sizes.
+
+For each size of --sizes, a synthetic table (bench_vector_index) is filled with clustered, L2-normalized random embeddings
+(shaped like the location table: id and embedding) and searched with ORDER BY embedding <=> query LIMIT k:
+- exact: sequential scan (no index), the only plan available before database/indexes.py,
+- hnsw with each --ef-search and ivfflat with each --probes, built like ensure_vector_indexes builds them (VECTOR_INDEX_* variables).
+The in-memory scan of LocationRetriever (one matrix product over every embedding, numpy) is timed as well, with the memory it takes per worker.
+Recall@k is measured against the exact neighbors computed in numpy. The table is dropped afterwards.
+
+Without --database-uri (or DATABASE_URI), only the in-memory scan is measured. Building HNSW over a million 1536 dimensional rows takes
+a long time, pass smaller --sizes or --dimensions for a quick run.
+
+Usage: python -m benchmarks.vector_index [--sizes 10000,100000,1000000] [--dimensions 1536] [--queries 100] [--database-uri postgresql://...]
+'''
+import argparse
+import os
+import statistics
+import time
+
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+
+from database.indexes import create_vector_index_sql, ivfflat_lists, vector_index_config_from_env
+from retrievers.TableColumnRetriever import normalize_embeddings, top_k_indices
+
+TABLE_NAME = "bench_vector_index"
+CHUNK_SIZE = 20000
+CLUSTERS = 500
+
+def cluster_centers(dimensions, seed=0):
+    return np.random.default_rng(seed).standard_normal((CLUSTERS, dimensions)).astype(np.float32)
+
+def embedding_chunks(size, centers, seed=0):
+    '''
+    Yields (first id, embeddings) chunks of size embeddings spread around the centers. Chunks are regenerated from their seed,
+    so the whole table never has to be held in memory.
+    '''
+    for start in range(0, size, CHUNK_SIZE):
+        rng = np.random.default_rng([seed, start])
+        count = min(CHUNK_SIZE, size - start)
+
+        embeddings = centers[rng.integers(0, CLUSTERS, count)] + rng.standard_normal((count, centers.shape[1]), dtype=np.float32)
+
+        yield start, normalize_embeddings(embeddings, copy=False)
+
+def exact_neighbors(size, centers, queries, k):
+    '''
+    Exact top-k ids of every query, merged chunk by chunk, and the seconds one query spends scanning every chunk (the in-memory retriever)
+    '''
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    best_similarities = np.empty((len(queries), 0), dtype=np.float32)
+    scan_seconds = 0.0
+
+    for start, embeddings in embedding_chunks(size, centers):
+        query_start = time.perf_counter()
+        embeddings @ queries[0]
+        scan_seconds += time.perf_counter() - query_start
+
+        similarities = np.hstack([best_similarities, (embeddings @ queries.T).T])
+        ids = np.hstack([best_ids, np.broadcast_to(np.arange(start, start + len(embeddings)), (len(queries), len(embeddings)))])
+
+        keep = np.array([top_k_indices(row, k) for row in similarities])
+        best_similarities = np.take_along_axis(similarities, keep, axis=1)
+        best_ids = np.take_along_axis(ids, keep, axis=1)
+
+    return best_ids, scan_seconds
+
+def load_table(conn, size, centers):
+    conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+    conn.execute(f"CREATE TABLE {TABLE_NAME} (id bigint PRIMARY KEY, embedding vector({centers.shape[1]}))")
+
+    with conn.cursor().copy(f"COPY {TABLE_NAME} (id, embedding) FROM STDIN WITH (FORMAT BINARY)") as copy:
+        copy.set_types(["int8", "vector"])
+
+        for start, embeddings in embedding_chunks(size, centers):
+            for i, embedding in enumerate(embeddings):
+                copy.write_row((start + i, embedding))
+
+    conn.execute(f"ANALYZE {TABLE_NAME}")
+    conn.commit()
+
+def search(conn, queries, k, truth):
+    '''
+    Runs every query, returns the median and 95th percentile latency in ms and the mean recall@k
+    '''
+    timings = []
+    recalls = []
+
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        ids = [id for id, in conn.execute(f"SELECT id FROM {TABLE_NAME} ORDER BY embedding <=> %s LIMIT %s", (query, k))]
+        timings.append((time.perf_counter() - start) * 1000)
+
+        recalls.append(len(set(ids) & set(expected.tolist())) / k)
+
+    return statistics.median(timings), np.percentile(timings, 95), statistics.mean(recalls)
+
+def report(label, median, p95, recall):
+    print(f"  {label:<28} {median:9.2f} ms median {p95:9.2f} ms p95   recall@k {recall:6.1%}")
+
+def benchmark_database(database_uri, size, centers, queries, truth, args):
+    config = vector_index_config_from_env()
+
+    with psycopg.connect(database_uri) as conn:
+        conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        register_vector(conn)
+
+        start = time.perf_counter()
+        load_table(conn, size, centers)
+        print(f"  loaded in {time.perf_counter() - start:.1f} s")
+
+        conn.autocommit = True
+        conn.execute(f"SET maintenance_work_mem = '{args.maintenance_work_mem}'")
+
+        try:
+            report("exact (sequential scan)", *search(conn, queries[:args.exact_queries], args.k, truth))
+
+            for index_type, settings in (("hnsw", [f"SET hnsw.ef_search = {ef_search}" for ef_search in args.ef_search]),
+                                         ("ivfflat", [f"SET ivfflat.probes = {probes}" for probes in args.probes])):
+                start = time.perf_counter()
+                conn.execute(create_vector_index_sql(TABLE_NAME, "embedding", config._replace(index_type=index_type), size))
+                build_seconds = time.perf_counter() - start
+
+                detail = f"m {config.hnsw_m}, ef_construction {config.hnsw_ef_construction}" if index_type == "hnsw" else f"lists {config.ivfflat_lists or ivfflat_lists(size)}"
+                print(f"  {index_type} ({detail}) built in {build_seconds:.1f} s")
+
+                for setting in settings:
+                    conn.execute(setting)
+                    report(setting.removeprefix("SET "), *search(conn, queries, args.k, truth))
+
+                conn.execute(f"DROP INDEX IF EXISTS ix_{TABLE_NAME}_embedding_{index_type}")
+        finally:
+            conn.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--exact-queries", type=int, default=10, help="queries timed without an index (sequential scans are slow)")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--ef-search", type=lambda value: [int(v) for v in value.split(",")], default=[20, 40, 100])
+    parser.add_argument("--probes", type=lambda value: [int(v) for v in value.split(",")], default=[1, 10, 40])
+    parser.add_argument("--maintenance-work-mem", default="1GB")
+    parser.add_argument("--database-uri", default=os.getenv("DATABASE_URI"))
+    args = parser.parse_args()
+
+    # psycopg takes plain libpq URIs (postgresql://...), not SQLAlchemy ones (postgresql+psycopg://...)
+    database_uri = args.database_uri.replace("+psycopg", "") if args.database_uri else None
+
+    centers = cluster_centers(args.dimensions)
+    rng = np.random.default_rng(1)
+    queries = normalize_embeddings(centers[rng.integers(0, CLUSTERS, args.queries)] + rng.standard_normal((args.queries, args.dimensions), dtype=np.float32))
+
+    for size in (int(size) for size in args.sizes.split(",")):
+        truth, scan_seconds = exact_neighbors(size, centers, queries, args.k)
+
+        print(f"{size} rows of {args.dimensions} dimensions")
+        print(f"  {'in memory (numpy scan)':<28} {scan_seconds * 1000:9.2f} ms per query, {size * args.dimensions * 4 / 2 ** 20:.0f} MB of embeddings per worker")
+
+        if database_uri:
+            benchmark_database(database_uri, size, centers, queries, truth, args)
+
+if __name__ == "__main__":
+    main()
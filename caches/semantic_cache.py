@@ -0,0 +1,270 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import text
+
+from database.engine import get_engine
+from lifecycle.lazy import Lazy
+
+def normalize_query(query):
+    '''
+    Normalizes query text so trivially different spellings of a question share a cache key
+    e.g. "Dental services in Corpus Christi?" and "dental  services in corpus christi" both become "dental services in corpus christi"
+    '''
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+def _unit_vector(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+
+    return vector / norm if norm else vector
+
+class InMemoryCacheBackend:
+    '''
+    Process local cache backend with LRU eviction.
+
+    Embeddings are kept in a preallocated float32 matrix (one slot per entry) so a similarity lookup is a single matrix-vector product.
+    '''
+
+    def __init__(self, max_entries=1000, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # key -> (slot, value, created_at), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._keys = [None] * max_entries
+        # Place of the question of each slot (see SemanticCache)
+        self._places = np.full(max_entries, None, dtype=object)
+        self._occupied = np.zeros(max_entries, dtype=bool)
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._embeddings = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            if self._expired(entry):
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+
+            return entry[1]
+
+    def search(self, embedding, place=None):
+        '''
+        Returns (key, value, similarity) of the entry most similar to embedding among the entries of the same place, or None
+        '''
+        with self._lock:
+            if not self._entries or self._embeddings is None:
+                return None
+
+            similarities = self._embeddings @ _unit_vector(embedding)
+            # Empty slots hold zero vectors and entries of other places cannot be served, push them below any real similarity
+            similarities[~self._occupied] = -np.inf
+            similarities[self._places != place] = -np.inf
+
+            slot = int(np.argmax(similarities))
+            if similarities[slot] == -np.inf:
+                return None
+
+            key = self._keys[slot]
+            entry = self._entries[key]
+
+            if self._expired(entry):
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+
+            return key, entry[1], float(similarities[slot])
+
+    def put(self, key, embedding, value):
+        '''
+        Stores value under key and returns the number of entries evicted to make room for it.
+        '''
+        evicted = 0
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            if not self._free_slots:
+                least_recently_used = next(iter(self._entries))
+                self._remove(least_recently_used)
+                evicted += 1
+
+            vector = _unit_vector(embedding)
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+
+            slot = self._free_slots.pop()
+            self._embeddings[slot] = vector
+            self._keys[slot] = key
+            self._places[slot] = value.get("place")
+            self._occupied[slot] = True
+            self._entries[key] = (slot, value, time.time())
+
+        return evicted
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry[2] > self.ttl
+
+    def _remove(self, key):
+        slot, _, _ = self._entries.pop(key)
+
+        self._embeddings[slot] = 0
+        self._keys[slot] = None
+        self._places[slot] = None
+        self._occupied[slot] = False
+        self._free_slots.append(slot)
+
+class PostgresCacheBackend:
+    '''
+    Cache backend shared by every worker, stored in the query_cache table (see database.database.QueryCache).
+
+    Expired entries and the least recently used entries beyond max_entries are deleted whenever an entry is stored.
+    '''
+
+    def __init__(self, engine, max_entries=10000, ttl=86400):
+        self.engine = engine
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key):
+        with self.engine.begin() as conn:
+            row = conn.execute(text(
+                "UPDATE query_cache SET last_hit_at = now() "
+                "WHERE key = :key AND created_at > now() - make_interval(secs => :ttl) "
+                "RETURNING value"
+            ), { "key": key, "ttl": self._ttl_seconds() }).fetchone()
+
+        return row[0] if row else None
+
+    def search(self, embedding, place=None):
+        with self.engine.begin() as conn:
+            row = conn.execute(text(
+                "SELECT key, value, 1 - (embedding <=> CAST(:embedding AS vector)) AS similarity FROM query_cache "
+                "WHERE created_at > now() - make_interval(secs => :ttl) AND value->>'place' IS NOT DISTINCT FROM :place "
+                "ORDER BY embedding <=> CAST(:embedding AS vector) LIMIT 1"
+            ), { "embedding": _to_vector_literal(embedding), "ttl": self._ttl_seconds(), "place": place }).fetchone()
+
+            if row is None:
+                return None
+
+            conn.execute(text("UPDATE query_cache SET last_hit_at = now() WHERE key = :key"), { "key": row[0] })
+
+        return row[0], row[1], float(row[2])
+
+    def put(self, key, embedding, value):
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO query_cache (key, embedding, value, created_at, last_hit_at) "
+                "VALUES (:key, CAST(:embedding AS vector), CAST(:value AS jsonb), now(), now()) "
+                "ON CONFLICT (key) DO UPDATE SET embedding = EXCLUDED.embedding, value = EXCLUDED.value, created_at = now(), last_hit_at = now()"
+            ), { "key": key, "embedding": _to_vector_literal(embedding), "value": json.dumps(value) })
+
+            evicted = conn.execute(text(
+                "DELETE FROM query_cache WHERE created_at <= now() - make_interval(secs => :ttl) "
+                "OR key IN (SELECT key FROM query_cache ORDER BY last_hit_at DESC OFFSET :max_entries)"
+            ), { "ttl": self._ttl_seconds(), "max_entries": self.max_entries })
+
+        return evicted.rowcount
+
+    def _ttl_seconds(self):
+        # make_interval needs a number, an entry without ttl effectively never expires
+        return self.ttl if self.ttl is not None else 10 ** 9
+
+def _to_vector_literal(embedding):
+    return "[" + ",".join(str(float(value)) for value in embedding) + "]"
+
+class SemanticCache:
+    '''
+    Caches the classification and response of unified search for repeated questions.
+
+    A question is a hit when its normalized text was seen before (no embedding needed) or when its embedding is at least
+    similarity_threshold (cosine) similar to a cached question about the same place. Questions that only differ by their place
+    ("Dental services in Bryan" and "Dental services in Corpus Christi") embed almost identically, so each entry is stored with the place
+    its question mentions (see route_handlers.query_handlers.query_place) and a similar question is only served the entries of its own place.
+    Only questions without prior conversation history are cached or served, since the condensed question (and therefore the answer)
+    of a follow-up depends on chat_history.
+    '''
+
+    def __init__(self, backend, similarity_threshold=0.95):
+        self.backend = backend
+        self.similarity_threshold = similarity_threshold
+
+        self._counters = { "exact_hits": 0, "semantic_hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0 }
+        self._lock = threading.Lock()
+
+    def lookup_exact(self, query):
+        value = self.backend.get(normalize_query(query))
+
+        if value is not None:
+            self._count("exact_hits")
+
+        return value
+
+    def lookup_similar(self, query_embedding, place=None):
+        match = self.backend.search(query_embedding, place)
+
+        if match is not None and match[2] >= self.similarity_threshold:
+            self._count("semantic_hits")
+            return match[1]
+
+        self._count("misses")
+
+        return None
+
+    def store(self, query, query_embedding, value, place=None):
+        evicted = self.backend.put(normalize_query(query), query_embedding, { **value, "place": place })
+
+        self._count("stores")
+        self._count("evictions", evicted)
+
+    def bypass(self):
+        self._count("bypassed")
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+
+        lookups = counters["exact_hits"] + counters["semantic_hits"] + counters["misses"]
+        counters["hit_rate"] = (counters["exact_hits"] + counters["semantic_hits"]) / lookups if lookups else 0.0
+
+        return counters
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+def build_query_cache():
+    '''
+    Builds the unified search cache from the environment:
+    QUERY_CACHE_BACKEND (memory, postgres or none), QUERY_CACHE_SIMILARITY_THRESHOLD, QUERY_CACHE_TTL_SECONDS and QUERY_CACHE_MAX_ENTRIES
+    '''
+    backend_name = os.getenv("QUERY_CACHE_BACKEND", "memory")
+    ttl = float(os.getenv("QUERY_CACHE_TTL_SECONDS", 86400))
+    max_entries = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 1000))
+
+    if backend_name == "none":
+        return None
+
+    if backend_name == "postgres":
+        backend = PostgresCacheBackend(get_engine(), max_entries=max_entries, ttl=ttl)
+    else:
+        backend = InMemoryCacheBackend(max_entries=max_entries, ttl=ttl)
+
+    return SemanticCache(backend, similarity_threshold=float(os.getenv("QUERY_CACHE_SIMILARITY_THRESHOLD", 0.95)))
+
+# None when QUERY_CACHE_BACKEND is none, built on first use (query_cache.get())
+query_cache = Lazy("query_cache", build_query_cache)
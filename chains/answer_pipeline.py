@@ -0,0 +1,137 @@
+import os
+import re
+from collections import namedtuple
+
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.chains.question_answering.stuff_prompt import PROMPT_SELECTOR
+from langchain_core.messages import AIMessage, HumanMessage
+
+from database.engine import get_engine
+from memory.bounded_history import build_chat_history
+
+# auto: questions that read as self-contained are answered without rewriting them (see is_self_contained), always: every question of a conversation is rewritten
+CONDENSE_QUESTION_MODES = ("auto", "always")
+
+# Words referring back to the conversation ("is it free?", "any others near there?", "is the second location open?", "which is closest to me?")
+FOLLOW_UP_WORDS = {
+    "it", "its", "it's", "they", "them", "their", "theirs", "this", "that", "these", "those", "there",
+    "he", "him", "his", "she", "her", "hers", "one", "ones", "same", "else", "other", "others", "another",
+    "more", "also", "too", "again", "previous", "above", "former", "latter",
+    "any", "either", "neither", "both", "each",
+    "first", "second", "third", "fourth", "fifth", "last", "next",
+    "closest", "nearest", "closer", "nearer", "farthest", "cheapest", "best"
+}
+
+# Openings of questions that continue the previous one ("and in Bryan?", "what about dental care?")
+FOLLOW_UP_OPENINGS = ("and ", "but ", "or ", "so ", "then ", "what about ", "how about ")
+
+# "there" of "are there", "is there any", ... does not refer to a place mentioned before
+EXISTENTIAL_THERE = re.compile(r"\b(?:is|are|was|were) there\b|\bthere (?:is|are|was|were)\b")
+
+# Questions of fewer words are taken as follow-ups ("why?", "in Bryan?")
+MIN_SELF_CONTAINED_WORDS = 3
+
+# Short questions with a definite article are about something already mentioned ("what are the side effects?")
+SHORT_QUESTION_WORDS = 6
+
+# question: as asked, standalone_question: rewritten with the conversation (or the question itself), documents: retrieved for standalone_question,
+# chat_history: history of the conversation the exchange is added to
+PreparedQuestion = namedtuple("PreparedQuestion", ["question", "standalone_question", "documents", "chat_history"])
+
+def is_self_contained(question):
+    '''
+    Cheap check that a question can be answered without the conversation: no pronoun or word referring back to it, no continuation opening,
+    at least MIN_SELF_CONTAINED_WORDS words and no definite article in a short question. Questions it rejects are rewritten by the LLM,
+    as they all were before, so it errs on the side of rejecting (see benchmarks/answer_pipeline.py for its accuracy).
+    '''
+    normalized = " ".join(question.lower().split())
+    words = re.findall(r"[a-z']+", EXISTENTIAL_THERE.sub(" ", normalized))
+
+    if len(words) < MIN_SELF_CONTAINED_WORDS or normalized.startswith(FOLLOW_UP_OPENINGS):
+        return False
+    if len(words) < SHORT_QUESTION_WORDS and "the" in words:
+        return False
+
+    return FOLLOW_UP_WORDS.isdisjoint(words)
+
+def join_page_contents(documents):
+    return "\n\n".join(document.page_content for document in documents)
+
+def condense_question_mode_from_env():
+    mode = os.getenv("CONDENSE_QUESTION", "auto").lower()
+    if mode not in CONDENSE_QUESTION_MODES:
+        raise ValueError(f"CONDENSE_QUESTION should be one of {', '.join(CONDENSE_QUESTION_MODES)}, got {mode}")
+
+    return mode
+
+class AnswerPipeline:
+    '''
+    Answers the questions of a conversation from retrieved documents, with the prompts of ConversationalRetrievalChain but without its overhead:
+
+    - documents already retrieved for the question (speculative search) are used as they are, the retriever only runs for a rewritten question,
+    - the question is only rewritten into a standalone question (one more LLM round trip) when the conversation has history
+      and the question does not read as self-contained (see is_self_contained), the history is not even loaded otherwise,
+    - the question can be rewritten by a smaller, faster model than the one answering (condense_question_llm).
+
+    Built once per route and shared by every request. prepare() and generate() can be called separately to send the documents
+    before the answer is generated (see route_handlers/streaming_handlers.py), run() does both.
+    '''
+
+    def __init__(self, llm, retrieve, condense_question_llm=None, memory_config=None, condense_mode="auto", build_context=None):
+        self.llm = llm
+        self.retrieve = retrieve
+        self.condense_question_llm = condense_question_llm or llm
+        self.memory_config = memory_config
+        self.condense_mode = condense_mode
+        # Context of the answer prompt from the documents, every document in order by default (see chains/context_builder.py)
+        self.build_context = build_context or join_page_contents
+
+        self.answer_prompt = PROMPT_SELECTOR.get_prompt(llm)
+
+    def prepare(self, id, question, documents=None):
+        '''
+        Rewrites question into a standalone question if needed and returns a PreparedQuestion with the documents to answer it from.
+        documents, if given, were retrieved for question and are used unless the question was rewritten.
+        '''
+        # The rolling summary of the "summary" memory mode is written by the condensation model
+        chat_history = build_chat_history(id, get_engine(), self.memory_config, summary_llm=self.condense_question_llm)
+
+        standalone_question = question
+        if self.condense_mode == "always" or not is_self_contained(question):
+            chat_history_text = _get_chat_history(chat_history.messages)
+            if chat_history_text:
+                standalone_question = self.condense_question(question, chat_history_text)
+
+        if documents is None or standalone_question != question:
+            documents = self.retrieve(standalone_question)
+
+        return PreparedQuestion(question, standalone_question, documents, chat_history)
+
+    def condense_question(self, question, chat_history_text):
+        result = self.condense_question_llm.invoke(
+            CONDENSE_QUESTION_PROMPT.format(chat_history=chat_history_text, question=question), config={ "metadata": { "stage": "condense_question" } })
+
+        return getattr(result, "content", result).strip() or question
+
+    def generate(self, prepared, llm=None, callbacks=None):
+        '''
+        Answers a prepared question with llm (default: the pipeline's, e.g. a streaming one instead) and adds the exchange to the conversation
+        '''
+        context = self.build_context(prepared.documents)
+        messages = self.answer_prompt.format_messages(context=context, question=prepared.standalone_question)
+
+        result = (llm or self.llm).invoke(messages, config={ "callbacks": callbacks, "metadata": { "stage": "answer" } })
+        answer = getattr(result, "content", result)
+
+        prepared.chat_history.add_messages([HumanMessage(content=prepared.question), AIMessage(content=answer)])
+
+        return answer
+
+    def run(self, id, question, documents=None):
+        '''
+        Returns the answer to question and the documents it was generated from
+        '''
+        prepared = self.prepare(id, question, documents)
+
+        return self.generate(prepared), prepared.documents
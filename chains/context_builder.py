@@ -0,0 +1,166 @@
+import os
+import re
+from collections import namedtuple
+
+# Passages are separated like the documents of the stuff chain
+PASSAGE_SEPARATOR = "\n\n"
+
+# Word 3-grams compared to detect near-identical passages
+SHINGLE_WORDS = 3
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+# text: merged content of adjacent chunks, source: their file, rank: rank of the best retrieved chunk, shingles: word 3-grams (near-duplicate detection)
+Passage = namedtuple("Passage", ["text", "source", "rank", "shingles"])
+
+def _load_encoding(model_name=None):
+    '''
+    The tiktoken encoding of model_name (cl100k_base by default), None when it cannot be loaded (tiktoken downloads it on first use)
+    '''
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model_name) if model_name else tiktoken.get_encoding("cl100k_base")
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+def token_counter(model_name=None):
+    '''
+    Returns a function counting the tokens of a text with the tiktoken encoding of model_name (cl100k_base by default),
+    or estimating them at 4 characters per token when the encoding cannot be loaded.
+    '''
+    encoding = _load_encoding(model_name)
+    if encoding is None:
+        return lambda text: (len(text) + 3) // 4
+
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+def token_truncator(model_name=None):
+    '''
+    Returns a function cutting a text to its first max_tokens tokens, with the encoding token_counter counts them with
+    '''
+    encoding = _load_encoding(model_name)
+    if encoding is None:
+        return lambda text, max_tokens: text[:max_tokens * 4]
+
+    return lambda text, max_tokens: encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+def shingles(text):
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return frozenset([" ".join(words)])
+
+    return frozenset(" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1))
+
+def similarity(first, second):
+    '''
+    Jaccard similarity of two sets of shingles
+    '''
+    if not first or not second:
+        return 0.0
+
+    return len(first & second) / len(first | second)
+
+class ContextBuilder:
+    '''
+    Builds the context of the answer prompt from the retrieved knowledge base chunks, instead of stuffing every chunk as it was retrieved:
+
+    - chunks that follow each other in the same transcript (consecutive chunk_index, see preprocessing/load_docs.py) are merged into one passage,
+      placed at the rank of its best chunk,
+    - passages that are near-identical to a better ranked one (shingle similarity of at least similarity_threshold) are dropped,
+      the transcripts repeat whole sentences ("contact your provider with any questions or concerns"),
+    - passages are added in rank order while they fit in max_tokens (None for no limit), a passage that does not fit is skipped
+      so a shorter one ranked after it can still be added. The best ranked passage is always kept, cut to max_tokens if it is longer.
+
+    Built once per route and shared by every request.
+    '''
+
+    def __init__(self, max_tokens=None, similarity_threshold=0.8, count_tokens=None, truncate=None):
+        self.max_tokens = max_tokens
+        self.similarity_threshold = similarity_threshold
+        self.count_tokens = count_tokens or token_counter()
+        self.truncate = truncate or token_truncator()
+
+    def __call__(self, documents):
+        return PASSAGE_SEPARATOR.join(self.pack(self.deduplicate(self.merge_adjacent(documents))))
+
+    def merge_adjacent(self, documents):
+        '''
+        Returns the passages of documents, adjacent chunks of the same source merged, in rank order
+        '''
+        # (source, chunk_index) -> (rank, content) of the chunks that know their position, the ones that do not are passages of their own
+        positions = {}
+        passages = []
+
+        for rank, document in enumerate(documents):
+            source, chunk_index = document.metadata.get("source"), document.metadata.get("chunk_index")
+            if source is None or chunk_index is None:
+                passages.append([rank, [document.page_content], source])
+            elif (source, chunk_index) not in positions:
+                positions[(source, chunk_index)] = (rank, document.page_content)
+
+        # Runs of consecutive chunks of each source
+        run, previous_index = None, None
+        for source, chunk_index in sorted(positions, key=lambda position: (str(position[0]), position[1])):
+            rank, content = positions[(source, chunk_index)]
+
+            if run is not None and run[2] == source and chunk_index == previous_index + 1:
+                run[0] = min(run[0], rank)
+                run[1].append(content)
+            else:
+                run = [rank, [content], source]
+                passages.append(run)
+
+            previous_index = chunk_index
+
+        return [Passage("\n".join(texts), source, rank, shingles(" ".join(texts))) for rank, texts, source in sorted(passages, key=lambda passage: passage[0])]
+
+    def deduplicate(self, passages):
+        kept = []
+        for passage in passages:
+            if all(similarity(passage.shingles, other.shingles) < self.similarity_threshold for other in kept):
+                kept.append(passage)
+
+        return kept
+
+    def pack(self, passages):
+        '''
+        Texts of the passages that fit in max_tokens, in rank order, starting with the best ranked one (cut to max_tokens if needed)
+        '''
+        if self.max_tokens is None:
+            return [passage.text for passage in passages]
+
+        if not passages:
+            return []
+
+        # The answer is never generated from an empty context because the best passage alone is over the budget
+        first = passages[0].text
+        if self.count_tokens(first) > self.max_tokens:
+            first = self.truncate(first, self.max_tokens)
+
+        separator_tokens = self.count_tokens(PASSAGE_SEPARATOR)
+        texts, used = [first], self.count_tokens(first)
+
+        for passage in passages[1:]:
+            tokens = self.count_tokens(passage.text) + (separator_tokens if texts else 0)
+            if used + tokens <= self.max_tokens:
+                texts.append(passage.text)
+                used += tokens
+
+        return texts
+
+def context_builder_from_env(prefix, model_name=None):
+    '''
+    Reads the context budget of a route from <prefix>_CONTEXT_TOKENS (0 for no limit) and <prefix>_CONTEXT_DEDUPLICATION_THRESHOLD
+    '''
+    max_tokens = int(os.getenv(f"{prefix}_CONTEXT_TOKENS", 1000)) or None
+
+    return ContextBuilder(
+        max_tokens=max_tokens,
+        similarity_threshold=float(os.getenv(f"{prefix}_CONTEXT_DEDUPLICATION_THRESHOLD", 0.8)),
+        count_tokens=token_counter(model_name),
+        truncate=token_truncator(model_name)
+    )
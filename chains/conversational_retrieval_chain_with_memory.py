@@ -1,23 +1,34 @@
-from langchain.memory import ConversationBufferMemory
-from langchain_community.chat_message_histories import SQLChatMessageHistory
-from langchain.chains import ConversationalRetrievalChain
-import os
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+from database.engine import get_engine
+from langchain_core.messages import AIMessage, HumanMessage
+from memory.bounded_history import BoundedSQLChatMessageHistory
+from memory.write_behind import message_writer
 
-def build_conversational_retrieval_chain_with_memory(llm, retriever, id):
-    # Memory is stored and sourced from SQL
-    # All messages (Human and AI) are stored in the message_store table and are linked together via the session_id
-    # To continue an existing conversation, pass in an existing session_id
-    # To create a new conversation, pass in a new session_id
-    memory = ConversationBufferMemory(
-        chat_memory=SQLChatMessageHistory(session_id=str(id), connection_string=os.getenv('DATABASE_URI')),
-        return_messages=True,
-        memory_key="chat_history",
-        output_key="answer"
-    )
+def has_chat_history(id):
+    '''
+    Returns True if the conversation already has messages in the message_store table (new conversations have no id),
+    or messages this process has not written there yet (see memory/write_behind.py)
+    '''
+    if not id:
+        return False
 
-    return ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        memory=memory,
-        retriever=retriever,
-        condense_question_llm=llm
-    )
\ No newline at end of file
+    # The first exchange of a conversation is still queued when its follow-up comes in quickly
+    writer = message_writer.get()
+    if writer is not None and writer.pending(str(id)):
+        return True
+
+    try:
+        with get_engine().connect() as conn:
+            return conn.execute(text("SELECT 1 FROM message_store WHERE session_id = :session_id LIMIT 1"), { "session_id": str(id) }).first() is not None
+    except ProgrammingError:
+        # message_store is created with the first conversation
+        return False
+
+def record_exchange(id, question, answer):
+    '''
+    Appends a question and its answer to the conversation, as the chain does when it generates the answer itself
+    '''
+    chat_history = BoundedSQLChatMessageHistory(session_id=id, engine=get_engine())
+
+    chat_history.add_messages([HumanMessage(content=question), AIMessage(content=answer)])
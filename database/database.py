@@ -16,6 +16,13 @@ class Vector(UserDefinedType):
         return col
 
 class Location(db.Model):
+    # Place filters of the SQL location search (see retrievers/SQLLocationRetriever.py), the embedding index is managed by database/indexes.py
+    __table_args__ = (
+        db.Index("ix_location_city", "city"),
+        db.Index("ix_location_county", "county"),
+        db.Index("ix_location_latitude_longitude", "latitude", "longitude"),
+    )
+
     id = db.Column(db.String(), primary_key=True, default=lambda: str(uuid4()))
     name = db.Column(db.String(), nullable=False, unique=True)
     address = db.Column(db.String(), nullable=False)
@@ -39,4 +46,33 @@ class Location(db.Model):
     address_link = db.Column(db.String(), nullable=False)
     website = db.Column(db.String(), nullable=False)
     resource_type = db.Column(db.String(), nullable=False)
-    embedding = db.Column(Vector(), nullable=True)
\ No newline at end of file
+    embedding = db.Column(Vector(), nullable=True)
+
+class QueryCache(db.Model):
+    # Shared unified search cache (see caches/semantic_cache.py), keyed by the normalized query text
+    __tablename__ = 'query_cache'
+
+    key = db.Column(db.String(), primary_key=True)
+    embedding = db.Column(Vector(), nullable=False)
+    value = db.Column(JSONB, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    last_hit_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+class ConversationSummary(db.Model):
+    # Rolling summary of the messages of a conversation that fell out of the memory window (see memory/bounded_history.py)
+    __tablename__ = 'conversation_summary'
+
+    session_id = db.Column(db.String(), primary_key=True)
+    summary = db.Column(db.Text(), nullable=False)
+    # Id of the last message_store row folded into the summary
+    summarized_through = db.Column(db.Integer(), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+class EmbeddingCache(db.Model):
+    # Persistent embeddings cache (see embeddings/cached.py), keyed by a hash of the model name and the embedded text
+    __tablename__ = 'embedding_cache'
+
+    key = db.Column(db.String(), primary_key=True)
+    # float32 bytes of the embedding
+    embedding = db.Column(db.LargeBinary(), nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False)
@@ -0,0 +1,100 @@
+import os
+import re
+import threading
+
+from sqlalchemy import create_engine, event, text
+
+_engine = None
+_engine_lock = threading.Lock()
+_counters_lock = threading.Lock()
+
+# Physical connections opened and connections handed out by the pool since startup
+_pool_counters = { "connects": 0, "checkouts": 0 }
+
+def sqlalchemy_database_uri(database_uri=None):
+    '''
+    Returns DATABASE_URI with the psycopg (3) driver, e.g. postgresql://user@host/db -> postgresql+psycopg://user@host/db
+
+    Every SQLAlchemy consumer (chat memory, PGVector, the caches) and the location loader share this driver,
+    so pooled connections can also be used for pgvector's binary protocol.
+    '''
+    database_uri = database_uri or os.getenv('DATABASE_URI')
+
+    return re.sub(r"^postgres(?:ql)?(?:\+\w+)?://", "postgresql+psycopg://", database_uri)
+
+def engine_options():
+    '''
+    Pool configuration, read from DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT and DATABASE_POOL_RECYCLE
+    '''
+    return {
+        "pool_size": int(os.getenv('DATABASE_POOL_SIZE', 5)),
+        "max_overflow": int(os.getenv('DATABASE_MAX_OVERFLOW', 10)),
+        "pool_timeout": float(os.getenv('DATABASE_POOL_TIMEOUT', 30)),
+        "pool_recycle": int(os.getenv('DATABASE_POOL_RECYCLE', 1800)),
+        "pool_pre_ping": True
+    }
+
+def get_engine():
+    '''
+    Returns the process-wide SQLAlchemy engine (and connection pool) shared by every database consumer of the server
+    '''
+    global _engine
+
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_engine(sqlalchemy_database_uri(), **engine_options())
+
+                event.listen(engine, "connect", lambda *args: _count("connects"))
+                event.listen(engine, "checkout", lambda *args: _count("checkouts"))
+
+                # hnsw.ef_search / ivfflat.probes of the ANN indexes
+                from database.indexes import configure_vector_search
+                configure_vector_search(engine)
+
+                _engine = engine
+
+    return _engine
+
+def fetch_table_fingerprint(table):
+    '''
+    Returns a fingerprint of a table that changes whenever rows are inserted, updated or deleted, or the table is truncated:
+    its rows counters in the statistics of PostgreSQL and its file node (a new one is assigned by TRUNCATE).
+    Two catalog rows are read, the table itself is not, so checking it often is cheap whatever the number of rows.
+    The counters are updated when the writing transaction ends (within a second), and a reset of the statistics only causes one extra reload.
+    '''
+    with get_engine().connect() as conn:
+        return tuple(conn.execute(text(
+            "SELECT c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del FROM pg_class c JOIN pg_stat_user_tables s ON s.relid = c.oid "
+            "WHERE c.oid = CAST(:table AS regclass);"
+        ), { "table": table }).one())
+
+def _count(counter):
+    with _counters_lock:
+        _pool_counters[counter] += 1
+
+def pool_stats():
+    '''
+    Current state of the shared connection pool
+    '''
+    if _engine is None:
+        return { "initialized": False }
+
+    pool = _engine.pool
+
+    return {
+        "initialized": True,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **_pool_counters
+    }
+
+def dispose_inherited_connections():
+    '''
+    Drops the pooled connections a forked worker inherited from its parent, without closing them (they still belong to the parent).
+    The worker opens its own connections on first use.
+    '''
+    if _engine is not None:
+        _engine.dispose(close=False)
@@ -0,0 +1,193 @@
+import argparse
+import math
+import os
+from collections import namedtuple
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.schema import CreateIndex
+
+from database.database import Location
+
+# hnsw (best recall for a given latency, slower to build), ivfflat (fast to build, its lists are computed from the rows present when it is built) or none
+VECTOR_INDEX_TYPES = ("hnsw", "ivfflat", "none")
+
+# pgvector columns searched by cosine distance (<=>): the locations, the shared query cache and the PGVector collections of the knowledge base
+VECTOR_COLUMNS = [("location", "embedding"), ("query_cache", "embedding"), ("langchain_pg_embedding", "embedding")]
+
+VectorIndexConfig = namedtuple("VectorIndexConfig", ["index_type", "hnsw_m", "hnsw_ef_construction", "hnsw_ef_search", "ivfflat_lists", "ivfflat_probes", "iterative_scan"])
+
+def vector_index_config_from_env():
+    '''
+    Reads the ANN index configuration from VECTOR_INDEX_TYPE (hnsw, ivfflat or none), VECTOR_INDEX_HNSW_M, VECTOR_INDEX_HNSW_EF_CONSTRUCTION,
+    VECTOR_INDEX_HNSW_EF_SEARCH, VECTOR_INDEX_IVFFLAT_LISTS (computed from the row count when unset), VECTOR_INDEX_IVFFLAT_PROBES
+    and VECTOR_INDEX_ITERATIVE_SCAN (off, strict_order or relaxed_order, defaults to strict_order where the server has pgvector 0.8+)
+    '''
+    index_type = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()
+    if index_type not in VECTOR_INDEX_TYPES:
+        raise ValueError(f"VECTOR_INDEX_TYPE should be one of {', '.join(VECTOR_INDEX_TYPES)}, got {index_type}")
+
+    lists = os.getenv("VECTOR_INDEX_IVFFLAT_LISTS")
+
+    return VectorIndexConfig(
+        index_type=index_type,
+        hnsw_m=int(os.getenv("VECTOR_INDEX_HNSW_M", 16)),
+        hnsw_ef_construction=int(os.getenv("VECTOR_INDEX_HNSW_EF_CONSTRUCTION", 64)),
+        hnsw_ef_search=int(os.getenv("VECTOR_INDEX_HNSW_EF_SEARCH", 40)),
+        ivfflat_lists=int(lists) if lists else None,
+        ivfflat_probes=int(os.getenv("VECTOR_INDEX_IVFFLAT_PROBES", 10)),
+        iterative_scan=os.getenv("VECTOR_INDEX_ITERATIVE_SCAN", "auto").lower()
+    )
+
+def vector_index_name(table, column, index_type):
+    return f"ix_{table}_{column}_{index_type}"
+
+def ivfflat_lists(rows):
+    '''
+    Number of IVFFlat lists recommended by pgvector: rows / 1000 up to a million rows, sqrt(rows) above
+    '''
+    return max(1, rows // 1000 if rows <= 1_000_000 else int(math.sqrt(rows)))
+
+def create_vector_index_sql(table, column, config, rows):
+    name = vector_index_name(table, column, config.index_type)
+
+    if config.index_type == "hnsw":
+        return f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING hnsw ({column} vector_cosine_ops) WITH (m = {config.hnsw_m}, ef_construction = {config.hnsw_ef_construction})"
+
+    return f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING ivfflat ({column} vector_cosine_ops) WITH (lists = {config.ivfflat_lists or ivfflat_lists(rows)})"
+
+def supports_iterative_scan(version):
+    '''
+    Whether the pgvector version (extversion, e.g. "0.8.0") has hnsw.iterative_scan and ivfflat.iterative_scan
+    '''
+    major, minor = (int(part) for part in version.split(".")[:2])
+    return (major, minor) >= (0, 8)
+
+def search_settings(config, pgvector_version=None):
+    '''
+    SET statements of the query time parameters of the indexes (recall against latency).
+    The knowledge base collections share one index of langchain_pg_embedding and are searched with a collection_id filter,
+    which is applied after ef_search (or probes) candidates are read: without an iterative scan a collection can get fewer than k rows.
+    The "auto" iterative scan is strict_order when pgvector_version supports it, off otherwise.
+    '''
+    settings = [f"SET hnsw.ef_search = {config.hnsw_ef_search}", f"SET ivfflat.probes = {config.ivfflat_probes}"]
+
+    if config.iterative_scan == "auto":
+        config = config._replace(iterative_scan="strict_order" if pgvector_version and supports_iterative_scan(pgvector_version) else None)
+
+    if config.iterative_scan and config.iterative_scan != "off":
+        if config.index_type == "hnsw":
+            settings.append(f"SET hnsw.iterative_scan = {config.iterative_scan}")
+        else:
+            # IVFFlat scans have no strict order
+            settings.append("SET ivfflat.iterative_scan = relaxed_order")
+
+    return settings
+
+def configure_vector_search(engine, config=None):
+    '''
+    Applies the search parameters of config (default: from the environment) to every new connection of engine
+    '''
+    config = config or vector_index_config_from_env()
+
+    if config.index_type == "none":
+        return
+
+    def set_search_parameters(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+
+        pgvector_version = None
+        if config.iterative_scan == "auto":
+            cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            row = cursor.fetchone()
+            pgvector_version = row[0] if row else None
+
+        for setting in search_settings(config, pgvector_version):
+            cursor.execute(setting)
+        cursor.close()
+
+        # Session settings survive the commit, not a rollback of the transaction they were made in
+        dbapi_connection.commit()
+
+    event.listen(engine, "connect", set_search_parameters)
+
+def _fix_dimensions(conn, table, column):
+    '''
+    Gives an untyped vector column (langchain_postgres creates embedding as vector, without dimensions) the dimensions of its rows,
+    since pgvector can only index columns with dimensions. Returns the number of rows, or None if the column cannot be indexed.
+    '''
+    typmod = conn.execute(text(
+        "SELECT atttypmod FROM pg_attribute WHERE attrelid = CAST(:table AS regclass) AND attname = :column"
+    ), { "table": table, "column": column }).scalar()
+
+    if typmod is not None and typmod > 0:
+        return conn.execute(text(f"SELECT count({column}) FROM {table}")).scalar()
+
+    rows, min_dimensions, max_dimensions = conn.execute(text(
+        f"SELECT count({column}), min(vector_dims({column})), max(vector_dims({column})) FROM {table}"
+    )).one()
+
+    if min_dimensions is None or min_dimensions != max_dimensions:
+        print(f"Not indexing {table}.{column}: it has no dimensions and its rows have {min_dimensions} to {max_dimensions} dimensions")
+        return None
+
+    conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE vector({min_dimensions})"))
+
+    return rows
+
+def ensure_vector_indexes(engine, config=None, tables=None, rebuild=False):
+    '''
+    Creates the ANN index of every pgvector column of VECTOR_COLUMNS (restricted to tables) whose table exists, and the place indexes of
+    the location table, if they are missing. Indexes of the other index type are dropped, and with rebuild the configured ones as well,
+    so changed parameters (m, lists, ...) are applied.
+
+    IVFFlat indexes are not built on empty tables (their lists would be trained on no data), the loading scripts call this again once the rows are in.
+    Runs in one transaction holding an advisory lock, so several workers starting at once do not build the same index twice.
+    Returns the names of the vector indexes that exist afterwards.
+    '''
+    config = config or vector_index_config_from_env()
+    inspector = inspect(engine)
+    indexed = []
+
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('ensure_vector_indexes'))"))
+
+        if (tables is None or "location" in tables) and inspector.has_table("location"):
+            for index in Location.__table__.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+        for table, column in VECTOR_COLUMNS:
+            if (tables is not None and table not in tables) or not inspector.has_table(table):
+                continue
+
+            for index_type in VECTOR_INDEX_TYPES[:-1]:
+                if index_type != config.index_type or rebuild:
+                    conn.execute(text(f"DROP INDEX IF EXISTS {vector_index_name(table, column, index_type)}"))
+
+            if config.index_type == "none":
+                continue
+
+            name = vector_index_name(table, column, config.index_type)
+            if conn.execute(text("SELECT to_regclass(:name)"), { "name": name }).scalar() is None:
+                rows = _fix_dimensions(conn, table, column)
+                if rows is None or (config.index_type == "ivfflat" and rows == 0):
+                    continue
+
+                conn.execute(text(create_vector_index_sql(table, column, config, rows)))
+
+            indexed.append(name)
+
+    return indexed
+
+if __name__ == "__main__":
+    from sqlalchemy import create_engine
+
+    from database.engine import sqlalchemy_database_uri
+
+    parser = argparse.ArgumentParser(description="Creates the ANN (HNSW or IVFFlat) indexes of the pgvector columns, configured by the VECTOR_INDEX_* variables")
+    parser.add_argument("--table", action="append", choices=[table for table, _ in VECTOR_COLUMNS], help="only index this table (repeatable)")
+    parser.add_argument("--rebuild", action="store_true", help="drop and rebuild the indexes, e.g. after changing their parameters")
+    args = parser.parse_args()
+
+    engine = create_engine(sqlalchemy_database_uri())
+    print("Vector indexes:", ", ".join(ensure_vector_indexes(engine, tables=args.table, rebuild=args.rebuild)) or "none")
+    engine.dispose()
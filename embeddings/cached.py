@@ -0,0 +1,203 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import CreateTable
+
+from database.database import EmbeddingCache
+
+embedding_cache_table = EmbeddingCache.__table__
+
+# Stores the embeddings of queries after they are returned, a query waits for the model but not for the INSERT
+_store_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache-writer")
+
+# Above this many queued writes (the database is slow or down) new query embeddings are only kept in memory
+MAX_PENDING_STORE_WRITES = 1000
+
+def embedding_key(namespace, text):
+    '''
+    Cache key of a text embedded by the model named namespace
+    '''
+    return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+class SQLEmbeddingStore:
+    '''
+    Persistent embeddings cache in the embedding_cache table, shared by every worker, the ingestion scripts and later runs.
+    Embeddings are stored as float32 bytes (the precision pgvector stores them with).
+    '''
+
+    def __init__(self, engine, lookup_size=1000):
+        self.engine = engine
+        self.lookup_size = lookup_size
+
+        self._table_ready = False
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        '''
+        Returns a dictionary of the cached embeddings (float32 arrays) of keys
+        '''
+        self._ensure_table()
+
+        found = {}
+        with self.engine.connect() as conn:
+            for i in range(0, len(keys), self.lookup_size):
+                rows = conn.execute(
+                    select(embedding_cache_table.c.key, embedding_cache_table.c.embedding).where(embedding_cache_table.c.key.in_(keys[i:i + self.lookup_size]))
+                )
+                found.update((key, np.frombuffer(embedding, dtype=np.float32)) for key, embedding in rows)
+
+        return found
+
+    def put_many(self, embeddings):
+        '''
+        Stores a dictionary of key -> float32 embedding, keeping the existing entries
+        '''
+        self._ensure_table()
+
+        insert = postgresql.insert if self.engine.dialect.name == "postgresql" else sqlite.insert
+        created_at = datetime.now(timezone.utc)
+
+        with self.engine.begin() as conn:
+            conn.execute(
+                insert(embedding_cache_table).on_conflict_do_nothing(index_elements=["key"]),
+                [{ "key": key, "embedding": embedding.tobytes(), "created_at": created_at } for key, embedding in embeddings.items()]
+            )
+
+    def _ensure_table(self):
+        if self._table_ready:
+            return
+
+        with self._lock:
+            if not self._table_ready:
+                with self.engine.begin() as conn:
+                    conn.execute(CreateTable(embedding_cache_table, if_not_exists=True))
+                self._table_ready = True
+
+class CachedEmbeddings(Embeddings):
+    '''
+    Wraps an embeddings model with an in-process LRU cache and, optionally, a persistent store (see SQLEmbeddingStore).
+
+    Texts are looked up by a hash of the model name (namespace) and the text: first in memory, then in the store,
+    and only the remaining texts are sent to the model (each distinct text once per request).
+    New document embeddings are stored before embed_documents returns, new query embeddings in the background.
+    Counters of memory hits, store hits and model calls are returned by metrics().
+    '''
+
+    def __init__(self, underlying, namespace, store=None, max_entries=10000):
+        self.underlying = underlying
+        self.namespace = namespace
+        self.store = store
+        self.max_entries = max_entries
+
+        # key -> float32 embedding, ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = { "memory_hits": 0, "store_hits": 0, "misses": 0, "store_errors": 0 }
+        self._pending_writes = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_key(self.namespace, text) for text in texts]
+        found = self._get_many(dict(zip(keys, texts)), self.underlying.embed_documents)
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = embedding_key(self.namespace, text)
+        found = self._get_many({ key: text }, lambda texts: [self.underlying.embed_query(texts[0])], background_store=True)
+
+        return found[key].tolist()
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters["entries"] = len(self._entries)
+
+        lookups = counters["memory_hits"] + counters["store_hits"] + counters["misses"]
+        counters["hit_rate"] = (counters["memory_hits"] + counters["store_hits"]) / lookups if lookups else 0.0
+
+        return counters
+
+    def _get_many(self, texts_by_key, embed, background_store=False):
+        found = {}
+
+        with self._lock:
+            for key in texts_by_key:
+                embedding = self._entries.get(key)
+                if embedding is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = embedding
+
+            self._counters["memory_hits"] += len(found)
+
+        missing = [key for key in texts_by_key if key not in found]
+
+        if missing and self.store is not None:
+            # The store is an optimization, the model is still called if it is unavailable
+            try:
+                stored = self.store.get_many(missing)
+            except Exception:
+                stored = {}
+                self._count("store_errors")
+
+            self._count("store_hits", len(stored))
+            self._remember(stored)
+            found.update(stored)
+            missing = [key for key in missing if key not in stored]
+
+        if missing:
+            self._count("misses", len(missing))
+
+            embedded = { key: np.asarray(embedding, dtype=np.float32) for key, embedding in zip(missing, embed([texts_by_key[key] for key in missing])) }
+            self._remember(embedded)
+            found.update(embedded)
+
+            if self.store is not None:
+                if background_store:
+                    self._store_in_background(embedded)
+                else:
+                    self._store(embedded)
+
+        return found
+
+    def _store(self, embeddings):
+        try:
+            self.store.put_many(embeddings)
+        except Exception:
+            self._count("store_errors")
+
+    def _store_in_background(self, embeddings):
+        with self._lock:
+            if self._pending_writes >= MAX_PENDING_STORE_WRITES:
+                self._counters["store_errors"] += 1
+                return
+            self._pending_writes += 1
+
+        def store():
+            try:
+                self._store(embeddings)
+            finally:
+                with self._lock:
+                    self._pending_writes -= 1
+
+        _store_writer.submit(store)
+
+    def _remember(self, embeddings):
+        with self._lock:
+            for key, embedding in embeddings.items():
+                self._entries[key] = embedding
+                self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
@@ -0,0 +1,36 @@
+import hashlib
+import time
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+class FakeEmbeddings(Embeddings):
+    '''
+    Deterministic, offline stand-in for OpenAIEmbeddings.
+
+    The same text always maps to the same unit vector, so it can be used to exercise retrievers, loaders and benchmarks without paying for (or waiting on) the OpenAI API.
+    An optional latency (in seconds) is slept per call to approximate the network round trip of the real model.
+    '''
+
+    def __init__(self, size=1536, latency=0.0):
+        self.size = size
+        self.latency = latency
+
+    def _embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+
+        return self._embed(text)
@@ -1,4 +1,33 @@
+import os
+
 from langchain.embeddings import OpenAIEmbeddings
 
-# Using OpenAI embeddings for now
-openai_embeddings = OpenAIEmbeddings()
\ No newline at end of file
+from embeddings.cached import CachedEmbeddings, SQLEmbeddingStore
+from lifecycle.lazy import Lazy
+
+def build_openai_embeddings(engine=None):
+    '''
+    Builds the OpenAI embeddings model used by the server and the ingestion scripts, wrapped in a CachedEmbeddings.
+
+    Configured from the environment: EMBEDDING_CACHE_BACKEND (postgres, the default, keeps embeddings in the embedding_cache table
+    across processes and runs, memory only in this process, none disables the cache) and EMBEDDING_CACHE_MAX_ENTRIES (in-process LRU size).
+    engine defaults to the shared engine of database.engine.get_engine.
+    '''
+    model = OpenAIEmbeddings()
+
+    backend_name = os.getenv("EMBEDDING_CACHE_BACKEND", "postgres")
+    if backend_name == "none":
+        return model
+
+    store = None
+    if backend_name == "postgres":
+        if engine is None:
+            from database.engine import get_engine
+            engine = get_engine()
+
+        store = SQLEmbeddingStore(engine)
+
+    return CachedEmbeddings(model, namespace=model.model, store=store, max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 10000)))
+
+# Using OpenAI embeddings for now, built on first use (openai_embeddings.get())
+openai_embeddings = Lazy("openai_embeddings", build_openai_embeddings)
@@ -0,0 +1,33 @@
+# gunicorn -c gunicorn.conf.py app:app
+import os
+
+from dotenv import load_dotenv
+
+# Settings read below (GUNICORN_TIMEOUT, WARMUP) may come from .env like the ones of the application
+load_dotenv()
+
+# Importing app.py builds no client and opens no connection (see lifecycle/lazy.py), so it is imported once in the master and shared by the workers
+preload_app = True
+
+# Workers that are still warming up are not restarted for being slow to answer
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+def post_fork(server, worker):
+    # Nothing should have connected before the fork, but pooled connections must never be shared between processes
+    from database.engine import dispose_inherited_connections
+
+    dispose_inherited_connections()
+
+def post_worker_init(worker):
+    # The worker accepts requests once its clients, retrievers and indexes are built, set WARMUP=false to build them on first use instead
+    if os.getenv("WARMUP", "true").lower() == "true":
+        from app import warmup
+
+        warmup()
+
+def worker_exit(server, worker):
+    # Chat messages still queued by the background writer (see memory/write_behind.py) are written before the worker stops
+    from memory.write_behind import message_writer
+
+    if message_writer.loaded and message_writer.get() is not None:
+        message_writer.get().close()
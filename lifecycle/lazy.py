@@ -0,0 +1,43 @@
+import threading
+
+from monitoring.metrics import stage
+
+class Lazy:
+    '''
+    Process-wide object built by factory on first use, e.g. llm = Lazy("llm", ChatOpenAI), then llm.get() wherever it is needed.
+
+    Importing the module that defines it builds nothing and opens no connection, so a worker starts without waiting on the database or OpenAI,
+    and a pre-fork server does not hand the same sockets to all of its workers (see app.warmup and gunicorn.conf.py).
+    Concurrent first calls build the object once. If factory raises (e.g. the database is briefly unavailable) nothing is kept
+    and the next call builds it again. Build times are recorded as the "build_<name>" stage in /metrics.
+    '''
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    with stage(f"build_{self.name}"):
+                        self._value = self.factory()
+                    self._loaded = True
+
+        return self._value
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def reset(self):
+        '''
+        Drops the object, the next get() builds a new one
+        '''
+        with self._lock:
+            self._value = None
+            self._loaded = False
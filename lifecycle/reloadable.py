@@ -0,0 +1,72 @@
+import threading
+import time
+
+class Reloadable:
+    '''
+    Process-wide object built from the database by loader on first use (e.g. an in-memory index of a table), that can be rebuilt when the table changes.
+
+    The object is refreshed when reload() is called or, if refresh_interval is set, when fingerprint() has changed since the last check
+    (checked at most once every refresh_interval seconds, by a single request while the others keep using the current object).
+    Each server worker holds its own object: reload() only refreshes the worker it runs in, the fingerprint check refreshes every worker.
+    A check that fails keeps the current object and is retried after refresh_interval.
+    '''
+
+    def __init__(self, name, loader, fingerprint=None, refresh_interval=None):
+        self.name = name
+        self.loader = loader
+        self.fingerprint = fingerprint
+        self.refresh_interval = refresh_interval
+
+        self._value = None
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        value = self._value
+
+        if value is None:
+            with self._lock:
+                if self._value is None:
+                    self._load()
+                value = self._value
+        elif self._should_check():
+            value = self._refresh_if_changed()
+
+        return value
+
+    def reload(self):
+        '''
+        Rebuilds the object from the database. Requests keep using the previous object until the new one is ready.
+        '''
+        with self._lock:
+            self._load()
+
+            return self._value
+
+    def _load(self):
+        fingerprint = self.fingerprint() if self.fingerprint else None
+
+        self._value = self.loader()
+        self._fingerprint = fingerprint
+        self._checked_at = time.monotonic()
+
+    def _should_check(self):
+        return self.fingerprint is not None and self.refresh_interval is not None and time.monotonic() - self._checked_at >= self.refresh_interval
+
+    def _refresh_if_changed(self):
+        # Only one request pays for the fingerprint query, the others keep serving the current object
+        if not self._lock.acquire(blocking=False):
+            return self._value
+
+        try:
+            self._checked_at = time.monotonic()
+            if self.fingerprint() != self._fingerprint:
+                self._load()
+        except Exception as e:
+            # The database is briefly unavailable (restart, pool timeout): the current object is still valid, checked again after refresh_interval
+            print(f"Refresh of the {self.name} failed, the current one is kept: {e}")
+        finally:
+            self._lock.release()
+
+        return self._value
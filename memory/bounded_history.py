@@ -0,0 +1,231 @@
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_community.chat_message_histories.sql import create_message_model
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import SystemMessage, get_buffer_string, message_to_dict, messages_from_dict
+from sqlalchemy import Index, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from database.database import ConversationSummary
+from memory.write_behind import message_writer
+from monitoring.metrics import stage
+
+# Same table as SQLChatMessageHistory, so both histories can be used on the same conversations
+message_table = create_message_model("message_store", declarative_base()).__table__
+summary_table = ConversationSummary.__table__
+
+# Messages of a conversation are always read by session_id, in id order
+message_store_session_index = Index("ix_message_store_session_id_id", message_table.c.session_id, message_table.c.id)
+
+# "buffer" replays the whole conversation (as ConversationBufferMemory over SQLChatMessageHistory did),
+# "window" only the last max_turns questions and answers and "summary" the window preceded by a rolling summary of the older messages
+MEMORY_MODES = ("buffer", "window", "summary")
+
+MemoryConfig = namedtuple("MemoryConfig", ["mode", "max_turns"])
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+# Sessions with a summary being written by this process
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+def memory_config_from_env(prefix, mode="window", max_turns=4):
+    '''
+    Reads the memory configuration of a route from <prefix>_MEMORY (buffer, window or summary) and <prefix>_MEMORY_TURNS.
+    summary is opt-in: it makes an extra LLM call in the background after each exchange that overflows the window
+    '''
+    mode = os.getenv(f"{prefix}_MEMORY", mode).lower()
+    if mode not in MEMORY_MODES:
+        raise ValueError(f"{prefix}_MEMORY should be one of {', '.join(MEMORY_MODES)}, got {mode}")
+
+    return MemoryConfig(mode=mode, max_turns=int(os.getenv(f"{prefix}_MEMORY_TURNS", max_turns)))
+
+def ensure_schema(engine):
+    '''
+    Creates the message_store and conversation_summary tables and the (session_id, id) index of message_store if they are missing, once per engine
+    '''
+    if engine in _schema_ready:
+        return
+
+    with _schema_lock:
+        if engine in _schema_ready:
+            return
+
+        with engine.begin() as conn:
+            conn.execute(CreateTable(message_table, if_not_exists=True))
+            conn.execute(CreateTable(summary_table, if_not_exists=True))
+            conn.execute(CreateIndex(message_store_session_index, if_not_exists=True))
+
+        _schema_ready.add(engine)
+
+class BoundedSQLChatMessageHistory(BaseChatMessageHistory):
+    '''
+    Chat history of a conversation stored in the message_store table that only loads the last max_turns questions and answers,
+    with a single LIMITed query on the (session_id, id) index, instead of the whole conversation (max_turns=None loads all of it).
+
+    With a summary_llm, the messages that fall out of the window are folded into a rolling summary (conversation_summary table)
+    in a background thread after each exchange, and the summary is loaded as a system message before the window.
+
+    New messages are inserted by the write-behind message_writer (see memory/write_behind.py) unless CHAT_HISTORY_WRITES is sync,
+    the messages of this process that are not written yet are read along with the stored ones.
+    '''
+
+    def __init__(self, session_id, engine, max_turns=4, summary_llm=None):
+        self.session_id = str(session_id)
+        self.engine = engine
+        self.max_turns = max_turns
+        self.summary_llm = summary_llm
+
+        ensure_schema(engine)
+
+    @property
+    def messages(self):
+        writer = message_writer.get()
+
+        with stage("memory_read"):
+            if writer is None:
+                summary, rows = self._read()
+                pending = []
+            else:
+                (summary, rows), pending = writer.read_with_pending(self.session_id, self._read)
+
+        rows = list(reversed(rows)) + [row["message"] for row in pending]
+        if self.max_turns is not None:
+            rows = rows[-2 * self.max_turns:]
+
+        messages = messages_from_dict([json.loads(row) for row in rows])
+
+        if summary:
+            messages.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {summary.summary}"))
+
+        return messages
+
+    def add_message(self, message):
+        self.add_messages([message])
+
+    def add_messages(self, messages):
+        rows = [{ "session_id": self.session_id, "message": json.dumps(message_to_dict(message)) } for message in messages]
+        on_written = self.summarize_in_background if self.summary_llm is not None else None
+        writer = message_writer.get()
+
+        with stage("memory_write"):
+            if writer is not None:
+                # Returns once queued, the summary is updated after the messages are written
+                writer.add_messages(self.engine, message_table, self.session_id, rows, on_written)
+                return
+
+            with self.engine.begin() as conn:
+                conn.execute(insert(message_table), rows)
+
+        if on_written:
+            on_written()
+
+    def clear(self):
+        writer = message_writer.get()
+        if writer is not None:
+            writer.flush()
+
+        with self.engine.begin() as conn:
+            conn.execute(delete(message_table).where(message_table.c.session_id == self.session_id))
+            conn.execute(delete(summary_table).where(summary_table.c.session_id == self.session_id))
+
+    def summarize(self):
+        '''
+        Folds the messages older than the window that are not in the summary yet into it. Returns True if the summary was updated
+        '''
+        with self.engine.connect() as conn:
+            summary = self._load_summary(conn)
+
+            rows = conn.execute(
+                select(message_table.c.id, message_table.c.message)
+                .where(message_table.c.session_id == self.session_id, message_table.c.id > (summary.summarized_through if summary else 0))
+                .order_by(message_table.c.id.desc())
+                .offset(2 * self.max_turns)
+            ).all()
+
+        if not rows:
+            return False
+
+        rows.reverse()
+        new_lines = get_buffer_string(messages_from_dict([json.loads(row.message) for row in rows]))
+
+        result = self.summary_llm.invoke(
+            SUMMARY_PROMPT.format(summary=summary.summary if summary else "", new_lines=new_lines), config={ "metadata": { "stage": "memory_summary" } })
+        values = { "summary": getattr(result, "content", result), "summarized_through": rows[-1].id, "updated_at": datetime.now(timezone.utc) }
+
+        # Another worker may have summarized the same messages in the meantime, only the first write is kept
+        try:
+            with self.engine.begin() as conn:
+                if summary is None:
+                    conn.execute(insert(summary_table).values(session_id=self.session_id, **values))
+                    return True
+
+                return conn.execute(
+                    update(summary_table)
+                    .where(summary_table.c.session_id == self.session_id, summary_table.c.summarized_through == summary.summarized_through)
+                    .values(**values)
+                ).rowcount > 0
+        except IntegrityError:
+            return False
+
+    def summarize_in_background(self):
+        with _summarizing_lock:
+            if self.session_id in _summarizing:
+                return
+            _summarizing.add(self.session_id)
+
+        threading.Thread(target=self._summarize, daemon=True).start()
+
+    def _summarize(self):
+        try:
+            self.summarize()
+        except Exception as e:
+            print(f"Error summarizing conversation {self.session_id}: {e}")
+        finally:
+            with _summarizing_lock:
+                _summarizing.discard(self.session_id)
+
+    def _read(self):
+        '''
+        Returns the summary of the conversation (None without one) and its messages after the summary, most recent first
+        '''
+        with self.engine.connect() as conn:
+            # The whole conversation is replayed without a window, the summary is not used
+            summary = self._load_summary(conn) if self.max_turns is not None else None
+
+            query = (
+                select(message_table.c.message)
+                .where(message_table.c.session_id == self.session_id, message_table.c.id > (summary.summarized_through if summary else 0))
+                .order_by(message_table.c.id.desc())
+            )
+            if self.max_turns is not None:
+                query = query.limit(2 * self.max_turns)
+
+            return summary, conn.execute(query).scalars().all()
+
+    def _load_summary(self, conn):
+        return conn.execute(
+            select(summary_table.c.summary, summary_table.c.summarized_through).where(summary_table.c.session_id == self.session_id)
+        ).first()
+
+def build_chat_history(id, engine, memory_config=None, summary_llm=None):
+    '''
+    Returns the chat history of the conversation for a memory configuration (the whole conversation if memory_config is None)
+    '''
+    if memory_config is None or memory_config.mode == "buffer":
+        return BoundedSQLChatMessageHistory(session_id=id, engine=engine, max_turns=None)
+
+    return BoundedSQLChatMessageHistory(
+        session_id=id,
+        engine=engine,
+        max_turns=memory_config.max_turns,
+        summary_llm=summary_llm if memory_config.mode == "summary" else None
+    )
@@ -0,0 +1,225 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import insert
+
+from lifecycle.lazy import Lazy
+from monitoring.metrics import stage
+
+# Marks the end of the queue when the writer is closed
+_CLOSE = object()
+
+class MessageWriter:
+    '''
+    Write-behind inserts of chat messages into the message_store table.
+
+    add_messages() queues the messages of an exchange and returns at once, so the answer is not held back by the database.
+    A background thread inserts everything queued within flush_interval seconds (at most max_batch messages) in one transaction.
+    There is a single writer thread per process and the queue is first in, first out, so the messages of a conversation are inserted
+    (and numbered by message_store.id) in the order they were added.
+
+    Messages waiting to be written are returned by pending(), so a conversation read by this process right after an exchange still sees it
+    (see BoundedSQLChatMessageHistory.messages). When more than max_pending messages are waiting (the database is slow or down),
+    add_messages() writes synchronously instead (unless the conversation has messages queued), so the queue cannot grow without bound.
+    A failed batch is retried max_retries times.
+    close() writes what is left, it is called at exit and by gunicorn when a worker stops (see gunicorn.conf.py).
+    '''
+
+    def __init__(self, flush_interval=0.05, max_batch=500, max_pending=10000, max_retries=3):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+
+        self._lock = threading.Lock()
+        # Held while a batch is committed and removed from _pending, see read_with_pending
+        self._flush_lock = threading.Lock()
+        self._start()
+
+        self._counters = { "written_messages": 0, "batches": 0, "synchronous_writes": 0, "failed_batches": 0, "dropped_messages": 0 }
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue()
+        self._pending = defaultdict(list)
+        self._pending_count = 0
+        self._thread = None
+        self._closed = False
+
+    def add_messages(self, engine, table, session_id, rows, on_written=None):
+        '''
+        Queues rows ({"session_id", "message"} dicts) of table for insertion, on_written is called once they are committed
+        '''
+        with self._lock:
+            # A forked process does not inherit the writer thread, it starts its own
+            if self._pid != os.getpid():
+                self._start()
+
+            # Rows of a conversation that already has rows queued are always queued behind them, to keep the conversation in order
+            if self._closed or (self._pending_count + len(rows) > self.max_pending and session_id not in self._pending):
+                synchronous = True
+            else:
+                synchronous = False
+                self._pending[session_id].extend(rows)
+                self._pending_count += len(rows)
+                self._queue.put((engine, table, session_id, rows, on_written))
+
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+                    self._thread.start()
+
+        if synchronous:
+            with engine.begin() as conn:
+                conn.execute(insert(table), rows)
+            self._count("synchronous_writes")
+
+            if on_written:
+                on_written()
+
+    def pending(self, session_id):
+        '''
+        Rows of the conversation that are queued or being written
+        '''
+        with self._lock:
+            return list(self._pending.get(session_id, ()))
+
+    def read_with_pending(self, session_id, read):
+        '''
+        Returns read() (a read of the conversation from the database) and the rows of the conversation that it cannot contain yet.
+        Without pending rows (nearly always) the read is not synchronized with the writer.
+        '''
+        if session_id not in self._pending:
+            return read(), []
+
+        # No batch is committed between the read and the snapshot, so a row is either read or pending, never both nor neither
+        with self._flush_lock:
+            return read(), self.pending(session_id)
+
+    def flush(self, timeout=None):
+        '''
+        Waits until every queued message is written (or timeout seconds), returns True if the queue is empty
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending_count:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(min(self.flush_interval, 0.01))
+
+        return True
+
+    def close(self, timeout=10):
+        '''
+        Writes the queued messages and stops the writer thread, later messages are written synchronously
+        '''
+        with self._lock:
+            if self._closed or self._pid != os.getpid():
+                return
+            self._closed = True
+            thread = self._thread
+
+        if thread is not None:
+            self._queue.put(_CLOSE)
+            thread.join(timeout)
+
+    def metrics(self):
+        with self._lock:
+            return { **self._counters, "pending_messages": self._pending_count }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _run(self):
+        closing = False
+        while not closing:
+            items = [self._queue.get()]
+
+            # Whatever arrives within flush_interval joins the batch
+            deadline = time.monotonic() + self.flush_interval
+            while sum(len(item[3]) for item in items if item is not _CLOSE) < self.max_batch:
+                try:
+                    items.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            closing = _CLOSE in items
+            batch = [item for item in items if item is not _CLOSE]
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        # Rows of every engine and table, in the order they were queued
+        groups = defaultdict(list)
+        for engine, table, _, rows, _ in batch:
+            groups[(engine, table)].extend(rows)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._flush_lock:
+                    with stage("memory_flush"):
+                        # A group is only removed once committed, so a retry does not insert it twice
+                        for engine, table in list(groups):
+                            with engine.begin() as conn:
+                                conn.execute(insert(table), groups[(engine, table)])
+                            del groups[(engine, table)]
+
+                    self._release(batch)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    count = sum(len(rows) for _, _, _, rows, _ in batch)
+                    print(f"Error writing {count} chat messages, they are dropped: {e}")
+                    self._count("failed_batches")
+                    self._count("dropped_messages", count)
+
+                    with self._flush_lock:
+                        self._release(batch)
+                    return
+
+                time.sleep(self.flush_interval * 2 ** attempt)
+
+        self._count("batches")
+        self._count("written_messages", sum(len(rows) for _, _, _, rows, _ in batch))
+
+        for _, _, _, _, on_written in batch:
+            if on_written:
+                try:
+                    on_written()
+                except Exception as e:
+                    print(f"Error after writing chat messages: {e}")
+
+    def _release(self, batch):
+        with self._lock:
+            for _, _, session_id, rows, _ in batch:
+                del self._pending[session_id][:len(rows)]
+                if not self._pending[session_id]:
+                    del self._pending[session_id]
+                self._pending_count -= len(rows)
+
+def build_message_writer():
+    '''
+    Builds the chat history writer from the environment: CHAT_HISTORY_WRITES (background or sync), CHAT_HISTORY_FLUSH_INTERVAL (seconds),
+    CHAT_HISTORY_MAX_BATCH and CHAT_HISTORY_MAX_PENDING. Returns None (messages are inserted by the request) with sync.
+    '''
+    mode = os.getenv("CHAT_HISTORY_WRITES", "background").lower()
+    if mode not in ("background", "sync"):
+        raise ValueError(f"CHAT_HISTORY_WRITES should be background or sync, got {mode}")
+
+    if mode == "sync":
+        return None
+
+    writer = MessageWriter(
+        flush_interval=float(os.getenv("CHAT_HISTORY_FLUSH_INTERVAL", 0.05)),
+        max_batch=int(os.getenv("CHAT_HISTORY_MAX_BATCH", 500)),
+        max_pending=int(os.getenv("CHAT_HISTORY_MAX_PENDING", 10000))
+    )
+    atexit.register(writer.close)
+
+    return writer
+
+# None when CHAT_HISTORY_WRITES is sync, built on first use (message_writer.get())
+message_writer = Lazy("message_writer", build_message_writer)
@@ -0,0 +1,13 @@
+def gauges_collector(prefix, read_values, help):
+    '''
+    Collector (see Registry.add_collector) exposing every numeric value of the dict returned by read_values as a <prefix>_<key> gauge,
+    e.g. the counters of the connection pool or of the caches
+    '''
+    def collect():
+        return [
+            (f"{prefix}_{key}", "gauge", help, [({}, value)])
+            for key, value in read_values().items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        ]
+
+    return collect
@@ -0,0 +1,92 @@
+import threading
+import time
+from contextvars import ContextVar
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+from monitoring.metrics import current_stage, record_token_usage, retriever_duration, stage_duration, stage_errors
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Times the LLM calls and retrievals of every LangChain run and accounts the tokens of each LLM call to its stage.
+
+    The stage of an LLM call is, in order: the "stage" metadata of the call or of one of its parent chains
+    (see chains/answer_pipeline.py), the enclosing monitoring.metrics.stage, or "llm".
+    """
+
+    # Called in the thread of the run, so the enclosing stage (a context variable) is visible
+    run_inline = True
+
+    def __init__(self):
+        # run id -> stage of the chains, start time of the LLM calls and retrievals in progress
+        self._stages = {}
+        self._starts = {}
+        self._streamed_tokens = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, run_id, parent_run_id, metadata):
+        stage = (metadata or {}).get("stage")
+        with self._lock:
+            stage = stage or self._stages.get(parent_run_id) or current_stage.get()
+            self._stages[run_id] = stage
+
+        return stage
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._stage(run_id, parent_run_id, metadata)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            self._stages.pop(run_id, None)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.on_chain_end(None, run_id=run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._stage(run_id, parent_run_id, metadata)
+        self._starts[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, parent_run_id=parent_run_id, metadata=metadata)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            self._streamed_tokens[run_id] = self._streamed_tokens.get(run_id, 0) + 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        stage, streamed_tokens = self._finish_llm(run_id)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+
+        record_token_usage(stage, usage.get("prompt_tokens", 0), usage.get("completion_tokens") or streamed_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        stage, _ = self._finish_llm(run_id)
+        stage_errors.inc(stage=stage)
+
+    def _finish_llm(self, run_id):
+        start = self._starts.pop(run_id, None)
+
+        with self._lock:
+            stage = self._stages.pop(run_id, None) or "llm"
+            streamed_tokens = self._streamed_tokens.pop(run_id, 0)
+
+        if start is not None:
+            stage_duration.observe(time.perf_counter() - start, stage=stage)
+
+        return stage, streamed_tokens
+
+    def on_retriever_start(self, serialized, query, *, run_id, name=None, **kwargs):
+        self._starts[run_id] = (time.perf_counter(), name or (serialized or {}).get("name") or "retriever")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        start, name = self._starts.pop(run_id, (None, None))
+        if start is not None:
+            retriever_duration.observe(time.perf_counter() - start, retriever=name)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self.on_retriever_end(None, run_id=run_id)
+
+metrics_callback_handler = MetricsCallbackHandler()
+
+# The handler is added to every LangChain run of the process, without passing callbacks to each chain, model and retriever
+metrics_callback_var = ContextVar("metrics_callback_handler", default=metrics_callback_handler)
+register_configure_hook(metrics_callback_var, inheritable=True)
@@ -0,0 +1,183 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Latency buckets in seconds, from in-memory lookups to slow LLM answers
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Innermost stage being timed in this context (see stage), LLM calls without a stage of their own are accounted to it
+current_stage = ContextVar("current_stage", default=None)
+
+def _label_string(labels):
+    if not labels:
+        return ""
+
+    values = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return "{" + values + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    '''
+    Monotonic counter with labels, e.g. tokens.inc(120, stage="answer", type="prompt")
+    '''
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_string(zip(self.labelnames, key))} {_format_value(value)}")
+
+        return lines
+
+class Histogram:
+    '''
+    Histogram with labels (cumulative buckets, sum and count per label values), e.g. stage_duration.observe(0.12, stage="classification")
+    '''
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (the last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        bucket = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bucket] += 1
+            self._values[key] = (counts, total + value)
+
+    def collect(self):
+        with self._lock:
+            values = { key: (list(counts), total) for key, (counts, total) in self._values.items() }
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(values.items()):
+            labels = list(zip(self.labelnames, key))
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_string(labels + [('le', _format_value(float(bound)))])} {cumulative}")
+
+            lines.append(f"{self.name}_sum{_label_string(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_label_string(labels)} {cumulative}")
+
+        return lines
+
+class Registry:
+    '''
+    Metrics of this process, rendered in the Prometheus text format by /metrics.
+
+    Collectors are functions called at scrape time returning (name, type, help, [(labels dict, value)]) tuples,
+    for values that are already counted elsewhere (connection pool, caches).
+    '''
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.collect()
+
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+
+            for name, metric_type, help, samples in families:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {metric_type}"]
+                lines += [f"{name}{_label_string(sorted(labels.items()))} {_format_value(value)}" for labels, value in samples]
+
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+request_duration = registry.histogram("ichild_request_duration_seconds", "Time to build the response of a request (first byte for streamed responses)", ["route", "method", "status"])
+stage_duration = registry.histogram("ichild_stage_duration_seconds", "Time spent in each stage of a search (classification, embedding, retrieval, LLM calls, memory)", ["stage"])
+stage_errors = registry.counter("ichild_stage_errors_total", "Stages that raised an exception", ["stage"])
+retriever_duration = registry.histogram("ichild_retriever_duration_seconds", "Time spent in LangChain retrievers", ["retriever"])
+llm_tokens = registry.counter("ichild_llm_tokens_total", "Tokens sent to and generated by the LLMs (completion tokens of streamed answers are counted per streamed token)", ["stage", "type"])
+
+@contextmanager
+def stage(name):
+    '''
+    Times the block as the stage name (ichild_stage_duration_seconds) and counts it in ichild_stage_errors_total if it raises.
+    LLM calls made inside the block without a stage of their own have their tokens accounted to it.
+    '''
+    token = current_stage.set(name)
+    start = time.perf_counter()
+
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        stage_duration.observe(time.perf_counter() - start, stage=name)
+        current_stage.reset(token)
+
+def timed(name, function):
+    '''
+    Wraps function so that each call is timed as the stage name (see stage)
+    '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+def record_token_usage(stage_name, prompt_tokens=0, completion_tokens=0):
+    if prompt_tokens:
+        llm_tokens.inc(prompt_tokens, stage=stage_name, type="prompt")
+    if completion_tokens:
+        llm_tokens.inc(completion_tokens, stage=stage_name, type="completion")
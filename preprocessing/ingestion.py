@@ -0,0 +1,44 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from tenacity import Retrying, stop_after_attempt, wait_random_exponential
+
+def batched(items, batch_size):
+    '''
+    Splits a list into consecutive lists of at most batch_size items
+    '''
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+def embed_batches(embeddings_model, batches, max_concurrency=4, max_attempts=5):
+    '''
+    Embeds batches of texts with one embed_documents request per batch and at most max_concurrency requests in flight.
+
+    Failed requests (rate limits, timeouts) are retried with randomized exponential backoff, up to max_attempts times.
+    Yields (index of the batch, embeddings, None) as batches complete, in completion order, or (index, None, exception)
+    for a batch that still failed after max_attempts, so the caller can store every other batch.
+    '''
+    retrying = Retrying(stop=stop_after_attempt(max_attempts), wait=wait_random_exponential(multiplier=1, max=30), reraise=True)
+
+    def embed(texts):
+        return retrying(embeddings_model.embed_documents, texts)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = {}
+
+        for index, texts in enumerate(batches):
+            pending[executor.submit(embed, texts)] = index
+
+            # Only submit the next batch once a request is free, so batches are not all held in memory at once
+            if len(pending) >= max_concurrency:
+                yield from _completed(pending)
+
+        while pending:
+            yield from _completed(pending)
+
+def _completed(pending):
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+    for future in done:
+        index = pending.pop(future)
+        error = future.exception()
+
+        yield (index, None, error) if error else (index, future.result(), None)
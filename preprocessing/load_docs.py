@@ -1,57 +1,176 @@
+import argparse
 import os
 import glob
-from datetime import datetime
+import hashlib
+from collections import Counter, defaultdict
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.document_loaders import TextLoader
-from langchain_postgres import PGVector
-from langchain_postgres.vectorstores import PGVector
-from langchain.embeddings import OpenAIEmbeddings
+from sqlalchemy import bindparam, create_engine, delete, select, update
+from sqlalchemy.dialects.postgresql import insert
 
-def load_docs(embeddings_model, documents_path, collection_name, database_uri):
+from database.engine import sqlalchemy_database_uri
+from database.indexes import ensure_vector_indexes
+from preprocessing.ingestion import batched, embed_batches
+from vector_stores.pgvector import build_pg_vector_store, knowledge_base_collection_name
+
+def chunk_id(collection_name, source, content, occurrence=0):
+    '''
+    Id of a chunk, derived from its content, so an unchanged chunk keeps its id (and its embedding) from one run to the next.
+    Ids are unique across collections (langchain_pg_embedding.id is the primary key of every collection).
+    '''
+    return hashlib.sha256(f"{collection_name}\0{source}\0{occurrence}\0{content}".encode("utf-8")).hexdigest()
+
+def split_documents(documents_path, collection_name, text_splitter):
+    '''
+    Loads and splits every transcript of the knowledge base. Returns the chunks and their content ids.
+    The position of each chunk in its file is kept as its chunk_index metadata, so adjacent chunks can be merged again (see chains/context_builder.py).
+    '''
+    file_paths = glob.glob(os.path.join(documents_path, '**', '*.txt'), recursive=True)
+
+    chunks = []
+    ids = []
+
+    for file_path in file_paths:
+        try:
+            docs = TextLoader(file_path).load_and_split(text_splitter=text_splitter)
+        except Exception as e:
+            raise RuntimeError(f"Error processing {file_path}: {e}") from e
+
+        # The same text can appear twice in a file, so repeated chunks are numbered
+        occurrences = Counter()
+        for chunk_index, doc in enumerate(docs):
+            doc.metadata["chunk_index"] = chunk_index
+            ids.append(chunk_id(collection_name, doc.metadata["source"], doc.page_content, occurrences[doc.page_content]))
+            occurrences[doc.page_content] += 1
+            chunks.append(doc)
+
+    return chunks, ids
+
+def load_docs(embeddings_model, documents_path, collection_name, database_uri, batch_size=100, max_concurrency=4):
     '''
     Loads vectorized knowledge base embeddings into vector database (PGVector).
 
-    Iterates through knowledge base, calculates 1536 dimensional vector embeddings for each document and stores them in vector database.
+    Iterates through knowledge base and splits each document into chunks. Only the chunks that are not in the collection yet (new or changed text)
+    are embedded, and the chunks of the collection that are not in the knowledge base anymore (changed text or removed files) are deleted.
+    The new chunks are embedded first and all the changes are then applied in a single transaction, so searches see either the previous
+    or the new version of the knowledge base, never a mix, and a failed run leaves the collection untouched.
 
     Chunk size is currently set to 200 with an overlap of 0. This may have to be adjusted in the future.
 
     Note: This function calls OpenAIEmbeddings() which costs money to run and can be fairly expensive so try to limit this operation.
           Ideally, the vector database should only need to be loaded initially and whenever we have new data
     '''
-    
+
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=200, chunk_overlap=0)
 
-    file_paths = glob.glob(os.path.join(documents_path, '**', '*.txt'), recursive=True)
+    chunks, ids = split_documents(documents_path, collection_name, text_splitter)
 
-    vector_store = PGVector(
-        embeddings=embeddings_model,
-        collection_name=collection_name,
-        connection=database_uri,
-        use_jsonb=True,
-    )
+    # Same psycopg (3) driver as the server, PGVector and the index creation share the engine
+    engine = create_engine(sqlalchemy_database_uri(database_uri))
+    vector_store = build_pg_vector_store(embeddings_model=embeddings_model, collection_name=collection_name, connection=engine)
+    EmbeddingStore = vector_store.EmbeddingStore
 
-    # Process each file
-    for file_path in file_paths:
-        try:
-            # Load and split the document
-            loader = TextLoader(file_path)
-            docs = loader.load_and_split(text_splitter=text_splitter)
+    with vector_store.session_maker() as session:
+        collection = vector_store.get_collection(session)
+        stored = session.execute(
+            select(EmbeddingStore.id, EmbeddingStore.document, EmbeddingStore.cmetadata).where(EmbeddingStore.collection_id == collection.uuid)
+        ).all()
 
-            # Add documents to the vector store
-            vector_store.add_documents(docs)
+    stored_ids = { id for id, _, _ in stored }
+    stored_metadata = { id: metadata or {} for id, _, metadata in stored }
+    current_ids = set(ids)
 
-            print(f"Processed {file_path}")
-        except Exception as e:
-            print(f"Error processing {file_path}: {e}")
+    # Chunks stored under another id (e.g. by the previous loader, which used random ids) are renamed instead of embedded again
+    reusable_ids = defaultdict(list)
+    for id, document, metadata in stored:
+        if id not in current_ids:
+            reusable_ids[((metadata or {}).get("source"), document)].append(id)
+
+    new_chunks = []
+    renamed_ids = {}
+    # Unchanged chunks whose metadata changed (e.g. the chunk_index of chunks stored before it was recorded, or a chunk that moved in its file)
+    updated_metadata = {}
+    for id, chunk in zip(ids, chunks):
+        if id in stored_ids:
+            if stored_metadata[id] != chunk.metadata:
+                updated_metadata[id] = chunk.metadata
+            continue
+
+        reusable = reusable_ids.get((chunk.metadata["source"], chunk.page_content))
+        if reusable:
+            old_id = reusable.pop()
+            renamed_ids[old_id] = id
+            if stored_metadata[old_id] != chunk.metadata:
+                updated_metadata[id] = chunk.metadata
+        else:
+            new_chunks.append((id, chunk))
+
+    removed_ids = stored_ids - current_ids - set(renamed_ids)
+
+    print(f"{len(chunks)} chunks: {len(new_chunks)} new, {len(removed_ids)} removed, {len(chunks) - len(new_chunks)} unchanged "
+          f"({len(renamed_ids)} re-keyed, {len(updated_metadata)} with new metadata)")
+
+    batches = batched(new_chunks, batch_size)
+    embeddings = {}
+
+    for index, batch_embeddings, error in embed_batches(embeddings_model, [[chunk.page_content for _, chunk in batch] for batch in batches], max_concurrency):
+        if error:
+            raise RuntimeError(f"Error embedding chunks, the collection was not modified: {error}") from error
+
+        for (id, _), embedding in zip(batches[index], batch_embeddings):
+            embeddings[id] = embedding
+
+        print(f"Embedded {len(embeddings)} of {len(new_chunks)} chunks")
+
+    with vector_store.session_maker() as session:
+        collection = vector_store.get_collection(session)
+
+        if removed_ids:
+            session.execute(delete(EmbeddingStore).where(EmbeddingStore.collection_id == collection.uuid, EmbeddingStore.id.in_(removed_ids)))
+
+        if renamed_ids:
+            session.execute(
+                update(EmbeddingStore.__table__).where(EmbeddingStore.__table__.c.id == bindparam("old_id")).values(id=bindparam("new_id")),
+                [{ "old_id": old_id, "new_id": new_id } for old_id, new_id in renamed_ids.items()]
+            )
+
+        if updated_metadata:
+            session.execute(
+                update(EmbeddingStore.__table__).where(EmbeddingStore.__table__.c.id == bindparam("chunk_id")).values(cmetadata=bindparam("metadata")),
+                [{ "chunk_id": id, "metadata": metadata } for id, metadata in updated_metadata.items()]
+            )
+
+        for batch in batches:
+            statement = insert(EmbeddingStore).values([
+                { "id": id, "collection_id": collection.uuid, "embedding": embeddings[id], "document": chunk.page_content, "cmetadata": chunk.metadata }
+                for id, chunk in batch
+            ])
+            session.execute(statement.on_conflict_do_nothing(index_elements=["id"]))
+
+        session.commit()
+
+    # Builds the embedding index if it is missing (IVFFlat indexes need the rows to be loaded)
+    ensure_vector_indexes(engine, tables=["langchain_pg_embedding"])
+    engine.dispose()
+
+    print(f"Collection {collection_name} is up to date")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Indexes the knowledge base transcripts into a PGVector collection, only embedding the chunks that changed")
+    parser.add_argument("--documents-path", default="./knowledge_base/")
+    parser.add_argument("--collection", default=knowledge_base_collection_name(),
+                        help="collection to update, defaults to the one served (KNOWLEDGE_BASE_COLLECTION). A new name builds a new collection from scratch")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    args = parser.parse_args()
 
-docs_path = "./knowledge_base/"
-collection_name = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-database_uri = os.getenv("DATABASE_URI")
+    database_uri = os.getenv("DATABASE_URI")
 
-# Using OpenAI embeddings for now
-openai_api_key = os.getenv("OPENAI_API_KEY")
-embeddings_model = OpenAIEmbeddings(openai_api_key=openai_api_key)
+    # OpenAI embeddings, cached in the embedding_cache table so unchanged texts are not paid for twice
+    from embeddings.openai import build_openai_embeddings
+    embeddings_model = build_openai_embeddings()
 
-load_docs(embeddings_model=embeddings_model, documents_path=docs_path, collection_name=collection_name, database_uri=database_uri)
\ No newline at end of file
+    load_docs(embeddings_model=embeddings_model, documents_path=args.documents_path, collection_name=args.collection, database_uri=database_uri,
+              batch_size=args.batch_size, max_concurrency=args.max_concurrency)
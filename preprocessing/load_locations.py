@@ -1,72 +1,120 @@
+import argparse
 import os
 import pandas as pd
-from langchain.embeddings import OpenAIEmbeddings
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects.postgresql import insert
 from database.database import Location
+from database.engine import sqlalchemy_database_uri
+from database.indexes import ensure_vector_indexes
+from preprocessing.ingestion import batched, embed_batches
 
-def load_and_store_locations(embeddings_model, csv_path, database_uri):
+# Columns of the location table read from the CSV (the embedding is computed from the description)
+LOCATION_FIELDS = ["id", "name", "address", "city", "state", "country", "zip_code", "county", "latitude", "longitude", "description", "phone",
+                   "sunday_hours", "monday_hours", "tuesday_hours", "wednesday_hours", "thursday_hours", "friday_hours", "saturday_hours",
+                   "rating", "address_link", "website", "resource_type"]
+
+def store_locations(engine, rows, embeddings):
+    '''
+    Inserts (or updates, by id) a batch of locations and their embeddings in a single transaction, with one executemany statement.
+    If the batch fails (e.g. a duplicate name), its locations are inserted one by one so only the invalid rows are left out.
+    Returns the number of locations stored.
+    '''
+    statement = insert(Location.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=["id"],
+        set_={ field: statement.excluded[field] for field in LOCATION_FIELDS + ["embedding"] if field != "id" }
+    )
+
+    values = [{ **{ field: row[field] for field in LOCATION_FIELDS }, "embedding": embedding } for row, embedding in zip(rows, embeddings)]
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(statement, values)
+
+        return len(values)
+    except Exception:
+        if len(values) == 1:
+            raise
+
+    stored = 0
+    for value in values:
+        try:
+            with engine.begin() as conn:
+                conn.execute(statement, [value])
+            stored += 1
+        except Exception as e:
+            print(f"Error inserting location {value['name']}: {e}")
+
+    return stored
+
+def load_and_store_locations(embeddings_model, csv_path, database_uri, batch_size=100, max_concurrency=4):
     """
-    Load location data from a CSV, insert data into the 'location' table, 
+    Load location data from a CSV, insert data into the 'location' table,
     vectorize descriptions, and store vectors in the 'embeddings' column.
 
+    Descriptions are embedded batch_size at a time (one embed_documents request per batch) with at most max_concurrency requests in flight,
+    and each batch is stored in its own transaction as soon as it is embedded. Locations already stored with an embedding are skipped,
+    so a run that failed part way resumes where it stopped instead of paying for the same embeddings again.
+
     Note: This function calls OpenAIEmbeddings() which costs money to run and can be fairly expensive so try to limit this operation.
           Ideally, the vector database should only need to be loaded initially and whenever we have new data
 
     """
 
-    engine = create_engine(database_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    # Same psycopg (3) driver as the server
+    engine = create_engine(sqlalchemy_database_uri(database_uri))
+
+    # Empty cells are read as empty strings (the text columns are not nullable)
+    df = pd.read_csv(csv_path, keep_default_na=False)
+
+    with engine.connect() as conn:
+        stored_ids = set(conn.execute(select(Location.id).where(Location.embedding.isnot(None))).scalars())
 
-    df = pd.read_csv(csv_path)
+    rows = [row for row in df.to_dict("records") if row['id'] not in stored_ids]
+    batches = batched(rows, batch_size)
+
+    loaded = failed = 0
+    for index, embeddings, error in embed_batches(embeddings_model, [[row['description'] for row in batch] for batch in batches], max_concurrency):
+        batch = batches[index]
 
-    for _, row in df.iterrows():
-        description = row['description']
-        
         try:
-            embedding = embeddings_model.embed_query(description)
-
-            new_location = Location(
-                id=row['id'],
-                name=row['name'],
-                address=row['address'],
-                city=row['city'],
-                state=row['state'],
-                country=row['country'],
-                zip_code=row['zip_code'],
-                county=row['county'],
-                latitude=row['latitude'],
-                longitude=row['longitude'],
-                description=description,
-                phone=row['phone'],
-                sunday_hours=row['sunday_hours'],
-                monday_hours=row['monday_hours'],
-                tuesday_hours=row['tuesday_hours'],
-                wednesday_hours=row['wednesday_hours'],
-                thursday_hours=row['thursday_hours'],
-                friday_hours=row['friday_hours'],
-                saturday_hours=row['saturday_hours'],
-                rating=row['rating'],
-                address_link=row['address_link'],
-                website=row['website'],
-                resource_type=row['resource_type'],
-                embedding=embedding
-            )
-
-            session.add(new_location)
+            if error:
+                raise error
+
+            stored = store_locations(engine, batch, embeddings)
         except Exception as e:
-            print(f"Error inserting location {row['name']}: {e}")
+            stored = 0
+            print(f"Error inserting locations {batch[0]['name']} to {batch[-1]['name']}: {e}")
+
+        loaded += stored
+        failed += len(batch) - stored
+
+    print(f"Loaded {loaded} locations ({len(stored_ids)} already loaded, {failed} failed)")
+
+    # Builds the embedding index if it is missing (IVFFlat indexes need the rows to be loaded)
+    ensure_vector_indexes(engine, tables=["location"])
+
+    engine.dispose()
 
-        session.commit()
-        session.close()
+    return loaded
 
-# Using OpenAI embeddings for now
-openai_api_key = os.getenv("OPENAI_API_KEY")
-embeddings_model = OpenAIEmbeddings(openai_api_key=openai_api_key)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loads knowledge_base/locations.csv and the embeddings of the descriptions into the location table")
+    parser.add_argument("--csv-path", default="knowledge_base/locations.csv")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--fake-embeddings", action="store_true", help="use deterministic offline embeddings (embeddings/fake.py) instead of OpenAI")
+    args = parser.parse_args()
 
-csv_path = "knowledge_base/locations.csv"
+    if args.fake_embeddings:
+        from embeddings.fake import FakeEmbeddings
+        embeddings_model = FakeEmbeddings()
+    else:
+        # OpenAI embeddings, cached in the embedding_cache table so unchanged texts are not paid for twice
+        from embeddings.openai import build_openai_embeddings
+        embeddings_model = build_openai_embeddings()
 
-database_uri = os.getenv("DATABASE_URI")
+    database_uri = os.getenv("DATABASE_URI")
 
-load_and_store_locations(embeddings_model=embeddings_model, csv_path="knowledge_base/locations.csv", database_uri=database_uri)
\ No newline at end of file
+    load_and_store_locations(embeddings_model=embeddings_model, csv_path=args.csv_path, database_uri=database_uri,
+                             batch_size=args.batch_size, max_concurrency=args.max_concurrency)
@@ -1,52 +1,144 @@
-from pdf2image import convert_from_path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
 import pytesseract
+import argparse
 import os
+import sys
+import time
 
-input_folder = 'infographics'
-output_folder = 'transcribed-infographics'
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
 
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
+def init_worker():
+    # Each worker runs one tesseract process at a time, so tesseract itself should not start threads on every core
+    os.environ["OMP_THREAD_LIMIT"] = "1"
 
 def transcribe_image(image):
+    return pytesseract.image_to_string(image)
+
+def transcribe_page(file_path, page):
+    '''
+    Renders and transcribes a single page of a PDF (page is 1-based), or the whole image when page is None.
+    Returns the transcription (None if the page could not be rendered or transcribed) and the seconds spent.
+    '''
+    start = time.perf_counter()
+
     try:
-        text = pytesseract.image_to_string(image)
-        return text
+        if page is None:
+            with Image.open(file_path) as image:
+                transcription = transcribe_image(image)
+        else:
+            # Only this page is rendered, whole documents are never held in memory
+            image, = convert_from_path(file_path, first_page=page, last_page=page)
+            transcription = transcribe_image(image)
     except Exception as e:
-        print(f"Error during transcription: {e}")
-        return ""
-
-def process_pdf(pdf_path):
-    images = convert_from_path(pdf_path)
-    full_transcription = ""
-
-    for i, image in enumerate(images):
-        print(f"Transcribing {os.path.basename(pdf_path)} page {i+1}...")
-        transcription = transcribe_image(image)
-        full_transcription += transcription + "\n"
-
-    # save transcription to corresponding txt
-    output_file_path = os.path.join(output_folder, f"{os.path.basename(pdf_path)}.txt")
-    with open(output_file_path, "w") as text_file:
-        text_file.write(full_transcription)
-    # print(f"Saved full transcription for {os.path.basename(pdf_path)}.\n")
-
-for filename in os.listdir(input_folder):
-    file_path = os.path.join(input_folder, filename)
-
-    if filename.endswith(".pdf"):
-        print(f"Processing PDF: {filename}")
-        process_pdf(file_path)
-
-    elif filename.endswith(".jpg") or filename.endswith(".jpeg") or filename.endswith(".png"):
-        # print(f"Processing image: {filename}")
-        with Image.open(file_path) as img:
-            transcription = transcribe_image(img)
-
-        output_file_path = os.path.join(output_folder, f"{filename}.txt")
-        with open(output_file_path, "w") as text_file:
-            text_file.write(transcription)
-        print(f"Saved transcription for {filename}.\n")
-
-print("All files processed and cleaned up.")
+        print(f"Error transcribing {os.path.basename(file_path)} page {page}: {e}")
+        transcription = None
+
+    return transcription, time.perf_counter() - start
+
+def output_path(output_folder, filename):
+    return os.path.join(output_folder, f"{filename}.txt")
+
+def is_up_to_date(file_path, output_file_path):
+    # Empty transcriptions were written for failed files by earlier versions of this script, they are transcribed again
+    return os.path.exists(output_file_path) and os.path.getsize(output_file_path) > 0 and os.path.getmtime(output_file_path) >= os.path.getmtime(file_path)
+
+def write_transcription(output_file_path, transcription):
+    # Written under another name and renamed, an interrupted run never leaves a partial transcription that looks up to date
+    temporary_path = output_file_path + ".tmp"
+    with open(temporary_path, "w") as text_file:
+        text_file.write(transcription)
+    os.replace(temporary_path, output_file_path)
+
+def transcribe_folder(input_folder, output_folder, workers=None, force=False):
+    '''
+    Transcribes every PDF and image of input_folder into a txt file of output_folder, fanning the pages of all files out to a process pool.
+    Files whose transcription is newer than the file itself are skipped unless force is set.
+    A file with a page that fails is not saved (its transcription stays missing or out of date, so the next run retries it).
+    Returns the names of the files that failed.
+    '''
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    # file name -> page numbers (None for images)
+    files = {}
+    skipped = 0
+    failed = []
+
+    for filename in sorted(os.listdir(input_folder)):
+        file_path = os.path.join(input_folder, filename)
+
+        if not filename.lower().endswith((".pdf",) + IMAGE_EXTENSIONS):
+            continue
+
+        if not force and is_up_to_date(file_path, output_path(output_folder, filename)):
+            skipped += 1
+            continue
+
+        if filename.lower().endswith(".pdf"):
+            try:
+                files[filename] = list(range(1, pdfinfo_from_path(file_path)["Pages"] + 1))
+            except Exception as e:
+                print(f"Error reading {filename}: {e}")
+                failed.append(filename)
+        else:
+            files[filename] = [None]
+
+    print(f"Transcribing {len(files)} files ({sum(len(pages) for pages in files.values())} pages), {skipped} already up to date")
+
+    start = time.perf_counter()
+    transcriptions = { filename: {} for filename in files }
+    seconds = { filename: 0.0 for filename in files }
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = {
+            executor.submit(transcribe_page, os.path.join(input_folder, filename), page): (filename, page)
+            for filename, pages in files.items()
+            for page in pages
+        }
+
+        for future in as_completed(futures):
+            filename, page = futures[future]
+            transcription, page_seconds = future.result()
+
+            transcriptions[filename][page] = transcription
+            seconds[filename] += page_seconds
+
+            # Save the file as soon as its last page is transcribed
+            if len(transcriptions[filename]) == len(files[filename]):
+                pages = transcriptions.pop(filename)
+
+                if None in pages.values():
+                    failed.append(filename)
+                    print(f"Transcription of {filename} failed, it is not saved")
+                    continue
+
+                if files[filename] == [None]:
+                    full_transcription = pages[None]
+                else:
+                    full_transcription = "".join(pages[page] + "\n" for page in files[filename])
+
+                write_transcription(output_path(output_folder, filename), full_transcription)
+
+                print(f"Saved transcription for {filename} ({len(files[filename])} pages, {seconds[filename]:.1f} s of OCR, done after {time.perf_counter() - start:.1f} s)")
+
+    total = sum(seconds.values())
+    elapsed = time.perf_counter() - start
+    print(f"All files processed in {elapsed:.1f} s ({total:.1f} s of OCR, {total / elapsed if elapsed else 0:.1f}x parallelism).")
+
+    if failed:
+        print(f"{len(failed)} files failed and were not saved: {', '.join(sorted(failed))}")
+
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribes infographics (PDFs and images) with tesseract, one page per worker process")
+    parser.add_argument("--input-folder", default="infographics")
+    parser.add_argument("--output-folder", default="transcribed-infographics")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the number of cores")
+    parser.add_argument("--force", action="store_true", help="transcribe files even if their transcription is up to date")
+    args = parser.parse_args()
+
+    if transcribe_folder(args.input_folder, args.output_folder, workers=args.workers, force=args.force):
+        sys.exit(1)
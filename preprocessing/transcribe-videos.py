@@ -1,45 +1,122 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
 import os
+import sys
 import speech_recognition as sr
 from moviepy.editor import VideoFileClip
 import tempfile
+import time
 
-input_folder = 'video-files'
-output_folder = 'transcribed-files'
+def transcribe_video(video_path):
+    '''
+    Extracts the audio of a video and transcribes it. Returns the transcription (None if it failed), the error and the seconds spent.
+    Runs in a worker process.
+    '''
+    start = time.perf_counter()
+    recognizer = sr.Recognizer()
+    text, error = None, None
 
-recognizer = sr.Recognizer()
+    # extract audio only (as .wav)
+    with VideoFileClip(video_path) as video, tempfile.NamedTemporaryFile(suffix='.wav', delete=True) as temp_audio_file:
+        temp_audio_path = temp_audio_file.name
+        video.audio.write_audiofile(temp_audio_path, logger=None)
+
+        # transcribe audio
+        with sr.AudioFile(temp_audio_path) as source:
+            audio = recognizer.record(source)
+            try:
+                text = recognizer.recognize_google(audio)
+            except sr.UnknownValueError:
+                error = "could not understand audio"
+            except sr.RequestError as e:
+                error = f"error with the request: {e}"
+
+    return text, error, time.perf_counter() - start
+
+def is_failed_transcription(txt_path):
+    # Earlier versions of this script saved the error as the transcription
+    with open(txt_path) as txt_file:
+        text = txt_file.read()
+
+    return text == "Could not understand audio" or text.startswith("Error with the request:")
+
+def write_transcription(txt_path, text):
+    # Written under another name and renamed, an interrupted run never leaves a partial transcription that looks up to date
+    temporary_path = txt_path + ".tmp"
+    with open(temporary_path, 'w') as txt_file:
+        txt_file.write(text)
+    os.replace(temporary_path, txt_path)
+
+def transcribe_folder(input_folder, output_folder, workers=None, force=False):
+    '''
+    Transcribes every video of input_folder into a txt file of output_folder, one video per worker process.
+    Videos whose transcription is newer than the video itself are skipped unless force is set.
+    A video that fails is not saved (its transcription stays missing or out of date, so the next run retries it) and is listed in transcribed-err.txt.
+    Returns the names of the videos that failed.
+    '''
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    videos = []
+    for file in sorted(os.listdir(input_folder)):
+        if not file.lower().endswith(('.mp4', '.mov')):
+            continue
 
-for file in os.listdir(input_folder):
-    
-    if file.lower().endswith(('.mp4', '.mov')):
         video_path = os.path.join(input_folder, file)
-        
-        try:
-            # extract audio only (as .wav)
-            video = VideoFileClip(video_path)
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=True) as temp_audio_file:
-                temp_audio_path = temp_audio_file.name
-                video.audio.write_audiofile(temp_audio_path)
-
-                # transcribe audio
-                with sr.AudioFile(temp_audio_path) as source:
-                    audio = recognizer.record(source)
-                    try:
-                        text = recognizer.recognize_google(audio)
-                    except sr.UnknownValueError:
-                        text = "Could not understand audio"
-                        # make a list of vids that wasn't able to be transcribed
-                        with open('transcribed-err.txt', 'a') as txt_err_file:
-                            txt_err_file.write(file + '\n')
-                    except sr.RequestError as e:
-                        text = f"Error with the request: {e}"
-        
+        txt_path = os.path.join(output_folder, os.path.splitext(file)[0] + '.txt')
+
+        if force or not os.path.exists(txt_path) or os.path.getmtime(txt_path) < os.path.getmtime(video_path) or is_failed_transcription(txt_path):
+            videos.append(file)
+
+    print(f"Transcribing {len(videos)} videos, {len(os.listdir(input_folder)) - len(videos)} other files or already up to date")
+
+    start = time.perf_counter()
+    total = 0.0
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = { executor.submit(transcribe_video, os.path.join(input_folder, file)): file for file in videos }
+
+        for future in as_completed(futures):
+            file = futures[future]
+
+            try:
+                text, error, seconds = future.result()
+            except Exception as e:
+                text, error, seconds = None, e, 0.0
+
+            total += seconds
+
+            if text is None:
+                print(f"An error occurred while processing {file}, it is not saved: {error}")
+                failed.append(file)
+
+                # make a list of vids that wasn't able to be transcribed
+                with open('transcribed-err.txt', 'a') as txt_err_file:
+                    txt_err_file.write(file + '\n')
+                continue
+
             # save transcription to corresponding txt
             txt_filename = os.path.splitext(file)[0] + '.txt'
-            txt_path = os.path.join(output_folder, txt_filename)
-            with open(txt_path, 'w') as txt_file:
-                txt_file.write(text)
-        
-            print(f'Transcription for {file} saved as {txt_filename}')
-        
-        except Exception as e:
-            print(f"An error occurred while processing {file}: {e}")
+            write_transcription(os.path.join(output_folder, txt_filename), text)
+
+            print(f'Transcription for {file} saved as {txt_filename} ({seconds:.1f} s)')
+
+    elapsed = time.perf_counter() - start
+    print(f"All videos processed in {elapsed:.1f} s ({total:.1f} s of work, {total / elapsed if elapsed else 0:.1f}x parallelism).")
+
+    if failed:
+        print(f"{len(failed)} videos failed and were not saved: {', '.join(sorted(failed))}")
+
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribes the audio of videos, one video per worker process")
+    parser.add_argument("--input-folder", default="video-files")
+    parser.add_argument("--output-folder", default="transcribed-files")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the number of cores")
+    parser.add_argument("--force", action="store_true", help="transcribe videos even if their transcription is up to date")
+    args = parser.parse_args()
+
+    if transcribe_folder(args.input_folder, args.output_folder, workers=args.workers, force=args.force):
+        sys.exit(1)
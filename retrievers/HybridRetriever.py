@@ -0,0 +1,160 @@
+import math
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+import numpy as np
+from sqlalchemy import text
+
+from retrievers.TableColumnRetriever import top_k_indices
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i", "if", "in", "is", "it", "its", "my",
+    "of", "on", "or", "should", "that", "the", "this", "to", "was", "what", "when", "where", "which", "who", "why", "will", "with", "you", "your"
+}
+
+# Embedding requests of HybridRetriever, a request that timed out keeps its thread until it returns
+_embedding_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-embedding")
+
+def tokenize(value):
+    '''
+    Lowercase word tokens without stop words, with plurals reduced to their singular ("IUDs" matches "IUD")
+    '''
+    tokens = []
+    for token in TOKEN_PATTERN.findall(value.lower()):
+        if token in STOP_WORDS:
+            continue
+
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+
+        tokens.append(token)
+
+    return tokens
+
+class BM25Index:
+    '''
+    In-process BM25 index over the page content of documents.
+
+    Postings are numpy arrays, so scoring a query is one vectorized update per query term (no loop over the documents).
+    '''
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = documents
+        self.k1 = k1
+
+        postings = defaultdict(dict)
+        lengths = np.zeros(len(documents), dtype=np.float32)
+
+        for i, document in enumerate(documents):
+            tokens = tokenize(document.page_content)
+            lengths[i] = len(tokens)
+
+            for token, count in Counter(tokens).items():
+                postings[token][i] = count
+
+        self.postings = {
+            token: (np.fromiter(counts.keys(), dtype=np.int32, count=len(counts)), np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+            for token, counts in postings.items()
+        }
+        self.idf = { token: math.log(1 + (len(documents) - len(counts) + 0.5) / (len(counts) + 0.5)) for token, counts in postings.items() }
+
+        average_length = lengths.mean() if len(documents) else 0
+        self.length_norm = k1 * (1 - b + b * lengths / average_length) if average_length else np.full(len(documents), k1, dtype=np.float32)
+
+    def search(self, query, k):
+        '''
+        Returns the (at most) k documents with the highest BM25 score for query, best first. Documents without any query term are never returned.
+        '''
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+
+            indices, counts = posting
+            scores[indices] += self.idf[token] * counts * (self.k1 + 1) / (counts + self.length_norm[indices])
+
+        candidates = np.flatnonzero(scores)
+
+        return [self.documents[candidates[i]] for i in top_k_indices(scores[candidates], k)]
+
+def document_key(document):
+    return (document.metadata.get("source"), document.page_content)
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=60):
+    '''
+    Merges rankings of documents: each document scores the sum of 1 / (rrf_k + rank) over the rankings it appears in.
+    Returns the k best documents.
+    '''
+    scores = defaultdict(float)
+    documents = {}
+
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = document_key(document)
+            scores[key] += 1 / (rrf_k + rank)
+            documents.setdefault(key, document)
+
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+class HybridRetriever(BaseRetriever):
+    """A retriever fusing the results of a vector search and of a BM25 index over the same documents with reciprocal rank fusion.
+
+    Exact terms ("mastitis", "IUD") are matched by the lexical search while the vector search matches paraphrases.
+    When the query cannot be embedded within embedding_timeout seconds (or the embeddings call fails) the lexical results are returned on their own.
+    """
+
+    lexical_index: BM25Index
+    vector_store: VectorStore
+    embeddings: Embeddings
+    k: int = 4
+    """Number of documents returned."""
+    fetch_k: int = 10
+    """Number of documents taken from each search before fusion."""
+    rrf_k: int = 60
+    embedding_timeout: float = 2.0
+
+    def get_relevant_documents(
+        self, query: str
+    ) -> List[Document]:
+        query_embedding = _embedding_executor.submit(self.embeddings.embed_query, query)
+
+        # The lexical search runs while the query is being embedded
+        lexical_documents = self.lexical_index.search(query, self.fetch_k)
+
+        try:
+            embedding = query_embedding.result(timeout=self.embedding_timeout)
+        except Exception:
+            return lexical_documents[:self.k]
+
+        return self.get_relevant_documents_by_vector(query, embedding, lexical_documents)
+
+    def get_relevant_documents_by_vector(self, query: str, query_embedding: List[float], lexical_documents: Optional[List[Document]] = None) -> List[Document]:
+        """Retrieve documents for a query that has already been embedded."""
+
+        if lexical_documents is None:
+            lexical_documents = self.lexical_index.search(query, self.fetch_k)
+
+        vector_documents = self.vector_store.similarity_search_by_vector(query_embedding, k=self.fetch_k)
+
+        return reciprocal_rank_fusion([vector_documents, lexical_documents], self.k, self.rrf_k)
+
+def load_collection_documents(engine, collection_name):
+    '''
+    Reads the documents (chunks and their metadata) of a PGVector collection
+    '''
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT e.document, e.cmetadata FROM langchain_pg_embedding e JOIN langchain_pg_collection c ON c.uuid = e.collection_id "
+            "WHERE c.name = :collection_name ORDER BY e.id"
+        ), { "collection_name": collection_name })
+
+        return [Document(page_content=document or "", metadata=metadata or {}) for document, metadata in rows]
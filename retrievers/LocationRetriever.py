@@ -0,0 +1,158 @@
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+import numpy as np
+
+from retrievers.TableColumnRetriever import TableColumnRetriever, load_table, normalize_embeddings, top_k_indices
+from retrievers.compact_index import build_compact_index
+from retrievers.location_documents import build_location_documents
+from retrievers.place_matcher import NOT_PLACES, PlaceMatcher, normalize_county, normalize_place
+
+EARTH_RADIUS_KM = 6371.0
+
+class LocationRetriever(TableColumnRetriever):
+    """A TableColumnRetriever over the location table that only ranks the locations near the place (city or county) mentioned in the query."""
+
+    place_matcher: PlaceMatcher
+    neighborhoods: Dict[Tuple[str, str], np.ndarray]
+    """Indices of the locations in, or within the search radius of, each city and county of the table.
+    Locations that are not tied to a place (e.g. nationwide hotlines) are candidates for every place."""
+
+    def get_relevant_documents(
+        self, query: str
+    ) -> List[Document]:
+        """Retrieve the locations most similar to the query, among the ones near the place it mentions."""
+
+        return self.get_relevant_documents_by_vector(self.openai_embeddings.embed_query(query), query)
+
+    def get_relevant_documents_by_vector(self, query_embedding: List[float], query: Optional[str] = None) -> List[Document]:
+        """Retrieve locations for a query that has already been embedded. Without the query text every location is ranked."""
+
+        candidates = self.candidates(query) if query else None
+        if candidates is None:
+            return super().get_relevant_documents_by_vector(query_embedding)
+
+        query_embedding = normalize_embeddings(query_embedding)
+
+        # Large neighborhoods go through the first pass of the compact index too
+        if self.compact_index is not None and len(candidates) > self.k * self.compact_index.rescore_factor:
+            return self.rescore(query_embedding, self.compact_index.candidates(query_embedding, self.k, rows=candidates))
+
+        # Only the embeddings of the candidates are scored
+        similarities = self.embeddings[candidates] @ query_embedding
+
+        return [self.documents[candidates[i]] for i in top_k_indices(similarities, self.k)]
+
+    def candidates(self, query: str) -> Optional[np.ndarray]:
+        """Indices of the locations near the place mentioned in the query, or None to rank every location."""
+
+        place = self.place_matcher.search(query)
+        if place is None or place not in self.neighborhoods:
+            return None
+
+        candidates = self.neighborhoods[place]
+
+        # Too few nearby locations to fill the results, rank the whole table instead
+        if len(candidates) < self.k:
+            return None
+
+        return candidates
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    '''
+    Great-circle distances in kilometers between one point and arrays of points (all in degrees).
+    '''
+    latitude, longitude, latitudes, longitudes = map(np.radians, (latitude, longitude, latitudes, longitudes))
+
+    a = np.sin((latitudes - latitude) / 2) ** 2 + np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def coordinates(values):
+    '''
+    Converts latitude or longitude values into a float array, with NaN for missing or invalid values.
+    '''
+    array = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        try:
+            array[i] = float(value)
+        except (TypeError, ValueError):
+            pass
+
+    return array
+
+
+def build_neighborhoods(cities, counties, latitudes, longitudes, radius_km):
+    '''
+    Returns the indices of the locations of each city and county, plus the ones within radius_km of its center
+    (the mean coordinates of its locations), and of the locations that are not tied to a place.
+    '''
+    cities = np.array([normalize_place(city) for city in cities], dtype=object)
+    counties = np.array([normalize_county(county) for county in counties], dtype=object)
+
+    # (0, 0) is what the geocoder returns when the address was not found
+    located = np.isfinite(latitudes) & np.isfinite(longitudes) & ~((latitudes == 0) & (longitudes == 0))
+    everywhere = np.flatnonzero(np.isin(cities, list(NOT_PLACES)) & np.isin(counties, list(NOT_PLACES)))
+
+    neighborhoods = {}
+    for kind, names in (("city", cities), ("county", counties)):
+        for name in set(names) - NOT_PLACES:
+            in_place = names == name
+            nearby = in_place.copy()
+
+            if located[in_place].any():
+                center_latitude = latitudes[in_place & located].mean()
+                center_longitude = longitudes[in_place & located].mean()
+
+                nearby[located] |= haversine_km(center_latitude, center_longitude, latitudes[located], longitudes[located]) <= radius_km
+
+            neighborhoods[(kind, name)] = np.union1d(np.flatnonzero(nearby), everywhere)
+
+    return neighborhoods
+
+
+def build_location_retriever_from_rows(rows, embeddings, column_names, embeddings_model, k=4, radius_km=40, compact_index_config=None):
+    '''
+    Builds a LocationRetriever from rows holding the values of column_names (which must include city, county, latitude and longitude)
+    and the matching float32 embedding matrix.
+
+    With a compact_index_config (see retrievers/compact_index.py), locations are first scored on compact codes and only the best candidates
+    are rescored with their full embeddings, which are memory-mapped from compact_index_config.directory when it is set.
+    '''
+    columns = { name: i for i, name in enumerate(column_names) }
+
+    cities = [row[columns["city"]] for row in rows]
+    counties = [row[columns["county"]] for row in rows]
+    neighborhoods = build_neighborhoods(
+        cities,
+        counties,
+        coordinates([row[columns["latitude"]] for row in rows]),
+        coordinates([row[columns["longitude"]] for row in rows]),
+        radius_km
+    )
+
+    embeddings = normalize_embeddings(embeddings, copy=False)
+    compact_index = None
+    if compact_index_config is not None:
+        embeddings, compact_index = build_compact_index(embeddings, compact_index_config)
+
+    return LocationRetriever(
+        documents=build_location_documents(rows, column_names),
+        embeddings=embeddings,
+        k=k,
+        openai_embeddings=embeddings_model,
+        place_matcher=PlaceMatcher(cities, counties),
+        neighborhoods=neighborhoods,
+        compact_index=compact_index
+    )
+
+
+def build_location_retriever(connection, table_name, column_names, embedding_column_name, embeddings_model=None, k=4, radius_km=40, compact_index_config=None):
+    rows, embeddings = load_table(connection, table_name, column_names, embedding_column_name)
+
+    if embeddings_model is None:
+        from embeddings.openai import openai_embeddings
+        embeddings_model = openai_embeddings.get()
+
+    return build_location_retriever_from_rows(rows, embeddings, column_names, embeddings_model, k=k, radius_km=radius_km, compact_index_config=compact_index_config)
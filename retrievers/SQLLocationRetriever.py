@@ -0,0 +1,164 @@
+import math
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from sqlalchemy import text
+
+from retrievers.LocationRetriever import EARTH_RADIUS_KM
+from retrievers.location_documents import build_location_documents
+from retrievers.place_matcher import NOT_PLACES, PlaceMatcher, normalize_county, normalize_place
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+class SQLLocationRetriever(BaseRetriever):
+    """A retriever over the location table that ranks the locations in PostgreSQL instead of in memory, for tables too large to hold every embedding in each worker.
+
+    Queries without a place are answered with ORDER BY embedding <=> query LIMIT k, which uses the ANN index of the embedding column (see database/indexes.py).
+    Like LocationRetriever, queries mentioning a city or county only rank the locations of that place, within a bounding box of radius_km around its center
+    or not tied to a place. These are scored exactly (the place filter is applied before the ordering, not to the few rows returned by the ANN index).
+    """
+
+    connection: Any
+    """SQLAlchemy engine (see database.engine.get_engine)."""
+    table_name: str
+    column_names: List[str]
+    embedding_column_name: str
+    k: int
+    openai_embeddings: Embeddings
+    place_matcher: PlaceMatcher
+    places: Dict[Tuple[str, str], Tuple[str, List[str], Optional[float], Optional[float]]]
+    """(column, values of the column, center latitude, center longitude) of each city and county of the table."""
+    everywhere: Tuple[List[str], List[str]]
+    """City and county values of the locations that are not tied to a place (e.g. nationwide hotlines)."""
+    radius_km: float = 40
+    row_count: int = 0
+
+    def __repr__(self) -> str:
+        # Passed to the callbacks of every run, see TableColumnRetriever.__repr__
+        return f"{self.__class__.__name__}(table_name={self.table_name!r}, row_count={self.row_count}, k={self.k})"
+
+    def get_relevant_documents(
+        self, query: str
+    ) -> List[Document]:
+        """Retrieve the locations most similar to the query, among the ones near the place it mentions."""
+
+        return self.get_relevant_documents_by_vector(self.openai_embeddings.embed_query(query), query)
+
+    def get_relevant_documents_by_vector(self, query_embedding: List[float], query: Optional[str] = None) -> List[Document]:
+        """Retrieve locations for a query that has already been embedded. Without the query text every location is ranked."""
+
+        place = self.place_matcher.search(query) if query else None
+        columns_str = ', '.join(self.column_names)
+        parameters = { "embedding": "[" + ",".join(str(float(value)) for value in query_embedding) + "]", "k": self.k }
+
+        with self.connection.connect() as conn:
+            if place in self.places:
+                rows = conn.execute(text(
+                    f"WITH nearby AS MATERIALIZED (SELECT {columns_str}, {self.embedding_column_name} FROM {self.table_name} "
+                    f"WHERE {self.embedding_column_name} IS NOT NULL AND ({self._place_filter(place, parameters)})) "
+                    f"SELECT {columns_str} FROM nearby ORDER BY {self.embedding_column_name} <=> CAST(:embedding AS vector) LIMIT :k"
+                ), parameters).fetchall()
+
+                # Too few nearby locations to fill the results, rank the whole table instead
+                if len(rows) >= self.k:
+                    return build_location_documents(rows, self.column_names)
+
+            rows = conn.execute(text(
+                f"SELECT {columns_str} FROM {self.table_name} WHERE {self.embedding_column_name} IS NOT NULL "
+                f"ORDER BY {self.embedding_column_name} <=> CAST(:embedding AS vector) LIMIT :k"
+            ), parameters).fetchall()
+
+        return build_location_documents(rows, self.column_names)
+
+    def _place_filter(self, place, parameters):
+        column, values, latitude, longitude = self.places[place]
+        parameters.update({ "place_values": values, "everywhere_cities": self.everywhere[0], "everywhere_counties": self.everywhere[1] })
+
+        conditions = [f"{column} = ANY(:place_values)", "(city = ANY(:everywhere_cities) AND county = ANY(:everywhere_counties))"]
+
+        if latitude is not None:
+            latitude_delta = self.radius_km / KM_PER_DEGREE
+            longitude_delta = latitude_delta / max(math.cos(math.radians(latitude)), 0.01)
+
+            parameters.update({
+                "min_latitude": latitude - latitude_delta, "max_latitude": latitude + latitude_delta,
+                "min_longitude": longitude - longitude_delta, "max_longitude": longitude + longitude_delta
+            })
+            conditions.append("(latitude BETWEEN :min_latitude AND :max_latitude AND longitude BETWEEN :min_longitude AND :max_longitude)")
+
+        return " OR ".join(conditions)
+
+
+def build_places(groups):
+    '''
+    Aggregates (city, county, rows, located rows, mean latitude, mean longitude) groups of the location table into the places of SQLLocationRetriever
+    and the city and county values of the locations that are not tied to a place.
+    '''
+    values = defaultdict(set)
+    sums = defaultdict(lambda: [0, 0.0, 0.0])
+    everywhere = (set(), set())
+
+    for city, county, _, located, latitude, longitude in groups:
+        keys = [("city", normalize_place(city), city), ("county", normalize_county(county), county)]
+
+        if keys[0][1] in NOT_PLACES and keys[1][1] in NOT_PLACES:
+            everywhere[0].add(city)
+            everywhere[1].add(county)
+
+        for kind, name, value in keys:
+            if name in NOT_PLACES:
+                continue
+
+            values[(kind, name)].add(value)
+            if located:
+                place_sums = sums[(kind, name)]
+                place_sums[0] += located
+                place_sums[1] += located * latitude
+                place_sums[2] += located * longitude
+
+    places = {}
+    for (kind, name), place_values in values.items():
+        located, latitude_sum, longitude_sum = sums.get((kind, name), (0, 0.0, 0.0))
+        places[(kind, name)] = (
+            kind,
+            sorted(place_values),
+            latitude_sum / located if located else None,
+            longitude_sum / located if located else None
+        )
+
+    return places, (sorted(everywhere[0]), sorted(everywhere[1]))
+
+
+def build_sql_location_retriever(connection, table_name, column_names, embedding_column_name, embeddings_model=None, k=4, radius_km=40):
+    '''
+    Builds a SQLLocationRetriever over a table with city, county, latitude and longitude columns. Only the cities and counties are read,
+    with the centers of their located rows ((0, 0) is what the geocoder returns when the address was not found).
+    '''
+    with connection.connect() as conn:
+        groups = conn.execute(text(
+            f"SELECT city, county, count(*), count(*) FILTER (WHERE located), avg(latitude) FILTER (WHERE located), avg(longitude) FILTER (WHERE located) "
+            f"FROM (SELECT city, county, latitude, longitude, NOT (latitude = 0 AND longitude = 0) AS located FROM {table_name} "
+            f"WHERE {embedding_column_name} IS NOT NULL) AS locations GROUP BY city, county"
+        )).fetchall()
+
+    places, everywhere = build_places(groups)
+
+    if embeddings_model is None:
+        from embeddings.openai import openai_embeddings
+        embeddings_model = openai_embeddings.get()
+
+    return SQLLocationRetriever(
+        connection=connection,
+        table_name=table_name,
+        column_names=column_names,
+        embedding_column_name=embedding_column_name,
+        k=k,
+        openai_embeddings=embeddings_model,
+        place_matcher=PlaceMatcher([group[0] for group in groups], [group[1] for group in groups]),
+        places=places,
+        everywhere=everywhere,
+        radius_km=radius_km,
+        row_count=sum(group[2] for group in groups)
+    )
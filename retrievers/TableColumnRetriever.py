@@ -1,21 +1,27 @@
-import ast
-from typing import List
+from contextlib import contextmanager
+from typing import Any, List, Optional
 from langchain_core.documents import Document
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
 from langchain_core.retrievers import BaseRetriever
-from psycopg2 import connect
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from langchain.embeddings import OpenAIEmbeddings
+import psycopg
+from pgvector.psycopg import register_vector
 
 class TableColumnRetriever(BaseRetriever):
     """A retriever that retrieves top-k documents for a given table and its columns based on OpenAI embedding similarity."""
 
     documents: List[Document]
-    embeddings: List[np.ndarray]
+    embeddings: np.ndarray
+    """Contiguous float32 matrix (one L2-normalized row per document) so cosine similarity is a single dot product."""
     k: int
-    openai_embeddings: OpenAIEmbeddings
     """Number of top results to return."""
+    openai_embeddings: Embeddings
+    compact_index: Optional[Any] = None
+    """CompactIndex (see retrievers/compact_index.py) choosing the candidates rescored with embeddings, or None to score every row exactly."""
+
+    def __repr__(self) -> str:
+        # LangChain passes the repr of the retriever to the callbacks of every run, the default one renders every document
+        return f"{self.__class__.__name__}(documents={len(self.documents)}, k={self.k})"
 
     def get_relevant_documents(
         self, query: str
@@ -25,38 +31,175 @@ class TableColumnRetriever(BaseRetriever):
         # Step 1: Convert the query into an embedding using OpenAI
         query_embedding = self.openai_embeddings.embed_query(query)
 
-        # Step 2: Compute cosine similarities between query and document embeddings
-        similarities = cosine_similarity([query_embedding], self.embeddings)[0]
+        # Step 2 and 3: Score every document and keep the top-k
+        return self.get_relevant_documents_by_vector(query_embedding)
+
+    def get_relevant_documents_by_vector(self, query_embedding: List[float]) -> List[Document]:
+        """Retrieve documents for a query that has already been embedded."""
+
+        query_embedding = normalize_embeddings(query_embedding)
+        if self.compact_index is not None:
+            return self.rescore(query_embedding, self.compact_index.candidates(query_embedding, self.k))
+
+        # Compute cosine similarities between query and document embeddings (rows are already normalized)
+        similarities = self.embeddings @ query_embedding
+
+        # Get the top-k most similar documents
+        return [self.documents[i] for i in top_k_indices(similarities, self.k)]
+
+    def rescore(self, query_embedding: np.ndarray, candidates: np.ndarray) -> List[Document]:
+        """Rank candidate rows with their full embeddings, in row order so a memory-mapped matrix is read sequentially."""
+
+        candidates = np.sort(candidates)
+        similarities = self.embeddings[candidates] @ query_embedding
+
+        return [self.documents[candidates[i]] for i in top_k_indices(similarities, self.k)]
+
+    def get_relevant_documents_batch(self, queries: List[str]) -> List[List[Document]]:
+        """Retrieve documents for many queries with one embedding call and one matrix product."""
+
+        query_embeddings = normalize_embeddings(self.openai_embeddings.embed_documents(queries))
+
+        if self.compact_index is not None:
+            return [self.get_relevant_documents_by_vector(query_embedding) for query_embedding in query_embeddings]
+
+        # (documents x dimensions) @ (dimensions x queries) -> one column of similarities per query
+        similarities = self.embeddings @ query_embeddings.T
+
+        return [
+            [self.documents[i] for i in top_k_indices(similarities[:, j], self.k)]
+            for j in range(len(queries))
+        ]
+
+
+def normalize_embeddings(embeddings, copy=True):
+    '''
+    Converts an embedding (or a list of embeddings) into a contiguous float32 array with L2-normalized rows.
+
+    With copy=False a float32 matrix is normalized in place, which avoids holding two copies of a large table in memory.
+    '''
+    embeddings = np.array(embeddings, dtype=np.float32, copy=copy, order="C")
+
+    # einsum computes the squared norms without materializing embeddings * embeddings
+    norms = np.sqrt(np.einsum("...i,...i->...", embeddings, embeddings))[..., np.newaxis]
+    norms[norms == 0] = 1
+
+    embeddings /= norms
+
+    return embeddings
 
-        # Step 3: Get the top-k most similar documents
-        top_k_indices = np.argsort(similarities)[-self.k:][::-1]
 
-        matching_documents = [self.documents[i] for i in top_k_indices]
+def top_k_indices(similarities, k):
+    '''
+    Returns the indices of the k highest similarities, most similar first, without sorting the whole array.
+    '''
+    k = min(k, len(similarities))
+    if k == 0:
+        return []
 
-        return matching_documents
+    candidates = np.argpartition(similarities, -k)[-k:]
 
+    return candidates[np.argsort(similarities[candidates])[::-1]]
 
-def build_table_column_retriever(connection_uri, table_name, column_names, embedding_column_name):
-    conn = connect(connection_uri)
-    cursor = conn.cursor()
 
-    # Fetch embeddings and content from the database
-    columns_str = ', '.join(column_names)
-    cursor.execute(f"SELECT {columns_str}, {embedding_column_name} FROM {table_name};")
+def parse_vector(value):
+    '''
+    Parses a pgvector value in text form ("[0.1,0.2,...]") into a float32 array using numpy's C parser.
+    '''
+    return np.fromstring(value[1:-1], dtype=np.float32, sep=",")
 
-    rows = cursor.fetchall()
 
-    documents = [
+@contextmanager
+def psycopg_connection(connection):
+    '''
+    Yields a psycopg (3) connection for a connection string, or one borrowed from the pool of a SQLAlchemy engine using the psycopg driver.
+    The transaction is committed on success and rolled back on error.
+    '''
+    if isinstance(connection, str):
+        with psycopg.connect(connection) as conn:
+            yield conn
+        return
+
+    pooled = connection.raw_connection()
+    try:
+        yield pooled.driver_connection
+        pooled.commit()
+    finally:
+        # Returns the connection to the pool, rolling back anything left open
+        pooled.close()
+
+
+def load_table(connection, table_name, column_names, embedding_column_name, batch_size=2000):
+    '''
+    Loads the given columns of every row of a table along with a float32 matrix of their embeddings.
+
+    connection is a connection string or a SQLAlchemy engine (see database.engine.get_engine).
+    Embeddings are transferred in pgvector's binary format (decoded with np.frombuffer) and rows are streamed
+    through a server-side cursor straight into a preallocated matrix, so neither the text literals nor a
+    Python list of floats per row are ever materialized. Rows without an embedding are skipped.
+    '''
+    with psycopg_connection(connection) as conn:
+        # Count and stream from the same snapshot so the preallocated matrix matches the rows that are read
+        conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;")
+
+        register_vector(conn)
+
+        count, dimensions = conn.execute(
+            f"SELECT count(*), max(vector_dims({embedding_column_name})) FROM {table_name} WHERE {embedding_column_name} IS NOT NULL;"
+        ).fetchone()
+
+        rows = []
+        embeddings = np.empty((count, dimensions or 0), dtype=np.float32)
+
+        columns_str = ', '.join(column_names)
+        with conn.cursor(name=f"load_{table_name}", binary=True) as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(f"SELECT {columns_str}, {embedding_column_name} FROM {table_name} WHERE {embedding_column_name} IS NOT NULL;")
+
+            for i, row in enumerate(cursor):
+                embeddings[i] = row[-1]
+                rows.append(row[:-1])
+
+    return rows, embeddings
+
+
+def build_documents(rows, column_names):
+    return [
         Document(page_content="##".join([str(row[i]) for i in range(len(column_names))]))
         for row in rows
     ]
 
-    embeddings = [np.array(ast.literal_eval(row[len(column_names)])) for row in rows]
 
-    # Initialize OpenAIEmbeddings from LangChain
-    openai_embeddings = OpenAIEmbeddings()
+def build_table_column_retriever_from_rows(rows, column_names, embeddings_model, k=4):
+    '''
+    Builds a TableColumnRetriever from already fetched rows.
 
-    # Create the retriever with OpenAI embeddings
-    retriever = TableColumnRetriever(documents=documents, embeddings=embeddings, k=4, openai_embeddings=openai_embeddings)
+    Each row holds the values of column_names followed by the embedding (as returned by pgvector in text form).
+    '''
+    embeddings = np.empty((len(rows), len(parse_vector(rows[0][-1])) if rows else 0), dtype=np.float32)
+    for i, row in enumerate(rows):
+        embeddings[i] = parse_vector(row[len(column_names)])
+
+    return TableColumnRetriever(
+        documents=build_documents(rows, column_names),
+        embeddings=normalize_embeddings(embeddings, copy=False),
+        k=k,
+        openai_embeddings=embeddings_model
+    )
 
-    return retriever
\ No newline at end of file
+
+def build_table_column_retriever(connection, table_name, column_names, embedding_column_name, embeddings_model=None, k=4):
+    rows, embeddings = load_table(connection, table_name, column_names, embedding_column_name)
+
+    if embeddings_model is None:
+        # Reuse the process-wide OpenAIEmbeddings instead of building a new client per retriever
+        from embeddings.openai import openai_embeddings
+        embeddings_model = openai_embeddings.get()
+
+    # Create the retriever with OpenAI embeddings
+    return TableColumnRetriever(
+        documents=build_documents(rows, column_names),
+        embeddings=normalize_embeddings(embeddings, copy=False),
+        k=k,
+        openai_embeddings=embeddings_model
+    )
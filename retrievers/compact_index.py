@@ -0,0 +1,235 @@
+import hashlib
+import os
+import tempfile
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from retrievers.TableColumnRetriever import normalize_embeddings, top_k_indices
+
+# none keeps float32 first-pass vectors, int8 stores each value in a byte (per-row scale), binary only the sign of each value (one bit)
+QUANTIZATIONS = ("none", "int8", "binary")
+
+# quantization: see QUANTIZATIONS, dimensions: first-pass vectors are projected on this many principal components (None keeps every dimension),
+# rescore_factor: the first pass keeps k * rescore_factor candidates, rescored with the full vectors,
+# directory: where the index files are written and memory-mapped from, so every worker of the server maps the same pages
+CompactIndexConfig = namedtuple("CompactIndexConfig", ["quantization", "dimensions", "rescore_factor", "directory"])
+
+# Rows scored at once, the float32 copy of the codes made by each query stays small enough for the CPU cache
+SCORE_CHUNK_ROWS = 1024
+
+# Rows the principal components are computed from
+PCA_SAMPLE_ROWS = 20000
+
+# Index files of other tables (or of an older version of the table) are deleted once they have not been written to for this long
+STALE_INDEX_SECONDS = 3600
+
+# Number of set bits of every byte value, binary codes are compared by popcount of their XOR
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint16)
+
+def compact_index_config_from_env(prefix="LOCATION_INDEX"):
+    '''
+    Reads the compact index configuration from <prefix>_QUANTIZATION (none, int8 or binary), <prefix>_DIMENSIONS, <prefix>_RESCORE_FACTOR
+    and <prefix>_DIRECTORY. Returns None (full float32 vectors in memory, the default) when neither a quantization nor dimensions are set.
+    '''
+    quantization = os.getenv(f"{prefix}_QUANTIZATION", "none").lower()
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"{prefix}_QUANTIZATION should be one of {', '.join(QUANTIZATIONS)}, got {quantization}")
+
+    dimensions = int(os.getenv(f"{prefix}_DIMENSIONS", 0)) or None
+    if quantization == "none" and dimensions is None:
+        return None
+
+    return CompactIndexConfig(
+        quantization=quantization,
+        dimensions=dimensions,
+        rescore_factor=int(os.getenv(f"{prefix}_RESCORE_FACTOR", 10)),
+        directory=os.getenv(f"{prefix}_DIRECTORY", os.path.join(tempfile.gettempdir(), "ichild-location-index"))
+    )
+
+class CompactIndex:
+    '''
+    First-pass scoring of a normalized embedding matrix on compact codes: vectors projected on their principal components (PCA)
+    and/or quantized to int8 or to one bit per dimension. candidates() returns the rows to rescore exactly with the full vectors.
+
+    An int8 code takes a quarter of the float32 vector and a binary one a 32nd, so the first pass reads far less memory.
+    Opened from files (see build_compact_index), the codes and the full vectors are memory-mapped and shared by every process mapping them.
+    '''
+
+    def __init__(self, quantization, codes, scales=None, projection=None, rescore_factor=10):
+        self.quantization = quantization
+        self.codes = codes
+        self.scales = scales
+        self.projection = projection
+        self.rescore_factor = rescore_factor
+
+    def __repr__(self):
+        dimensions = self.projection.shape[1] if self.projection is not None else None
+        return f"{self.__class__.__name__}(rows={len(self.codes)}, quantization={self.quantization}, dimensions={dimensions})"
+
+    def encode_query(self, query_embedding):
+        query = normalize_embeddings(query_embedding)
+        if self.projection is not None:
+            query = query @ self.projection
+
+        if self.quantization == "binary":
+            return np.packbits(query > 0)
+
+        return query
+
+    def scores(self, query, rows=None):
+        '''
+        Approximate similarities of the (encoded) query with every row, or with the given rows
+        '''
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.empty(len(codes), dtype=np.float32)
+
+        for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+            chunk = codes[start:start + SCORE_CHUNK_ROWS]
+
+            if self.quantization == "binary":
+                # Fewer differing signs is more similar
+                scores[start:start + len(chunk)] = -POPCOUNT[np.bitwise_xor(chunk, query)].sum(axis=1, dtype=np.int32)
+            else:
+                scores[start:start + len(chunk)] = chunk.astype(np.float32, copy=False) @ query
+
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+
+        return scores
+
+    def candidates(self, query_embedding, k, rows=None):
+        '''
+        Indices of the k * rescore_factor rows most similar to the query according to the codes, among rows if given
+        '''
+        scores = self.scores(self.encode_query(query_embedding), rows)
+        candidates = top_k_indices(scores, k * self.rescore_factor)
+
+        return candidates if rows is None else rows[candidates]
+
+    def memory(self):
+        '''
+        Bytes of the index held by this process (heap) and mapped from its files (shared by every process mapping them)
+        '''
+        arrays = [array for array in (self.codes, self.scales, self.projection) if array is not None]
+
+        return {
+            "heap_bytes": sum(array.nbytes for array in arrays if not isinstance(array, np.memmap)),
+            "mapped_bytes": sum(array.nbytes for array in arrays if isinstance(array, np.memmap))
+        }
+
+
+def principal_components(embeddings, dimensions, seed=0):
+    '''
+    Returns the (embedding dimensions x dimensions) projection on the principal directions of a sample of the rows.
+    The rows are not centered: similarities are dot products, so the projection keeps the directions of the largest dot products.
+
+    The principal directions are then randomly rotated, which leaves the dot products unchanged but spreads the variance evenly over the
+    dimensions: otherwise the first few dimensions dominate, the int8 scale of each row and every bit of a binary code alike.
+    '''
+    rng = np.random.default_rng(seed)
+
+    rows = embeddings
+    if len(rows) > PCA_SAMPLE_ROWS:
+        rows = embeddings[np.sort(rng.choice(len(embeddings), PCA_SAMPLE_ROWS, replace=False))]
+
+    _, _, components = np.linalg.svd(np.asarray(rows, dtype=np.float32), full_matrices=False)
+    rotation, _ = np.linalg.qr(rng.standard_normal((dimensions, dimensions)))
+
+    return np.ascontiguousarray(components[:dimensions].T @ rotation.astype(np.float32))
+
+
+def encode_rows(embeddings, quantization, projection):
+    '''
+    Returns the codes (and the per-row scales of int8 codes) of normalized embeddings, SCORE_CHUNK_ROWS rows at a time
+    '''
+    dimensions = projection.shape[1] if projection is not None else embeddings.shape[1]
+    if quantization == "binary":
+        codes = np.empty((len(embeddings), (dimensions + 7) // 8), dtype=np.uint8)
+    else:
+        codes = np.empty((len(embeddings), dimensions), dtype=np.int8 if quantization == "int8" else np.float32)
+    scales = np.empty(len(embeddings), dtype=np.float32) if quantization == "int8" else None
+
+    for start in range(0, len(embeddings), SCORE_CHUNK_ROWS):
+        chunk = embeddings[start:start + SCORE_CHUNK_ROWS]
+        if projection is not None:
+            chunk = chunk @ projection
+
+        if quantization == "binary":
+            codes[start:start + len(chunk)] = np.packbits(chunk > 0, axis=1)
+        elif quantization == "int8":
+            # Symmetric per-row scale, the largest value of each row maps to 127
+            chunk_scales = np.abs(chunk).max(axis=1) / 127
+            chunk_scales[chunk_scales == 0] = 1
+            codes[start:start + len(chunk)] = np.rint(chunk / chunk_scales[:, np.newaxis])
+            scales[start:start + len(chunk)] = chunk_scales
+        else:
+            codes[start:start + len(chunk)] = chunk
+
+    return codes, scales
+
+
+def index_key(embeddings, config):
+    '''
+    Name of the index files of an embedding matrix: the same table and configuration always map to the same files
+    '''
+    digest = hashlib.sha1(f"{embeddings.shape}|{config.quantization}|{config.dimensions}".encode("utf-8"))
+    digest.update(np.ascontiguousarray(embeddings).data)
+
+    return digest.hexdigest()[:20]
+
+
+def save_array(path, array):
+    # Written under a name of this process and renamed, so processes building the same index at once never read a partial file
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    np.save(temporary_path, array)
+    os.replace(temporary_path + ".npy", path)
+
+
+def remove_stale_indexes(directory, key):
+    '''
+    Deletes the index files of other keys that are older than STALE_INDEX_SECONDS.
+    Processes still mapping them keep their pages (an unlinked file lives until it is unmapped), only the disk space is reclaimed then.
+    '''
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not name.startswith(key) and name.endswith(".npy") and time.time() - os.path.getmtime(path) > STALE_INDEX_SECONDS:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def build_compact_index(embeddings, config):
+    '''
+    Builds the compact index of a normalized float32 embedding matrix and returns the full vectors to rescore with and the index.
+
+    With config.directory, the full vectors and the codes are written there once (the first process to load a given table writes them,
+    the others find them) and both are returned memory-mapped, so the workers of a server share one copy in the page cache
+    instead of each holding its own. The matrix passed in can then be dropped.
+    '''
+    paths = None
+    if config.directory:
+        os.makedirs(config.directory, exist_ok=True)
+        key = index_key(embeddings, config)
+        prefix = os.path.join(config.directory, key)
+        paths = { name: f"{prefix}-{name}.npy" for name in ("embeddings", "codes", "scales", "projection") }
+
+    if paths is None or not os.path.exists(paths["embeddings"]):
+        projection = principal_components(embeddings, config.dimensions) if config.dimensions else None
+        codes, scales = encode_rows(embeddings, config.quantization, projection)
+
+        if paths is None:
+            return embeddings, CompactIndex(config.quantization, codes, scales, projection, config.rescore_factor)
+
+        # The full vectors are written last, their file marks a complete index
+        for name, array in (("codes", codes), ("scales", scales), ("projection", projection), ("embeddings", embeddings)):
+            if array is not None:
+                save_array(paths[name], array)
+
+        remove_stale_indexes(config.directory, key)
+
+    arrays = { name: np.load(path, mmap_mode="r") if os.path.exists(path) else None for name, path in paths.items() }
+
+    return arrays["embeddings"], CompactIndex(config.quantization, arrays["codes"], arrays["scales"], arrays["projection"], config.rescore_factor)
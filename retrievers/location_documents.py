@@ -0,0 +1,100 @@
+import math
+import sys
+from langchain_core.documents import Document
+
+# Days in the order of the hoursOfOperation array returned to the client
+DAYS = ["sunday", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday"]
+
+# Days in the order they are listed to the LLM, so opening hours collapse into ranges ("Monday to Friday")
+WEEK = DAYS[1:] + DAYS[:1]
+
+# Placeholders left by the scraper and the geocoder, never shown to the LLM
+MISSING_VALUES = {"", "nan", "none", "n/a", "error: not found"}
+
+def to_number(value):
+    '''
+    Converts a latitude, longitude or rating into a float ("-96.33" included, which str.isnumeric rejects), or returns it unchanged if it is not a number
+    '''
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+
+    return number if math.isfinite(number) else None
+
+def is_missing(value):
+    return value is None or str(value).strip().lower() in MISSING_VALUES
+
+def location_json(location):
+    '''
+    Location object returned to the client for a row of the location table (a dict of column name -> value)
+    '''
+    return {
+        "address": f"{location['address']}, {location['city']}, {location['state']} {location['zip_code']}",
+        "addressLink": location["address_link"],
+        "confidence" : 1,
+        "description" : location["description"],
+        "hoursOfOperation" : [{ day: sys.intern(str(location[f"{day}_hours"])) } for day in DAYS],
+        "id": location["id"],
+        "isSaved": False,
+        "latitude": to_number(location["latitude"]),
+        "longitude": to_number(location["longitude"]),
+        "name": location["name"],
+        "phone": location["phone"],
+        "rating": to_number(location["rating"]),
+        "website": location["website"]
+    }
+
+def opening_hours_text(location):
+    '''
+    Opening hours of a location with consecutive days sharing the same hours merged, e.g. "Monday to Friday 8:00 AM – 5:00 PM, Saturday to Sunday Closed"
+    '''
+    ranges = []
+    for day in WEEK:
+        hours = location[f"{day}_hours"]
+        if is_missing(hours):
+            continue
+
+        if ranges and ranges[-1][2] == hours and WEEK.index(ranges[-1][1]) == WEEK.index(day) - 1:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day, hours])
+
+    return ", ".join(
+        f"{first.capitalize()} {hours}" if first == last else f"{first.capitalize()} to {last.capitalize()} {hours}"
+        for first, last, hours in ranges
+    )
+
+def location_text(location):
+    '''
+    Compact rendering of a location for the LLM context: the fields a user may ask about, one per line, without ids, coordinates, map links or placeholders
+    '''
+    address = ", ".join(str(location[column]) for column in ("address", "city") if not is_missing(location[column]))
+    address = f"{address}, {location['state']} {location['zip_code']}".strip(", ")
+
+    fields = [
+        ("Name", location["name"]),
+        ("Type", location["resource_type"]),
+        ("Address", address),
+        ("Phone", location["phone"]),
+        ("Website", location["website"]),
+        ("Rating", location["rating"]),
+        ("Hours", opening_hours_text(location)),
+        # Some scraped descriptions hold escaped line breaks
+        ("Description", " ".join(str(location["description"]).replace("\\n", " ").split()))
+    ]
+
+    return "\n".join(f"{label}: {value}" for label, value in fields if not is_missing(value))
+
+def build_location_documents(rows, column_names):
+    '''
+    Builds the documents of the location retrievers: page_content is the compact text sent to the LLM and metadata["location"]
+    the JSON object returned to the client, both computed once when the rows are loaded instead of on every request
+    '''
+    documents = []
+    for row in rows:
+        location = dict(zip(column_names, row))
+
+        documents.append(Document(page_content=location_text(location), metadata={ "location": location_json(location) }))
+
+    return documents
@@ -0,0 +1,49 @@
+import os
+
+from sqlalchemy import text
+
+from database.engine import fetch_table_fingerprint, get_engine
+from lifecycle.reloadable import Reloadable
+from retrievers.LocationRetriever import build_location_retriever
+from retrievers.SQLLocationRetriever import build_sql_location_retriever
+from retrievers.compact_index import compact_index_config_from_env
+
+# Columns of the location table that are indexed by the location retriever (see retrievers/location_documents.py)
+LOCATION_COLUMNS = ["id", "name", "address", "city", "state", "country", "zip_code", "latitude", "longitude", "description", "phone", "sunday_hours", "monday_hours",
+                    "tuesday_hours", "wednesday_hours", "thursday_hours", "friday_hours", "saturday_hours", "rating", "address_link", "website", "resource_type", "county"]
+
+def load_location_retriever():
+    '''
+    Reads every row of the location table and builds a LocationRetriever over it, or a SQLLocationRetriever (ranking the locations in PostgreSQL,
+    with the ANN index of the embeddings) when the table has more than LOCATION_IN_MEMORY_MAX_ROWS (default 100000) embedded locations.
+    Queries mentioning a city or county only rank the locations within LOCATION_SEARCH_RADIUS_KM (default 40) of it.
+    In memory, the locations are scored on a compact index if LOCATION_INDEX_QUANTIZATION or LOCATION_INDEX_DIMENSIONS is set (see retrievers/compact_index.py).
+    '''
+    engine = get_engine()
+    build_retriever = build_location_retriever
+    options = { "compact_index_config": compact_index_config_from_env() }
+
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT count(*) FROM location WHERE embedding IS NOT NULL;")).scalar() > int(os.getenv('LOCATION_IN_MEMORY_MAX_ROWS', 100000)):
+            build_retriever = build_sql_location_retriever
+            options = {}
+
+    return build_retriever(
+        connection=engine,
+        table_name="location",
+        column_names=LOCATION_COLUMNS,
+        embedding_column_name="embedding",
+        radius_km=float(os.getenv('LOCATION_SEARCH_RADIUS_KM', 40)),
+        **options
+    )
+
+refresh_interval = os.getenv('LOCATION_INDEX_REFRESH_SECONDS')
+
+# Process-wide location retriever: the location table is read and its embeddings parsed once, on first use, instead of on every request.
+# Rebuilt by POST /locations/reload and, with LOCATION_INDEX_REFRESH_SECONDS, when the location table changes (see lifecycle/reloadable.py)
+location_index = Reloadable(
+    "location index",
+    loader=load_location_retriever,
+    fingerprint=lambda: fetch_table_fingerprint("location"),
+    refresh_interval=float(refresh_interval) if refresh_interval else None
+)
@@ -0,0 +1,58 @@
+import re
+
+# Values of the city/county columns that are not places
+NOT_PLACES = {"nationwide", "texas avenue south", "error: not found", ""}
+
+# Prepositions that introduce a place ("dentist in Alice", "food pantry near Victoria")
+PLACE_PREPOSITIONS = r"(?:in|near|around|at|by|from|close to|outside|outside of)"
+
+def normalize_place(value):
+    return " ".join(str(value).lower().split())
+
+def normalize_county(value):
+    return normalize_place(value).removesuffix(" county")
+
+class PlaceMatcher:
+    '''
+    Finds the city or county of the location table mentioned in a query.
+
+    Single word city names are often also common words or first names ("Alice", "Victoria"), so they only count
+    after a preposition ("in Alice") or before the state ("Alice, TX"). Counties need the word county ("Brazos county").
+    '''
+
+    def __init__(self, cities, counties):
+        cities = sorted({ normalize_place(city) for city in cities } - NOT_PLACES, key=len, reverse=True)
+        counties = sorted({ normalize_county(county) for county in counties } - NOT_PLACES, key=len, reverse=True)
+
+        multi_word_cities = "|".join(re.escape(city) for city in cities if " " in city)
+        single_word_cities = "|".join(re.escape(city) for city in cities if " " not in city)
+        county_names = "|".join(re.escape(county) for county in counties)
+
+        # An empty alternation would match every query, so only the groups with names are added
+        alternatives = []
+        if multi_word_cities:
+            alternatives.append(r"\b(?P<city>" + multi_word_cities + r")\b")
+        if single_word_cities:
+            alternatives.append(r"\b" + PLACE_PREPOSITIONS + r"\s+(?P<preposition_city>" + single_word_cities + r")\b")
+            alternatives.append(r"\b(?P<state_city>" + single_word_cities + r")(?:,)?\s+(?:tx|texas)\b")
+        if county_names:
+            alternatives.append(r"\b(?P<county>" + county_names + r")\s+county\b")
+
+        self.pattern = re.compile("|".join(alternatives)) if alternatives else None
+
+    def search(self, query):
+        '''
+        Returns ("city", name) or ("county", name) for the first place mentioned in query, or None
+        '''
+        if self.pattern is None:
+            return None
+
+        match = self.pattern.search(normalize_place(query))
+        if match is None:
+            return None
+
+        groups = match.groupdict()
+        if groups.get("county"):
+            return ("county", groups["county"])
+
+        return ("city", next(name for name in groups.values() if name))
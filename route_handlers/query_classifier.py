@@ -0,0 +1,78 @@
+import openai
+
+from monitoring.metrics import record_token_usage
+
+# Defining list of tools to use with OpenAI function calling
+tools = [
+    {
+        "type": 'function',
+        "function": {
+            "name": "search_direct_questions",
+            "description": "Retrieve a direct answer from the knowlege base based on a user question. Call this whenever you get a direct question that should be answer without a specific location. For example when a user asks 'newborn nutritional advice' or 'birth control alternatives'",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "id": {
+                        "type": "string",
+                        "description": "The conversation id. For new conversations, this will be null, however for existing conversations, this will be passed in by the user to continue that conversation",
+                    },
+                    "query": {
+                        "type": "string",
+                        "description": "The question the user is trying to find an answer for"
+                    }
+                },
+                "required": ["id", "query"],
+                "additionalProperties": False
+            }
+        }
+    },
+    {
+        "type": 'function',
+        "function": {
+            "name": "search_location_questions",
+            "description": "Retrieve a location from the locations table based on a user question. Call this whenever you get a question that should be answer with a specific location. For example when a user asks 'mental health support in Bryan, Texas' or 'Where can i get a root canal in Corpus Christi'",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "id": {
+                        "type": "string",
+                        "description": "The conversation id. For new conversations, this will be null, however for existing conversations, this will be passed in by the user to continue that conversation",
+                    },
+                    "query": {
+                        "type": "string",
+                        "description": "The question the user is trying to find an answer for"
+                    }
+                },
+                "required": ["id", "query"],
+                "additionalProperties": False
+            }
+        }
+    }
+]
+
+def classify_query(search_query):
+    '''
+    Uses OpenAI function calling to classify a query as a direct or location based question.
+
+    Returns the name of the handler chosen by the model (search_direct_questions, search_location_questions) or None if the model refused.
+    '''
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant. Use the supplied tools to assist the user."},
+        {"role": "user", "content": search_query}
+    ]
+
+    response = openai.chat.completions.create(
+        model="gpt-4o",
+        messages=messages,
+        tools=tools,
+    )
+
+    if(response.usage):
+        record_token_usage("classification", response.usage.prompt_tokens, response.usage.completion_tokens)
+
+    message = response.choices[0].message
+
+    if(message.refusal or not message.tool_calls):
+        return None
+
+    return message.tool_calls[0].function.name
@@ -1,44 +1,151 @@
 import os
 from uuid import uuid4
 
-from chains.conversational_retrieval_chain_with_memory import build_conversational_retrieval_chain_with_memory
+from chains.answer_pipeline import AnswerPipeline, condense_question_mode_from_env
+from chains.context_builder import context_builder_from_env
+from chains.conversational_retrieval_chain_with_memory import record_exchange
 from langchain.chat_models import ChatOpenAI
-from vector_stores.pgvector import build_pg_vector_store
+from vector_stores.pgvector import build_pg_vector_store, knowledge_base_collection_name
 from embeddings.openai import openai_embeddings
+from database.engine import fetch_table_fingerprint, get_engine
+from lifecycle.lazy import Lazy
+from lifecycle.reloadable import Reloadable
+from memory.bounded_history import memory_config_from_env
 
-from retrievers.TableColumnRetriever import build_table_column_retriever
+from retrievers.location_index import location_index
+from retrievers.HybridRetriever import BM25Index, HybridRetriever, load_collection_documents
+
+# The clients, the vector store (which connects to the database) and the retriever are built on first use, see lifecycle/lazy.py and app.warmup
 
 # Using OpenAI for LLM
-llm = ChatOpenAI()
+llm = Lazy("llm", ChatOpenAI)
+
+# Follow-up questions are rewritten into standalone questions by CONDENSE_QUESTION_MODEL (e.g. a smaller model), by llm if unset
+condense_question_model = os.getenv('CONDENSE_QUESTION_MODEL')
+condense_question_llm = Lazy("condense_question_llm", lambda: ChatOpenAI(model=condense_question_model) if condense_question_model else llm.get())
 
 # Build vector store and retriever
-collection_name = "2024-09-02 00:44:49"
-pg_vector_store = build_pg_vector_store(
-    embeddings_model=openai_embeddings, collection_name=collection_name, connection_uri=os.getenv('DATABASE_URI'))
-pg_vector_retriever = pg_vector_store.as_retriever(search_type="mmr")
+collection_name = knowledge_base_collection_name()
+pg_vector_store = Lazy("pg_vector_store", lambda: build_pg_vector_store(
+    embeddings_model=openai_embeddings.get(), collection_name=collection_name, connection=get_engine()))
+
+# hybrid: vector and BM25 results fused (answers lexically when embedding the query fails), mmr: vector search only
+knowledge_base_search = os.getenv('KNOWLEDGE_BASE_SEARCH', 'hybrid')
+
+# Chunks retrieved per question, the answer prompt only keeps what fits in DIRECT_QUESTIONS_CONTEXT_TOKENS
+knowledge_base_k = int(os.getenv('KNOWLEDGE_BASE_K', 4))
+
+# Seconds a hybrid search waits for the query embedding before answering from the BM25 results alone
+knowledge_base_embedding_timeout = float(os.getenv('KNOWLEDGE_BASE_EMBEDDING_TIMEOUT', 2))
+
+def build_knowledge_base_retriever():
+    if(knowledge_base_search == "hybrid"):
+        return HybridRetriever(
+            lexical_index=BM25Index(load_collection_documents(get_engine(), collection_name)),
+            vector_store=pg_vector_store.get(),
+            embeddings=openai_embeddings.get(),
+            k=knowledge_base_k,
+            fetch_k=max(10, knowledge_base_k),
+            embedding_timeout=knowledge_base_embedding_timeout
+        )
+
+    return pg_vector_store.get().as_retriever(search_type="mmr", search_kwargs={ "k": knowledge_base_k })
+
+# The BM25 index holds the chunks of the collection as they were when it was built: it is rebuilt by POST /knowledge-base/reload and,
+# with KNOWLEDGE_BASE_REFRESH_SECONDS, when langchain_pg_embedding changes (e.g. after preprocessing/load_docs.py, see lifecycle/reloadable.py)
+knowledge_base_refresh_interval = os.getenv('KNOWLEDGE_BASE_REFRESH_SECONDS')
+
+pg_vector_retriever = Reloadable(
+    "knowledge base retriever",
+    loader=build_knowledge_base_retriever,
+    fingerprint=(lambda: fetch_table_fingerprint("langchain_pg_embedding")) if knowledge_base_search == "hybrid" else None,
+    refresh_interval=float(knowledge_base_refresh_interval) if knowledge_base_refresh_interval else None
+)
+
+# Conversation history sent to the condense question LLM by each route (DIRECT_QUESTIONS_MEMORY, LOCATION_QUESTIONS_MEMORY_TURNS, ...)
+direct_questions_memory = memory_config_from_env("DIRECT_QUESTIONS")
+location_questions_memory = memory_config_from_env("LOCATION_QUESTIONS")
+
+# auto: self-contained questions are answered in a single LLM call, always: every question of a conversation is condensed first (see chains/answer_pipeline.py)
+condense_question_mode = condense_question_mode_from_env()
+
+# The answer pipelines are built once and shared by every request, only the conversation changes
+# Their retrievers are looked up on every search, a reload replaces them
+# Knowledge base chunks are merged, deduplicated and packed into DIRECT_QUESTIONS_CONTEXT_TOKENS (see chains/context_builder.py)
+direct_questions_pipeline = Lazy("direct_questions_pipeline", lambda: AnswerPipeline(
+    llm.get(), lambda query: pg_vector_retriever.get().invoke(query), condense_question_llm=condense_question_llm.get(),
+    memory_config=direct_questions_memory, condense_mode=condense_question_mode, build_context=context_builder_from_env("DIRECT_QUESTIONS")))
+
+location_questions_pipeline = Lazy("location_questions_pipeline", lambda: AnswerPipeline(
+    llm.get(), lambda query: location_index.get().get_relevant_documents(query), condense_question_llm=condense_question_llm.get(),
+    memory_config=location_questions_memory, condense_mode=condense_question_mode))
+
+def retrieve_direct_documents(query_embedding, search_query=None):
+    '''
+    Runs the knowledge base search of pg_vector_retriever for a query that has already been embedded
+    '''
+    if(knowledge_base_search == "hybrid" and search_query):
+        return pg_vector_retriever.get().get_relevant_documents_by_vector(search_query, query_embedding)
+
+    return pg_vector_store.get().max_marginal_relevance_search_by_vector(query_embedding, k=knowledge_base_k)
+
+def retrieve_direct_documents_lexically(search_query):
+    '''
+    Runs the BM25 search of the knowledge base alone, for a query that could not be embedded in time (None without hybrid search)
+    '''
+    if(knowledge_base_search != "hybrid"):
+        return None
+
+    return pg_vector_retriever.get().lexical_index.search(search_query, knowledge_base_k)
 
-def search_direct_questions(id, search_query):
+def retrieve_location_documents(query_embedding, search_query=None):
+    '''
+    Runs the location search for a query that has already been embedded
+    The query text, if given, restricts the search to the locations near the place it mentions
+    '''
+    return location_index.get().get_relevant_documents_by_vector(query_embedding, search_query)
+
+def query_place(search_query):
+    '''
+    Returns the city or county of the location table mentioned in search_query ("city:bryan", "county:brazos"), or None
+    '''
+    place = location_index.get().place_matcher.search(search_query)
+
+    return ":".join(place) if place else None
+
+def document_sources(documents):
+    '''
+    Returns the source files of the knowledge base documents used to answer a direct question
+    '''
+    return sorted({ doc.metadata.get("source") for doc in documents if doc.metadata.get("source") })
+
+def search_direct_questions(id, search_query, documents=None):
     '''
     Direct question handler searches OliviaHealth.org knowledge base for most relevant data relating to user query
     Data is passed to LLM to generate output
     Memory is updated with user query and answer
 
     Examples of direct questions: 'Newborn nutritonal advice', 'How do hormonal IUDs prevent pregnancy', 'What is mastitis treated with'
+
+    documents may hold the knowledge base documents already retrieved for search_query (see retrieve_direct_documents)
     '''
 
     if not id:
         id = uuid4()
 
-    # Build the retrieval QA chain with SQL memory
     # Must pass in the session_id from the message_store table
-    retrieval_qa_chain = build_conversational_retrieval_chain_with_memory(
-        llm, pg_vector_retriever, id)
-
-    result = retrieval_qa_chain.run(search_query)
+    result, _ = direct_questions_pipeline.get().run(id, search_query, documents)
 
     return result
 
-def search_location_questions(id, search_query):
+def build_locations_json(doc_list):
+    '''
+    Returns the JSON array of locations returned to the client for the location documents returned by the location retriever
+    The JSON of each location is computed once, when the location index is loaded (see retrievers/location_documents.py)
+    '''
+    return [doc.metadata["location"] for doc in doc_list]
+
+def search_location_questions(id, search_query, documents=None):
     '''
     Location question handler searches Locations table for most relevant locations relating to user query
     Data is converted to JSON array of locations
@@ -47,60 +154,18 @@ def search_location_questions(id, search_query):
     Memory is updated with user query and answer
 
     Examples of location questions: 'Dental Services in Corpus Christi', 'Where can I get mental health support in Bryan'
+
+    documents may hold the locations already retrieved for search_query (see retrieve_location_documents)
     '''
     if not id:
         id = uuid4()
 
-    locations = []
-    
-    # Creating a TableColumnRetriever to index all of the columns for the location table when retrieving documents
-    table_column_retriever = build_table_column_retriever(
-        connection_uri=os.getenv('DATABASE_URI'),
-        table_name="location",
-        column_names=["id", "name", "address", "city", "state", "country", "zip_code", "latitude", "longitude", "description", "phone", "sunday_hours", "monday_hours",
-                      "tuesday_hours", "wednesday_hours", "thursday_hours", "friday_hours", "saturday_hours", "rating", "address_link", "website", "resource_type", "county"],
-        embedding_column_name="embedding"
-    )
-
-    # Get the raw list of relevant locations
-    doc_list = table_column_retriever.get_relevant_documents(search_query)
-
-    # loop through the doc_list and for each doc add a json representation in the locations array
-    for doc in doc_list:
-        doc_id, name, address, city, state, country, zip_code, latitude, longitude, description, phone, sunday_hours, monday_hours, tuesday_hours, wednesday_hours, thursday_hours, friday_hours, saturday_hours, rating, address_link, website, resource_type, county = doc.page_content.split("##")
-
-        unified_address = f"{address}, {city}, {state} {zip_code}"
-        confidence = 1
-        hours_of_operation = [{ "sunday": sunday_hours }, { "monday": monday_hours }, { "tuesday": tuesday_hours }, { "wednesday": wednesday_hours }, { "thursday": thursday_hours }, { "friday": friday_hours }, { "saturday": saturday_hours }]
-        is_saved = False
-        if(latitude and latitude.isnumeric()):
-            latitude = float(latitude.strip())
-        if(longitude and longitude.isnumeric()):
-            longitude = float(longitude.strip())
-        if(rating and rating.isnumeric()):
-            rating = float(rating.strip())
-
-        locations.append({
-            "address": unified_address,
-            "addressLink": address_link,
-            "confidence" : confidence,
-            "description" : description,
-            "hoursOfOperation" : hours_of_operation,
-            "id": doc_id,
-            "isSaved": is_saved,
-            "latitude": latitude,
-            "longitude": longitude,
-            "name": name,
-            "phone": phone,
-            "rating": rating,
-            "website": website
-        })
-
-    # Using same conversational retrieval chain with SQL memory just with different retriever
-    retrieval_qa_chain = build_conversational_retrieval_chain_with_memory(llm, table_column_retriever, id)
-
-    # Get the LLM response
-    response = retrieval_qa_chain.run(search_query)
+    # Get the LLM response and the raw list of relevant locations it was generated from
+    # The TableColumnRetriever indexing all of the columns of the location table is built once per process and shared between requests
+    # The locations already retrieved for search_query are reused unless the question is rewritten into a standalone question
+    response, doc_list = location_questions_pipeline.get().run(id, search_query, documents)
+
+    locations = build_locations_json(doc_list)
 
     # Return the LLM response and the JSON
     return {
@@ -108,51 +173,17 @@ def search_location_questions(id, search_query):
         "locations" : locations
     }
 
+def serve_cached_result(id, search_query, cached):
+    '''
+    Returns a unified search result served from the cache (see caches/semantic_cache.py)
+    Memory is updated with user query and cached answer, exactly as if the answer had just been generated
+    '''
+    if not id:
+        id = uuid4()
+
+    data = cached["data"]
+    response = data["response"] if cached["function_name"] == "search_location_questions" else data
 
-# Defining list of tools to use with OpenAI function calling
-tools = [
-    {
-        "type": 'function',
-        "function": {
-            "name": "search_direct_questions",
-            "description": "Retrieve a direct answer from the knowlege base based on a user question. Call this whenever you get a direct question that should be answer without a specific location. For example when a user asks 'newborn nutritional advice' or 'birth control alternatives'",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "id": {
-                        "type": "string",
-                        "description": "The conversation id. For new conversations, this will be null, however for existing conversations, this will be passed in by the user to continue that conversation",
-                    },
-                    "query": {
-                        "type": "string",
-                        "description": "The question the user is trying to find an answer for"
-                    }
-                },
-                "required": ["id", "query"],
-                "additionalProperties": False
-            }
-        }
-    },
-    {
-        "type": 'function',
-        "function": {
-            "name": "search_location_questions",
-            "description": "Retrieve a location from the locations table based on a user question. Call this whenever you get a question that should be answer with a specific location. For example when a user asks 'mental health support in Bryan, Texas' or 'Where can i get a root canal in Corpus Christi'",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "id": {
-                        "type": "string",
-                        "description": "The conversation id. For new conversations, this will be null, however for existing conversations, this will be passed in by the user to continue that conversation",
-                    },
-                    "query": {
-                        "type": "string",
-                        "description": "The question the user is trying to find an answer for"
-                    }
-                },
-                "required": ["id", "query"],
-                "additionalProperties": False
-            }
-        }
-    }
-]
\ No newline at end of file
+    record_exchange(id, search_query, response)
+
+    return data
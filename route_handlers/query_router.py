@@ -0,0 +1,72 @@
+import csv
+import os
+import re
+
+from retrievers.place_matcher import PlaceMatcher
+
+# Phrases asking for a physical place
+LOCATION_INTENT = re.compile(
+    r"\b(where (?:can|could|should|do) (?:i|we|my|you)|near me|nearby|closest|nearest|close to me|in my area|around me|find (?:a|an|me)|"
+    r"locations?|address(?:es)?|directions to|open (?:now|today|on)|hours of|phone number|zip code|\d{5})\b"
+)
+
+# Kinds of places listed in the location table
+RESOURCE_TERMS = re.compile(
+    r"\b(dentists?|dental|dentistry|orthodontists?|clinics?|hospitals?|pharmac(?:y|ies)|pediatricians?|doctors?|doctor's office|"
+    r"food pantr(?:y|ies)|food banks?|shelters?|housing|child ?care|daycares?|day care|wic office|health department|"
+    r"optometrists?|chiropractors?|urgent care|emergency room|therapists?|counseling|counselors?|birth cent(?:er|re)s?|"
+    r"home health|assisted living|social services|legal aid|services|resources|programs?|support groups?|offices?)\b"
+)
+
+# Cues of a general knowledge question
+DIRECT_INTENT = re.compile(
+    r"^(what|why|how|when|is|are|can|could|should|do|does|did|will|would|which|who)\b|"
+    r"\b(symptoms?|signs? of|causes?|treat(?:ed|ment|ments)?|advice|tips|safe|risks?|benefits?|side effects?|"
+    r"explain|mean|normal|pregnan\w*|after (?:birth|giving birth|delivery)|postpartum|newborns?|bab(?:y|ies)|infants?|"
+    r"birth control|contracepti\w*|breastfeed\w*|nutrition\w*|vaccin\w*|iuds?|labor|contractions|trimesters?|ovulation|fertility)\b"
+)
+
+class QueryRouter:
+    '''
+    Local, rule based router choosing between search_direct_questions and search_location_questions without a gpt-4o round trip.
+
+    Uses a gazetteer of the cities and counties of the location table (knowledge_base/locations.csv) and keyword rules.
+    route() returns the handler name when the rules agree, or None when the query is ambiguous and should be classified by the LLM.
+    '''
+
+    def __init__(self, cities, counties):
+        self.places = PlaceMatcher(cities, counties)
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        with open(csv_path, newline="", encoding="utf-8") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+
+        return cls(
+            cities=[row["city"] for row in rows],
+            counties=[row["county"] for row in rows]
+        )
+
+    def route(self, search_query):
+        query = " ".join(search_query.lower().split())
+
+        mentions_place = self.places.search(query) is not None
+        location_intent = LOCATION_INTENT.search(query) is not None
+        resource = RESOURCE_TERMS.search(query) is not None
+        direct_intent = DIRECT_INTENT.search(query) is not None
+
+        # "Dental services in Corpus Christi", "Where can I get mental health support in Bryan"
+        if mentions_place and (resource or location_intent or not direct_intent):
+            return "search_location_questions"
+
+        # "Food pantry near me", "Where can I find a pediatrician"
+        if not mentions_place and location_intent and (resource or not direct_intent):
+            return "search_location_questions"
+
+        # "Newborn nutritional advice", "What is mastitis treated with"
+        if not mentions_place and not location_intent and not resource and direct_intent:
+            return "search_direct_questions"
+
+        return None
+
+query_router = QueryRouter.from_csv(os.path.join(os.path.dirname(__file__), "..", "knowledge_base", "locations.csv"))
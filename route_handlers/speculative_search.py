@@ -0,0 +1,112 @@
+import asyncio
+from collections import namedtuple
+
+# function_name: handler chosen by the classification, documents: its speculatively retrieved documents (None if that retrieval failed),
+# query_embedding: embedding of the query (None if embedding failed), cached: cached result served instead (None on a cache miss)
+SpeculativeSearchResult = namedtuple("SpeculativeSearchResult", ["function_name", "documents", "query_embedding", "cached"])
+
+def _result_or_none(task):
+    if task.done() and not task.cancelled() and task.exception() is None:
+        return task.result()
+
+    return None
+
+async def speculative_search(search_query, classify, embed_query, retrievers, cache_lookup=None, embedding_timeout=None, fallbacks=None):
+    '''
+    Classifies search_query while speculatively retrieving documents for every possible handler.
+
+    classify(search_query) returns the name of the chosen handler (or None on refusal), embed_query(search_query) returns the query embedding
+    and retrievers maps each handler name to a function retrieving documents for an embedding.
+    The embedding and both retrievals run concurrently with the classification round trip, so by the time the handler is known its documents are usually ready.
+    The retrieval for the handler that was not chosen is cancelled.
+
+    cache_lookup(query_embedding), if given, is checked as soon as the embedding is ready. A cached result short-circuits the search:
+    the classification and retrievals are cancelled and the result carries the cached value.
+
+    When the embedding is not ready embedding_timeout seconds after the search started (or embedding failed), it is no longer waited for:
+    the documents of the chosen handler come from fallbacks[handler](search_query) if given (e.g. the lexical search of the knowledge base),
+    without an embedding, so a slow or failing embeddings API does not stall the search.
+
+    Returns a SpeculativeSearchResult. Its documents are None when the speculative retrieval failed, in which case the handler retrieves on its own.
+    The blocking clients are run in worker threads, so a cancelled call stops being awaited but its thread runs to completion in the background.
+    '''
+    fallbacks = fallbacks or {}
+    deadline = None if embedding_timeout is None else asyncio.get_running_loop().time() + embedding_timeout
+
+    def remaining():
+        return None if deadline is None else max(0, deadline - asyncio.get_running_loop().time())
+
+    classification = asyncio.create_task(asyncio.to_thread(classify, search_query))
+    query_embedding = asyncio.create_task(asyncio.to_thread(embed_query, search_query))
+
+    async def retrieve(retriever):
+        return await asyncio.to_thread(retriever, await query_embedding)
+
+    async def lookup():
+        return await asyncio.to_thread(cache_lookup, await query_embedding)
+
+    retrievals = { name: asyncio.create_task(retrieve(retriever)) for name, retriever in retrievers.items() }
+    cache = asyncio.create_task(lookup()) if cache_lookup else None
+
+    speculative_tasks = [query_embedding, *retrievals.values()] + ([cache] if cache else [])
+
+    # Speculative work may fail after nobody is waiting for it anymore, mark those exceptions as retrieved
+    for task in speculative_tasks:
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    def cancel_all():
+        classification.cancel()
+        for task in speculative_tasks:
+            task.cancel()
+
+    try:
+        # Wait for the classification, or for a cache hit that makes it unnecessary
+        pending = { classification, cache } if cache else { classification }
+        while not classification.done():
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            if cache in done and _result_or_none(cache) is not None:
+                cancel_all()
+                return SpeculativeSearchResult(None, None, _result_or_none(query_embedding), cache.result())
+
+        function_name = classification.result()
+
+        # The embedding is needed for the retrieval anyway, so a pending cache lookup is still worth waiting for
+        if cache and not cache.done():
+            await asyncio.wait({ cache }, timeout=remaining())
+            if _result_or_none(cache) is not None:
+                cancel_all()
+                return SpeculativeSearchResult(None, None, _result_or_none(query_embedding), cache.result())
+    except BaseException:
+        cancel_all()
+        raise
+
+    # Cancel the losing branch(es)
+    for name, task in retrievals.items():
+        if name != function_name:
+            task.cancel()
+
+    if function_name not in retrievals:
+        query_embedding.cancel()
+        return SpeculativeSearchResult(function_name, None, None, None)
+
+    if not query_embedding.done():
+        await asyncio.wait({ query_embedding }, timeout=remaining())
+
+    if _result_or_none(query_embedding) is None and function_name in fallbacks:
+        for task in speculative_tasks:
+            task.cancel()
+
+        try:
+            documents = await asyncio.to_thread(fallbacks[function_name], search_query)
+        except Exception:
+            documents = None
+
+        return SpeculativeSearchResult(function_name, documents, None, None)
+
+    try:
+        documents = await retrievals[function_name]
+    except Exception:
+        documents = None
+
+    return SpeculativeSearchResult(function_name, documents, _result_or_none(query_embedding), None)
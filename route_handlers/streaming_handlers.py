@@ -0,0 +1,125 @@
+import json
+import queue
+import threading
+from uuid import uuid4
+
+from langchain.chat_models import ChatOpenAI
+from langchain_core.callbacks import BaseCallbackHandler
+
+from chains.conversational_retrieval_chain_with_memory import record_exchange
+from lifecycle.lazy import Lazy
+from route_handlers.query_handlers import build_locations_json, direct_questions_pipeline, document_sources, location_questions_pipeline
+
+# Only the answer is generated by this LLM, so only answer tokens are streamed (the question is condensed without streaming)
+streaming_llm = Lazy("streaming_llm", lambda: ChatOpenAI(streaming=True))
+
+# Marks the end of the token queue
+_DONE = object()
+
+class QueueCallbackHandler(BaseCallbackHandler):
+    '''
+    Pushes every new LLM token into a queue so it can be sent to the client while the answer is still being generated
+    '''
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def on_llm_new_token(self, token, **kwargs):
+        if token:
+            self.tokens.put(token)
+
+def format_server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def format_error_events(error):
+    '''
+    Ends a stream that failed: an error event with the message, then the terminal done event without a response
+    '''
+    yield format_server_sent_event("error", { "message": str(error) })
+    yield format_server_sent_event("done", { "response": None })
+
+def stream_search(id, function_name, search_query, documents=None, on_complete=None):
+    '''
+    Generator of Server-Sent Events answering search_query with the handler chosen by the classification.
+
+    The retrieved locations (location questions) or sources (direct questions) are sent first, as soon as they are known,
+    followed by one token event per answer token and a final done event holding the full answer.
+    If retrieval or the answer fails, an error event is sent instead, followed by a done event without a response, so the stream always ends with done.
+    The question and answer are written to the SQL chat history by the answer pipeline once the answer is complete.
+    on_complete, if given, is called with the same result as the non-streaming handlers would return (plus the sources) once the answer is complete.
+    '''
+    if not id:
+        id = uuid4()
+
+    yield format_server_sent_event("session", { "id": str(id) })
+
+    # The question is condensed (if needed) and the documents retrieved before streaming, so the locations or sources sent are the ones the answer is generated from
+    try:
+        if function_name == "search_location_questions":
+            pipeline = location_questions_pipeline.get()
+            prepared = pipeline.prepare(id, search_query, documents)
+
+            locations = build_locations_json(prepared.documents)
+            sources = None
+        else:
+            pipeline = direct_questions_pipeline.get()
+            prepared = pipeline.prepare(id, search_query, documents)
+
+            locations = None
+            sources = document_sources(prepared.documents)
+    except Exception as e:
+        yield from format_error_events(e)
+        return
+
+    if locations is not None:
+        yield format_server_sent_event("locations", locations)
+    else:
+        yield format_server_sent_event("sources", sources)
+
+    tokens = queue.Queue()
+    result = {}
+
+    def run_pipeline():
+        try:
+            result["response"] = pipeline.generate(prepared, llm=streaming_llm.get(), callbacks=[QueueCallbackHandler(tokens)])
+        except Exception as e:
+            result["error"] = str(e)
+        finally:
+            tokens.put(_DONE)
+
+    threading.Thread(target=run_pipeline, daemon=True).start()
+
+    while (token := tokens.get()) is not _DONE:
+        yield format_server_sent_event("token", { "token": token })
+
+    if "error" in result:
+        yield from format_error_events(result["error"])
+    else:
+        yield format_server_sent_event("done", { "response": result["response"] })
+
+        if on_complete:
+            data = result["response"] if locations is None else { "response": result["response"], "locations": locations }
+            on_complete({ "function_name": function_name, "data": data, "sources": sources })
+
+def stream_cached_result(id, search_query, cached):
+    '''
+    Generator of the same Server-Sent Events as stream_search for a result served from the cache (the answer is sent as a single token)
+    The question and cached answer are appended to the SQL chat history like any other answer
+    '''
+    if not id:
+        id = uuid4()
+
+    yield format_server_sent_event("session", { "id": str(id) })
+
+    data = cached["data"]
+    if cached["function_name"] == "search_location_questions":
+        response = data["response"]
+        yield format_server_sent_event("locations", data["locations"])
+    else:
+        response = data
+        yield format_server_sent_event("sources", cached.get("sources") or [])
+
+    yield format_server_sent_event("token", { "token": response })
+    yield format_server_sent_event("done", { "response": response })
+
+    record_exchange(id, search_query, response)
@@ -0,0 +1,27 @@
+import pytest
+
+from chains.answer_pipeline import is_self_contained
+
+@pytest.mark.parametrize("question", [
+    "Is it free?",
+    "What about dental care?",
+    "Are there any in Bryan?",
+    "Which is closest to me?",
+    "How much does the first clinic cost?",
+    "Is the second location open on Saturday?",
+    "Do any accept walk-ins?",
+    "Which one is nearest to College Station?",
+    "What are the side effects?"
+])
+def test_follow_ups_are_condensed(question):
+    assert not is_self_contained(question)
+
+@pytest.mark.parametrize("question", [
+    "What is mastitis treated with?",
+    "How do hormonal IUDs prevent pregnancy?",
+    "Dental services in Corpus Christi",
+    "Where can I get mental health support in Bryan?",
+    "Is there a food bank in Brazos County?"
+])
+def test_self_contained_questions_are_answered_directly(question):
+    assert is_self_contained(question)
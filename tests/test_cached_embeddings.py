@@ -0,0 +1,50 @@
+import threading
+
+from embeddings.cached import CachedEmbeddings
+
+class FakeModel:
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+class BlockingStore:
+    '''
+    Store whose writes wait until released
+    '''
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.stored = threading.Event()
+        self.entries = {}
+
+    def get_many(self, keys):
+        return { key: self.entries[key] for key in keys if key in self.entries }
+
+    def put_many(self, embeddings):
+        self.release.wait(5)
+        self.entries.update(embeddings)
+        self.stored.set()
+
+def test_query_embedding_is_returned_before_it_is_stored():
+    store = BlockingStore()
+    embeddings = CachedEmbeddings(FakeModel(), namespace="fake", store=store)
+
+    try:
+        assert embeddings.embed_query("mastitis") == [8.0, 1.0]
+        assert not store.entries
+    finally:
+        store.release.set()
+
+    assert store.stored.wait(5)
+    assert len(store.entries) == 1
+
+def test_document_embeddings_are_stored_before_returning():
+    store = BlockingStore()
+    store.release.set()
+    embeddings = CachedEmbeddings(FakeModel(), namespace="fake", store=store)
+
+    embeddings.embed_documents(["mastitis", "newborn"])
+
+    assert len(store.entries) == 2
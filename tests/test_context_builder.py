@@ -0,0 +1,32 @@
+from langchain_core.documents import Document
+
+from chains.context_builder import ContextBuilder
+
+def count_words(text):
+    return len(text.split())
+
+def truncate_words(text, max_tokens):
+    return " ".join(text.split()[:max_tokens])
+
+def chunk(source, chunk_index, words):
+    return Document(page_content=" ".join(f"{source}{chunk_index}w{i}" for i in range(words)), metadata={ "source": source, "chunk_index": chunk_index })
+
+def builder(max_tokens):
+    return ContextBuilder(max_tokens=max_tokens, count_tokens=count_words, truncate=truncate_words)
+
+def test_adjacent_chunks_are_merged():
+    passages = builder(None).merge_adjacent([chunk("a", 2, 5), chunk("b", 0, 5), chunk("a", 1, 5)])
+
+    assert [(passage.source, passage.rank) for passage in passages] == [("a", 0), ("b", 1)]
+
+def test_best_passage_over_the_budget_is_truncated():
+    # Two adjacent 40 word chunks merge into one 80 word passage
+    context = builder(50)([chunk("a", 0, 40), chunk("a", 1, 40)])
+
+    assert count_words(context) == 50
+    assert context.startswith("a0w0 ")
+
+def test_passages_that_do_not_fit_are_skipped():
+    context = builder(50)([chunk("a", 0, 30), chunk("b", 0, 30), chunk("c", 0, 10)])
+
+    assert "a0w0" in context and "b0w0" not in context and "c0w0" in context
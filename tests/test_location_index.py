@@ -0,0 +1,23 @@
+from lifecycle.reloadable import Reloadable
+
+def test_failed_refresh_keeps_the_current_index():
+    loads = []
+    # Read on load, on each check and again when the changed index is loaded
+    fingerprints = iter([1, ConnectionError("database restarting"), 2, 2])
+
+    def fingerprint():
+        value = next(fingerprints)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def loader():
+        loads.append(object())
+        return loads[-1]
+
+    index = Reloadable("location index", loader, fingerprint=fingerprint, refresh_interval=0)
+    first = index.get()
+
+    assert index.get() is first
+    assert index.get() is not first
+    assert len(loads) == 2
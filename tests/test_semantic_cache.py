@@ -0,0 +1,49 @@
+from caches.semantic_cache import InMemoryCacheBackend, SemanticCache
+
+# Questions that only differ by their place embed almost identically
+DENTAL = [1.0, 0.0, 0.0]
+DENTAL_ELSEWHERE = [0.99, 0.05, 0.0]
+NUTRITION = [0.0, 1.0, 0.0]
+
+def build_cache(max_entries=10):
+    return SemanticCache(InMemoryCacheBackend(max_entries=max_entries), similarity_threshold=0.95)
+
+def test_similar_question_about_the_same_place_is_served():
+    cache = build_cache()
+    cache.store("Dental services in Bryan", DENTAL, { "data": "bryan" }, place="city:bryan")
+
+    assert cache.lookup_similar(DENTAL_ELSEWHERE, "city:bryan")["data"] == "bryan"
+
+def test_similar_question_about_another_place_is_not_served():
+    cache = build_cache()
+    cache.store("Dental services in Corpus Christi", DENTAL, { "data": "corpus christi" }, place="city:corpus christi")
+
+    assert cache.lookup_similar(DENTAL_ELSEWHERE, "city:bryan") is None
+    assert cache.metrics()["misses"] == 1
+
+def test_question_without_place_is_only_served_entries_without_place():
+    cache = build_cache()
+    cache.store("Dental services in Bryan", DENTAL, { "data": "bryan" }, place="city:bryan")
+
+    assert cache.lookup_similar(DENTAL_ELSEWHERE) is None
+
+    cache.store("Dental services", DENTAL, { "data": "anywhere" })
+
+    assert cache.lookup_similar(DENTAL_ELSEWHERE)["data"] == "anywhere"
+    assert cache.lookup_similar(DENTAL_ELSEWHERE, "city:bryan")["data"] == "bryan"
+
+def test_best_match_of_the_place_is_served_over_a_better_match_elsewhere():
+    cache = build_cache()
+    cache.store("Dental services in Corpus Christi", DENTAL_ELSEWHERE, { "data": "corpus christi" }, place="city:corpus christi")
+    cache.store("Nutrition advice in Bryan", NUTRITION, { "data": "nutrition" }, place="city:bryan")
+    cache.store("Dentists in Bryan", [0.97, 0.1, 0.0], { "data": "bryan" }, place="city:bryan")
+
+    assert cache.lookup_similar(DENTAL, "city:bryan")["data"] == "bryan"
+
+def test_evicted_slot_forgets_its_place():
+    cache = build_cache(max_entries=1)
+    cache.store("Dental services in Bryan", DENTAL, { "data": "bryan" }, place="city:bryan")
+    cache.store("Nutrition advice", NUTRITION, { "data": "nutrition" })
+
+    assert cache.lookup_similar(DENTAL, "city:bryan") is None
+    assert cache.lookup_similar(NUTRITION)["data"] == "nutrition"
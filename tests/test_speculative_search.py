@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import time
+
+from route_handlers.speculative_search import speculative_search
+
+def search(embed_query, cache_lookup=None, embedding_timeout=0.2):
+    retrieved = []
+
+    def retrieve_direct(query_embedding):
+        retrieved.append(query_embedding)
+        return ["vector"]
+
+    # Flask runs async views like this (asgiref), closing the loop without waiting for its threads, asyncio.run would wait for a hanging one
+    loop = asyncio.new_event_loop()
+    try:
+        result = loop.run_until_complete(speculative_search(
+            "What is mastitis treated with?",
+            classify=lambda query: "search_direct_questions",
+            embed_query=embed_query,
+            retrievers={ "search_direct_questions": retrieve_direct },
+            cache_lookup=cache_lookup,
+            embedding_timeout=embedding_timeout,
+            fallbacks={ "search_direct_questions": lambda query: ["lexical"] }
+        ))
+    finally:
+        loop.close()
+
+    return result, retrieved
+
+def test_hanging_embedding_falls_back_to_lexical_search():
+    released = threading.Event()
+
+    def hanging_embed_query(query):
+        released.wait(5)
+        return [1.0, 0.0]
+
+    try:
+        start = time.perf_counter()
+        result, retrieved = search(hanging_embed_query, cache_lookup=lambda query_embedding: None)
+        elapsed = time.perf_counter() - start
+    finally:
+        released.set()
+
+    assert result.function_name == "search_direct_questions"
+    assert result.documents == ["lexical"]
+    assert result.query_embedding is None
+    assert retrieved == []
+    assert elapsed < 1
+
+def test_failing_embedding_falls_back_to_lexical_search():
+    def failing_embed_query(query):
+        raise ConnectionError("embeddings API unavailable")
+
+    result, _ = search(failing_embed_query)
+
+    assert result.documents == ["lexical"]
+    assert result.query_embedding is None
+
+def test_embedding_in_time_uses_vector_retrieval():
+    result, retrieved = search(lambda query: [1.0, 0.0])
+
+    assert result.documents == ["vector"]
+    assert result.query_embedding == [1.0, 0.0]
+    assert retrieved == [[1.0, 0.0]]
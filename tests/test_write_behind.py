@@ -0,0 +1,108 @@
+import os
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+from sqlalchemy.pool import NullPool
+
+from memory.write_behind import MessageWriter
+
+metadata = MetaData()
+
+messages = Table(
+    "messages", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("session_id", String, nullable=False),
+    Column("message", String, nullable=False)
+)
+
+missing = Table("missing", MetaData(), Column("id", Integer, primary_key=True), Column("session_id", String), Column("message", String))
+
+@pytest.fixture
+def engine(tmp_path):
+    # No pooled connection is inherited by a forked process
+    engine = create_engine(f"sqlite:///{tmp_path / 'messages.db'}", poolclass=NullPool)
+    metadata.create_all(engine)
+
+    return engine
+
+def rows(session_id, *texts):
+    return [{ "session_id": session_id, "message": text } for text in texts]
+
+def stored(engine, session_id=None):
+    query = select(messages.c.session_id, messages.c.message).order_by(messages.c.id)
+    if session_id is not None:
+        query = query.where(messages.c.session_id == session_id)
+
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(query)]
+
+def test_messages_of_a_conversation_are_written_in_order(engine):
+    writer = MessageWriter(flush_interval=0.01, max_batch=3)
+
+    for turn in range(10):
+        writer.add_messages(engine, messages, "a", rows("a", f"question {turn}", f"answer {turn}"))
+        writer.add_messages(engine, messages, "b", rows("b", f"question {turn}"))
+
+    assert writer.flush(timeout=5)
+    writer.close()
+
+    assert [message for _, message in stored(engine, "a")] == [text for turn in range(10) for text in (f"question {turn}", f"answer {turn}")]
+    assert [message for _, message in stored(engine, "b")] == [f"question {turn}" for turn in range(10)]
+    assert writer.metrics()["written_messages"] == 30
+
+def test_failed_batch_is_released(engine):
+    writer = MessageWriter(flush_interval=0.01, max_retries=0)
+
+    writer.add_messages(engine, missing, "a", rows("a", "question", "answer"))
+
+    assert writer.flush(timeout=5)
+    assert writer.pending("a") == []
+    assert writer.metrics()["failed_batches"] == 1 and writer.metrics()["dropped_messages"] == 2
+
+    # The conversation is not held behind the dropped rows
+    writer.add_messages(engine, messages, "a", rows("a", "next question"))
+
+    assert writer.flush(timeout=5)
+    writer.close()
+    assert stored(engine) == [("a", "next question")]
+
+def test_reads_see_pending_messages(engine):
+    writer = MessageWriter(flush_interval=0.5)
+    read = lambda: stored(engine, "a")
+
+    writer.add_messages(engine, messages, "a", rows("a", "question", "answer"))
+
+    # Still waiting for the batch to fill: the rows are either read or pending, never both nor neither
+    read_rows, pending = writer.read_with_pending("a", read)
+    assert len(read_rows) + len(pending) == 2
+    assert [row["message"] for row in pending] == ["question", "answer"][len(read_rows):]
+
+    assert writer.flush(timeout=5)
+    assert writer.read_with_pending("a", read) == ([("a", "question"), ("a", "answer")], [])
+    writer.close()
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+def test_forked_process_starts_its_own_writer(engine):
+    writer = MessageWriter(flush_interval=0.2)
+    writer.add_messages(engine, messages, "parent", rows("parent", "question"))
+
+    pid = os.fork()
+    if pid == 0:
+        # The writer thread of the parent does not exist here, the child's messages are written by a thread of its own
+        written = False
+        try:
+            writer.add_messages(engine, messages, "child", rows("child", "question"))
+            written = writer.flush(timeout=5)
+            writer.close()
+        finally:
+            os._exit(0 if written else 1)
+
+    _, status = os.waitpid(pid, 0)
+
+    assert os.WEXITSTATUS(status) == 0
+    assert writer.flush(timeout=5)
+    writer.close()
+
+    # The parent's queued messages are written once, by the parent
+    assert sorted(stored(engine)) == [("child", "question"), ("parent", "question")]
@@ -1,15 +1,26 @@
+import os
+
 from langchain_postgres import PGVector
 
-def build_pg_vector_store(embeddings_model, collection_name, connection_uri):
+# Collection served by the knowledge base search, until KNOWLEDGE_BASE_COLLECTION is set
+DEFAULT_COLLECTION_NAME = "2024-09-02 00:44:49"
+
+def knowledge_base_collection_name():
+    '''
+    Name of the PGVector collection holding the knowledge base, read from KNOWLEDGE_BASE_COLLECTION (see preprocessing/load_docs.py)
+    '''
+    return os.getenv('KNOWLEDGE_BASE_COLLECTION', DEFAULT_COLLECTION_NAME)
+
+def build_pg_vector_store(embeddings_model, collection_name, connection):
     '''
-    Builds and returns an instance of a PGVector store given an embeddings model, db collection name and db connection url.
+    Builds and returns an instance of a PGVector store given an embeddings model, db collection name and db connection url (or SQLAlchemy engine).
 
     Built instance can be used for semantic search and retrieval functionality
     '''
     vector_store = PGVector(
         embeddings=embeddings_model,
         collection_name=collection_name,
-        connection=connection_uri,
+        connection=connection,
         use_jsonb=True,
     )
 